@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the in-process tarball builder against `ansible-galaxy collection build`.
+
+Usage:
+python benchmarks/bench_build.py [--collections-dir DIR] [--limit N] [--repeat N]
+
+The subprocess path needs ansible-galaxy in PATH and writes galaxy.yml into every collection,
+so run it against a writable copy of the collections tree.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts"))
+
+from collection_inventory import scan_inventory  # noqa: E402
+from exports_collections import COLLECTIONS_DIR, build_collection, convert_manifest_to_galaxy, find_collections  # noqa: E402
+from galaxy_builder import build_collection_tarball  # noqa: E402
+
+
+def bench_native(collections_dir: str, collection_paths: list, output_dir: str) -> float:
+    start = time.perf_counter()
+    for collection_path in collection_paths:
+        build_collection_tarball(os.path.join(collections_dir, collection_path), output_dir)
+    return time.perf_counter() - start
+
+
+def bench_subprocess(collections_dir: str, collection_paths: list, output_dir: str) -> float:
+    for collection_path in collection_paths:
+        full_collection_path = os.path.join(collections_dir, collection_path)
+        convert_manifest_to_galaxy(os.path.join(full_collection_path, 'MANIFEST.json'),
+                                   os.path.join(full_collection_path, 'galaxy.yml'))
+
+    start = time.perf_counter()
+    for collection_path in collection_paths:
+        build_collection(collections_dir, collection_path, output_dir)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--collections-dir", default=COLLECTIONS_DIR)
+    parser.add_argument("--limit", type=int, default=0, help="Only build the first N collections")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per builder, the best one is reported")
+    parser.add_argument("--skip-subprocess", action="store_true", help="Only measure the native builder")
+    args = parser.parse_args()
+
+    collection_paths = [entry["relpath"] for entry in find_collections(scan_inventory(args.collections_dir))]
+    if args.limit:
+        collection_paths = collection_paths[:args.limit]
+
+    builders = [("native", bench_native)]
+    if not args.skip_subprocess:
+        builders.append(("ansible-galaxy", bench_subprocess))
+
+    print(f"Collections: {len(collection_paths)}, runs per builder: {args.repeat}")
+    for name, bench in builders:
+        timings = []
+        for _ in range(args.repeat):
+            output_dir = tempfile.mkdtemp(prefix="bench-build-")
+            try:
+                timings.append(bench(args.collections_dir, collection_paths, output_dir))
+            finally:
+                shutil.rmtree(output_dir)
+        best = min(timings)
+        per_collection = best / len(collection_paths) * 1000 if collection_paths else 0.0
+        print(f"{name:<15} best {best:8.3f}s  {per_collection:8.1f} ms/collection")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of `ansible-galaxy collection build` on warm workers against one process per collection.
+
+Usage:
+python benchmarks/bench_galaxy_workers.py [--collections-dir DIR] [--limit N] [--repeat N] [--workers N]
+
+Needs ansible-galaxy in PATH and ansible importable by this interpreter, and writes galaxy.yml into
+every collection, so run it against a writable copy of the collections tree. Besides the per-collection
+time of both paths it checks that every build of every run gives the same exit code, output (warnings
+included) and tarball contents.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts"))
+
+from collection_inventory import scan_inventory  # noqa: E402
+from exports_collections import COLLECTIONS_DIR, convert_manifest_to_galaxy, find_collections  # noqa: E402
+from galaxy_workers import PROG, GalaxyWorkerPool  # noqa: E402
+
+
+def build_args(collections_dir: str, collection_path: str, output_dir: str) -> list:
+    return ["collection", "build", "-c", os.path.join(collections_dir, collection_path), "--output-path", output_dir]
+
+
+def run_builds(run, collections_dir: str, collection_paths: list, output_dir: str, workers: int) -> tuple:
+    """
+    :return: The wall time and the normalised (exit code, stdout, stderr) of every build.
+    """
+    def build(collection_path: str) -> tuple:
+        process = run(build_args(collections_dir, collection_path, output_dir))
+        return (process.returncode, process.stdout.replace(output_dir.encode(), b"<out>"),
+                process.stderr.replace(output_dir.encode(), b"<out>"))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outputs = list(executor.map(build, collection_paths))
+    return time.perf_counter() - start, outputs
+
+
+def tarball_contents(output_dir: str) -> dict:
+    contents = {}
+    for name in sorted(os.listdir(output_dir)):
+        with tarfile.open(os.path.join(output_dir, name)) as tar_file:
+            contents[name] = {member.name: tar_file.extractfile(member).read() if member.isfile() else member.type
+                              for member in tar_file.getmembers()}
+    return contents
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--collections-dir", default=COLLECTIONS_DIR)
+    parser.add_argument("--limit", type=int, default=0, help="Only build the first N collections")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per path, the best one is reported")
+    parser.add_argument("--workers", type=int, default=1, help="Concurrent builds (and warm workers)")
+    args = parser.parse_args()
+
+    collection_paths = [entry["relpath"] for entry in find_collections(scan_inventory(args.collections_dir))]
+    if args.limit:
+        collection_paths = collection_paths[:args.limit]
+    if not collection_paths:
+        sys.exit(f"No collections found in {args.collections_dir}")
+    for collection_path in collection_paths:
+        full_collection_path = os.path.join(args.collections_dir, collection_path)
+        convert_manifest_to_galaxy(os.path.join(full_collection_path, 'MANIFEST.json'),
+                                   os.path.join(full_collection_path, 'galaxy.yml'))
+
+    pool = GalaxyWorkerPool(args.workers, max_requests=len(collection_paths) * args.repeat + 1)
+    started = time.perf_counter()
+    if not pool.start():
+        sys.exit("Warm workers are not available, cannot compare")
+    startup = time.perf_counter() - started
+
+    paths = [("subprocess", lambda command: subprocess.run([PROG] + command, capture_output=True)),
+             ("warm workers", pool.run)]
+    print(f"Collections: {len(collection_paths)}, runs per path: {args.repeat}, concurrent builds: {args.workers}")
+    print(f"Worker start-up (paid once per run): {startup:.3f}s")
+    results = {}
+    try:
+        for name, run in paths:
+            timings = []
+            for _ in range(args.repeat):
+                output_dir = tempfile.mkdtemp(prefix="bench-galaxy-")
+                try:
+                    seconds, outputs = run_builds(run, args.collections_dir, collection_paths, output_dir, args.workers)
+                    timings.append(seconds)
+                    results.setdefault(name, []).append((outputs, tarball_contents(output_dir)))
+                finally:
+                    shutil.rmtree(output_dir)
+            best = min(timings)
+            per_collection = best / len(collection_paths) * 1000 if collection_paths else 0.0
+            print(f"{name:<15} best {best:8.3f}s  {per_collection:8.1f} ms/collection")
+    finally:
+        pool.close()
+
+    # Every run of a warm worker must match, not only its first command of each collection
+    expected = results["subprocess"][0]
+    differing = [result for result in results["subprocess"] + results["warm workers"] if result != expected]
+    if not differing:
+        print("Exit codes, output and tarball contents are identical in every run")
+    else:
+        print("Results differ between the subprocess and the warm workers")
+        (outputs, contents), (warm_outputs, warm_contents) = expected, differing[0]
+        for collection_path, output, warm_output in zip(collection_paths, outputs, warm_outputs):
+            if output != warm_output:
+                print(f"  {collection_path}: subprocess {output!r}")
+                print(f"  {' ' * len(collection_path)}  warm workers {warm_output!r}")
+        for name in sorted(set(contents) ^ set(warm_contents)):
+            print(f"  {name}: built by only one path")
+        for name in sorted(set(contents) & set(warm_contents)):
+            if contents[name] != warm_contents[name]:
+                print(f"  {name}: tarball contents differ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the scan / convert / build / publish stages of exports_collections.py.
+
+Runs against a synthetic collections tree (see synthetic_tree.py) and a local stand-in Galaxy server
+(see galaxy_standin.py), so neither root access nor a real server is needed. The ansible-galaxy
+builder and publisher use the stub in benchmarks/stub-bin unless --real-ansible-galaxy is given.
+Every stage reports wall time, throughput and peak RSS; build and publish are repeated for every
+--jobs value to compare the serial and parallel modes.
+
+Usage:
+python benchmarks/bench_pipeline.py [--tree DIR] [--namespaces N] [--collections M] [--files F]
+                                    [--jobs 1 4 ...] [--builder native|ansible-galaxy]
+                                    [--publisher native|ansible-galaxy] [--latency MS] [--import-polls N]
+                                    [--import-seconds S] [--no-wait] [--json FILE]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "scripts"))
+
+import exports_collections  # noqa: E402
+from collection_inventory import scan_inventory  # noqa: E402
+from exports_collections import GALAXY_YAML_OPTIONS, build_stage, manifest_to_galaxy_data, poll_imports  # noqa: E402
+from exports_collections import publish_stage  # noqa: E402
+from galaxy_standin import start_standin  # noqa: E402
+from galaxy_yaml import convert_batch  # noqa: E402
+from synthetic_tree import generate_tree  # noqa: E402
+
+STUB_BIN_DIR = os.path.join(BENCH_DIR, "stub-bin")
+MIB = 1024 * 1024
+
+
+def _reset_peak_rss() -> None:
+    """
+    Resets the peak RSS of this process (Linux 4.0+), so every stage reports its own peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mib() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(stage: str, func: Callable[[], Tuple[int, int]]) -> Dict[str, Any]:
+    """
+    Runs one stage and collects its metrics. The per-collection output of the scripts is discarded.
+
+    :param stage: Name of the stage.
+    :param func: Runs the stage and returns the number of collections and bytes it processed.
+    :return: A dict with the stage metrics.
+    """
+    _reset_peak_rss()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        items, nbytes = func()
+    seconds = time.perf_counter() - start
+    return {
+        "stage": stage,
+        "seconds": seconds,
+        "collections": items,
+        "collections_per_second": items / seconds if seconds else 0.0,
+        "mib": nbytes / MIB,
+        "mib_per_second": nbytes / MIB / seconds if seconds else 0.0,
+        "peak_rss_mib": _peak_rss_mib(),
+        # ru_maxrss of the children is the largest child so far, it is not reset between stages
+        "children_peak_rss_mib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def run_builds(collections_dir: str, entries: List[Dict[str, Any]], output_dir: str, jobs: int,
+               builder: str) -> List[Dict[str, str]]:
+    if jobs <= 1:
+        return [build_stage(collections_dir, entry["relpath"], output_dir, builder) for entry in entries]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=exports_collections._silence_worker) as executor:
+        futures = []
+        for entry in entries:
+            worker_output = os.path.join(output_dir, entry["fqcn"].replace('.', '-'))
+            os.makedirs(worker_output, exist_ok=True)
+            futures.append(executor.submit(build_stage, collections_dir, entry["relpath"], worker_output, builder))
+        return [future.result() for future in futures]
+
+
+def run_publishes(built: List[Dict[str, str]], jobs: int, publisher: str,
+                  wait: bool = True) -> List[Dict[str, str]]:
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        published = list(executor.map(lambda result: publish_stage(result, publisher, wait=wait), built))
+    if not wait:
+        poll_imports(published, workers=max(jobs, 1))
+    return published
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{'STAGE':<12} {'JOBS':>4} {'SECONDS':>9} {'COLL/S':>9} {'MIB':>9} {'MIB/S':>9} "
+          f"{'RSS MIB':>8} {'CHILD RSS':>9}")
+    for row in report["stages"]:
+        print(f"{row['stage']:<12} {row.get('jobs', '-'):>4} {row['seconds']:>9.3f} "
+              f"{row['collections_per_second']:>9.1f} {row['mib']:>9.1f} {row['mib_per_second']:>9.1f} "
+              f"{row['peak_rss_mib']:>8.1f} {row['children_peak_rss_mib']:>9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tree", help="Reuse or create the synthetic tree in DIR instead of a temporary directory")
+    parser.add_argument("--namespaces", type=int, default=10, help="Number of namespaces (default: 10)")
+    parser.add_argument("--collections", type=int, default=10, help="Collections per namespace (default: 10)")
+    parser.add_argument("--files", type=int, default=60, help="Median number of files per collection (default: 60)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the tree (default: 0)")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, os.cpu_count() or 1], metavar="N",
+                        help="Build processes and upload threads of every compared mode (default: 1 and CPU count)")
+    parser.add_argument("--builder", choices=("native", "ansible-galaxy"), default="native")
+    parser.add_argument("--publisher", choices=("native", "ansible-galaxy"), default="native")
+    parser.add_argument("--real-ansible-galaxy", action="store_true",
+                        help="Use ansible-galaxy from PATH instead of the stub")
+    parser.add_argument("--latency", type=float, default=0.0, metavar="MS",
+                        help="Latency of every stand-in server request in ms (default: 0)")
+    parser.add_argument("--import-polls", type=int, default=0, metavar="N",
+                        help="Polls every stand-in import task stays running, each costs the client's poll interval")
+    parser.add_argument("--import-seconds", type=float, default=0.0, metavar="S",
+                        help="Time every stand-in import task stays running after the upload (default: 0)")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="Upload without waiting for imports and poll all import tasks concurrently afterwards")
+    parser.add_argument("--json", metavar="FILE", help="Also write the report as JSON to FILE")
+    args = parser.parse_args()
+
+    if not args.real_ansible_galaxy:
+        os.environ["PATH"] = STUB_BIN_DIR + os.pathsep + os.environ.get("PATH", "")
+
+    work_dir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    tree_dir = args.tree or os.path.join(work_dir, "tree")
+    collections_dir = os.path.join(tree_dir, "ansible_collections")
+    report = {"config": vars(args), "stages": []}
+
+    try:
+        if not os.path.isdir(collections_dir):
+            summary = {}
+
+            def generate() -> Tuple[int, int]:
+                summary.update(generate_tree(tree_dir, args.namespaces, args.collections, args.files, args.seed))
+                return summary["collections"], summary["bytes"]
+
+            report["stages"].append(measure("generate", generate))
+
+        inventory = {}
+
+        def scan() -> Tuple[int, int]:
+            inventory["value"] = scan_inventory(collections_dir)
+            return len(inventory["value"]), sum(entry["manifest_size"] for entry in inventory["value"])
+
+        report["stages"].append(measure("scan", scan))
+        entries = inventory["value"].collections()
+        namespaces = {entry["namespace"] for entry in entries}
+
+        def convert() -> Tuple[int, int]:
+            files = [(entry["manifest_file"], os.path.join(entry["path"], 'galaxy.yml')) for entry in entries]
+            convert_batch(files, manifest_to_galaxy_data, **GALAXY_YAML_OPTIONS)
+            return len(files), sum(entry["manifest_size"] for entry in entries)
+
+        report["stages"].append(measure("convert", convert))
+
+        for jobs in args.jobs:
+            output_dir = os.path.join(work_dir, f"out-{jobs}")
+            os.makedirs(output_dir)
+            built = []
+
+            def build() -> Tuple[int, int]:
+                built.extend(run_builds(collections_dir, entries, output_dir, jobs, args.builder))
+                return len(built), sum(os.path.getsize(result["tarball"]) for result in built if result["tarball"])
+
+            report["stages"].append(dict(measure("build", build), jobs=jobs))
+
+            # A fresh server per mode, so every mode uploads every collection
+            standin = start_standin(args.latency / 1000, namespaces=namespaces, import_polls=args.import_polls,
+                                    import_seconds=args.import_seconds)
+            exports_collections.ANSIBLE_GALAXY_SERVER_GALAXY_URL = standin.url
+            exports_collections.ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN = "benchmark"
+            published = []
+            try:
+                def publish() -> Tuple[int, int]:
+                    published.extend(run_publishes(built, jobs, args.publisher, not args.no_wait))
+                    return len(published), standin.stats["uploaded_bytes"]
+
+                report["stages"].append(dict(measure("publish", publish), jobs=jobs,
+                                             connections=standin.stats["connections"]))
+            finally:
+                standin.stop()
+
+            statuses = {}
+            for result in published:
+                statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+            if set(statuses) - {"published"}:
+                print(f"Publish statuses with {jobs} jobs: {statuses}")
+            shutil.rmtree(output_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
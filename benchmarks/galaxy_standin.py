@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the Galaxy / Automation Hub API used by the pipeline benchmarks.
+
+Implements the parts of the v3 API the publish and mirror scripts talk to: API discovery, the
+paginated namespace, collection and version lists, version details, artifact upload and download
+(with Range requests) and import tasks. Uploads are kept in memory, so publishing the same version
+twice reports "already exists", and namespaces listed as missing are rejected like on a real server.
+An optional per-request latency emulates a remote server, a minimal import duration emulates slow
+server-side imports and dropped downloads emulate flaky connections.
+
+Usage:
+python benchmarks/galaxy_standin.py [--port PORT] [--latency MS] [--import-seconds S] [--missing-namespace NS ...]
+                                    [--artifact TARBALL ...] [--drop-downloads-after BYTES]
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import parse_qs, urlparse
+
+FILENAME_RE = re.compile(rb'filename="([^"]+)-([^-"]+)\.tar\.gz"')
+RANGE_RE = re.compile(r"bytes=(\d+)-$")
+
+
+class GalaxyStandIn:
+    """
+    Threaded HTTP server with the state of the stand-in Galaxy.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0, namespaces: Iterable[str] = (),
+                 missing_namespaces: Iterable[str] = (), import_polls: int = 0,
+                 import_seconds: float = 0.0, drop_downloads_after: int = 0) -> None:
+        """
+        :param port: Port to listen on, 0 picks a free one.
+        :param latency: Delay added to every request in seconds.
+        :param namespaces: Namespaces listed by the server before anything is uploaded.
+        :param missing_namespaces: Namespaces uploads are rejected for.
+        :param import_polls: Number of polls an import task stays "running", 0 completes imports at once.
+        :param import_seconds: Time an import task stays "running" after the upload.
+        :param drop_downloads_after: Close the connection after this many bytes of every download that
+                                     starts at the beginning of the artifact, 0 never drops; resumed
+                                     (Range) downloads are served completely.
+        """
+        self.latency = latency
+        self.namespaces = set(namespaces)
+        self.missing_namespaces = set(missing_namespaces)
+        self.import_polls = import_polls
+        self.import_seconds = import_seconds
+        self.drop_downloads_after = drop_downloads_after
+        self.collections = {}    # "<namespace>.<name>" -> set of versions
+        self.artifacts = {}      # filename -> tarball bytes
+        self.tasks = {}          # task id -> [remaining "running" polls, time the import finishes]
+        self.stats = {"requests": 0, "uploads": 0, "uploaded_bytes": 0, "connections": 0, "polls": 0,
+                      "downloads": 0, "downloaded_bytes": 0, "range_requests": 0}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count(1)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/api/"
+
+    def start(self) -> "GalaxyStandIn":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "GalaxyStandIn":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def upload(self, body: bytes) -> Dict[str, Any]:
+        match = FILENAME_RE.search(body[:4096])
+        if not match:
+            return {"code": 400, "body": {"errors": [{"code": "invalid", "detail": "No collection file."}]}}
+
+        namespace, _, name = match.group(1).decode().partition('-')
+        version = match.group(2).decode()
+        start = body.find(b"\r\n\r\n", match.end()) + 4
+        artifact = body[start:body.rfind(b"\r\n--")]
+        with self._lock:
+            self.stats["uploads"] += 1
+            self.stats["uploaded_bytes"] += len(body)
+            if namespace in self.missing_namespaces:
+                return {"code": 400, "body": {"errors": [{"code": "invalid",
+                                                          "detail": f'Namespace "{namespace}" does not exist.'}]}}
+            self.namespaces.add(namespace)
+            versions = self.collections.setdefault(f"{namespace}.{name}", set())
+            if version in versions:
+                return {"code": 400, "body": {"errors": [{"code": "invalid", "detail": "Artifact already exists."}]}}
+            versions.add(version)
+            self.artifacts[f"{namespace}-{name}-{version}.tar.gz"] = artifact
+            task_id = next(self._task_ids)
+            self.tasks[task_id] = [self.import_polls, time.monotonic() + self.import_seconds]
+        return {"code": 202, "body": {"task": f"/api/v3/imports/collections/{task_id}/"}}
+
+    def add_artifact(self, tarball: str) -> None:
+        """
+        Makes a collection tarball available as if it had been uploaded and imported.
+
+        :param tarball: Path of a <namespace>-<name>-<version>.tar.gz file.
+        """
+        filename = os.path.basename(tarball)
+        namespace, name, version = filename[:-len(".tar.gz")].split('-', 2)
+        with open(tarball, 'rb') as f:
+            artifact = f.read()
+        with self._lock:
+            self.namespaces.add(namespace)
+            self.collections.setdefault(f"{namespace}.{name}", set()).add(version)
+            self.artifacts[filename] = artifact
+
+    def version_detail(self, namespace: str, name: str, version: str) -> Optional[Dict[str, Any]]:
+        filename = f"{namespace}-{name}-{version}.tar.gz"
+        with self._lock:
+            artifact = self.artifacts.get(filename)
+        if artifact is None:
+            return None
+        return {"namespace": {"name": namespace}, "name": name, "version": version,
+                "download_url": f"{self.url}v3/artifacts/download/{filename}",
+                "artifact": {"filename": filename, "size": len(artifact),
+                             "sha256": hashlib.sha256(artifact).hexdigest()}}
+
+    def poll(self, task_id: int) -> Dict[str, Any]:
+        with self._lock:
+            self.stats["polls"] += 1
+            task = self.tasks.get(task_id, [0, 0.0])
+            running = task[0] > 0 or time.monotonic() < task[1]
+            task[0] = max(task[0] - 1, 0)
+        # ansible-galaxy keeps polling until finished_at is set, whatever the state says
+        if running:
+            return {"state": "running", "finished_at": None, "messages": []}
+        return {"state": "completed", "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "messages": []}
+
+    def _handler(self) -> type:
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def setup(self) -> None:
+                super().setup()
+                with standin._lock:
+                    standin.stats["connections"] += 1
+
+            def send_json(self, code: int, body: Any) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _begin(self) -> None:
+                with standin._lock:
+                    standin.stats["requests"] += 1
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+            @staticmethod
+            def page(items: list, query: Dict[str, list]) -> Dict[str, Any]:
+                limit = int(query.get("limit", ["10"])[0])
+                offset = int(query.get("offset", ["0"])[0])
+                return {"meta": {"count": len(items)}, "data": items[offset:offset + limit]}
+
+            def do_GET(self) -> None:
+                self._begin()
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                with standin._lock:
+                    collections = {key: sorted(value) for key, value in standin.collections.items()}
+                    namespaces = sorted(standin.namespaces)
+
+                match = re.search(r"/imports/collections/(\d+)/$", url.path)
+                if match:
+                    return self.send_json(200, standin.poll(int(match.group(1))))
+                match = re.search(r"/v3/artifacts/download/([^/]+)$", url.path)
+                if match:
+                    return self.send_artifact(match.group(1))
+                match = re.search(r"/v3/collections/([^/]+)/([^/]+)/versions/([^/]+)/$", url.path)
+                if match:
+                    detail = standin.version_detail(*match.groups())
+                    if detail is None:
+                        return self.send_json(404, {"errors": [{"code": "not_found", "detail": "Not found."}]})
+                    return self.send_json(200, detail)
+                match = re.search(r"/v3/collections/([^/]+)/([^/]+)/versions/$", url.path)
+                if match:
+                    versions = collections.get(f"{match.group(1)}.{match.group(2)}", [])
+                    return self.send_json(200, self.page([{"version": v} for v in versions], query))
+                if url.path.endswith("/v3/namespaces/"):
+                    return self.send_json(200, self.page([{"name": ns} for ns in namespaces], query))
+                if url.path.endswith("/v3/collections/"):
+                    items = [{"namespace": key.split('.')[0], "name": key.split('.')[1]} for key in sorted(collections)]
+                    return self.send_json(200, self.page(items, query))
+                self.send_json(200, {"available_versions": {"v3": "v3/"}})
+
+            def send_artifact(self, filename: str) -> None:
+                with standin._lock:
+                    artifact = standin.artifacts.get(filename)
+                if artifact is None:
+                    return self.send_json(404, {"errors": [{"code": "not_found", "detail": "Not found."}]})
+
+                match = RANGE_RE.match(self.headers.get("Range", ""))
+                start = int(match.group(1)) if match else 0
+                if start >= len(artifact) and artifact:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(artifact)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(206 if match else 200)
+                self.send_header("Content-Type", "application/gzip")
+                self.send_header("Content-Length", str(len(artifact) - start))
+                if match:
+                    self.send_header("Content-Range", f"bytes {start}-{len(artifact) - 1}/{len(artifact)}")
+                self.end_headers()
+
+                body = artifact[start:]
+                if standin.drop_downloads_after and start == 0:
+                    body = body[:standin.drop_downloads_after]
+                    self.close_connection = True
+                with standin._lock:
+                    standin.stats["downloads"] += 1
+                    standin.stats["downloaded_bytes"] += len(body)
+                    standin.stats["range_requests"] += 1 if match else 0
+                self.wfile.write(body)
+
+            def do_POST(self) -> None:
+                self._begin()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not urlparse(self.path).path.endswith("/artifacts/collections/"):
+                    return self.send_json(404, {"errors": [{"code": "not_found", "detail": "Not found."}]})
+                response = standin.upload(body)
+                self.send_json(response["code"], response["body"])
+
+        return Handler
+
+
+def start_standin(latency: float = 0.0, namespaces: Iterable[str] = (),
+                  missing_namespaces: Optional[Iterable[str]] = None, import_polls: int = 0,
+                  import_seconds: float = 0.0, artifacts: Iterable[str] = (),
+                  drop_downloads_after: int = 0) -> GalaxyStandIn:
+    """
+    Starts a stand-in server on a free port in a background thread.
+
+    :param latency: Delay added to every request in seconds.
+    :param namespaces: Namespaces that exist on the server up front.
+    :param missing_namespaces: Namespaces uploads are rejected for.
+    :param import_polls: Number of polls an import task stays "running".
+    :param import_seconds: Time an import task stays "running" after the upload.
+    :param artifacts: Collection tarballs the server offers for download up front.
+    :param drop_downloads_after: See GalaxyStandIn.
+    :return: The running server, stop it with stop().
+    """
+    standin = GalaxyStandIn(latency=latency, namespaces=namespaces, missing_namespaces=missing_namespaces or (),
+                            import_polls=import_polls, import_seconds=import_seconds,
+                            drop_downloads_after=drop_downloads_after)
+    for tarball in artifacts:
+        standin.add_artifact(tarball)
+    return standin.start()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, metavar="MS", help="Delay of every request in ms")
+    parser.add_argument("--namespace", action="append", default=[], metavar="NS",
+                        help="Namespace that exists on the server up front (repeatable)")
+    parser.add_argument("--import-polls", type=int, default=0, metavar="N",
+                        help="Number of polls an import task stays running (default: 0)")
+    parser.add_argument("--import-seconds", type=float, default=0.0, metavar="S",
+                        help="Time every import task stays running after the upload (default: 0)")
+    parser.add_argument("--missing-namespace", action="append", default=[], metavar="NS",
+                        help="Reject uploads to this namespace (repeatable)")
+    parser.add_argument("--artifact", action="append", default=[], metavar="TARBALL",
+                        help="Offer this collection tarball for download (repeatable)")
+    parser.add_argument("--drop-downloads-after", type=int, default=0, metavar="BYTES",
+                        help="Drop every download that does not resume after BYTES bytes (default: never)")
+    args = parser.parse_args()
+
+    standin = GalaxyStandIn(args.port, args.latency / 1000, args.namespace, args.missing_namespace, args.import_polls,
+                            args.import_seconds, args.drop_downloads_after)
+    for tarball in args.artifact:
+        standin.add_artifact(tarball)
+    print(f"Serving the stand-in Galaxy API at {standin.url}")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Generator of a synthetic installed collections tree for the pipeline benchmarks.
+
+Fabricates N namespaces x M collections laid out like /usr/share/ansible/collections/ansible_collections:
+every collection gets plugins, roles, docs and tests with log-normally distributed file counts and
+sizes, a FILES.json with real sha256 checksums and a MANIFEST.json as written by ansible-galaxy.
+Some collections are tagged for the certified repository and some depend on collections of earlier
+namespaces, so the publish plan has more than one repository and more than one dependency wave.
+
+Usage:
+python benchmarks/synthetic_tree.py OUTPUT_DIR [--namespaces N] [--collections M] [--files F] [--seed S]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+from typing import Any, Dict, List
+
+DIRECTORIES = (
+    "plugins/modules", "plugins/module_utils", "plugins/filter", "plugins/lookup",
+    "roles/main/tasks", "roles/main/defaults", "docs", "tests/unit", "tests/integration/targets",
+)
+EXTENSIONS = {"plugins": ".py", "roles": ".yml", "docs": ".md", "tests": ".py"}
+
+WORDS = ("def", "return", "module", "self", "ansible", "collection", "import", "name", "state", "present",
+         "absent", "description", "options", "type", "str", "required", "false", "true", "default",
+         "elements", "list", "dict", "result", "changed", "params", "argument_spec", "fail_json", "exit_json")
+
+MAX_FILE_SIZE = 2 * 1024 * 1024
+
+
+def make_corpus(rng: random.Random, size: int = 4 * 1024 * 1024) -> bytes:
+    """
+    Builds source-like text that file contents are cut from, so the tarballs compress like real ones.
+    """
+    lines = []
+    length = 0
+    while length < size:
+        indent = "    " * rng.randint(0, 3)
+        line = indent + " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode()
+
+
+def _file_entry(name: str, ftype: str, checksum: str = None) -> Dict[str, Any]:
+    return {"name": name, "ftype": ftype, "chksum_type": "sha256" if checksum else None,
+            "chksum_sha256": checksum, "format": 1}
+
+
+def write_collection(collection_dir: str, namespace: str, name: str, rng: random.Random, corpus: bytes,
+                     files: int, dependencies: Dict[str, str], tags: List[str]) -> Dict[str, int]:
+    """
+    Writes one collection with its FILES.json and MANIFEST.json.
+
+    :param collection_dir: Directory of the collection.
+    :param namespace: Namespace of the collection.
+    :param name: Name of the collection.
+    :param rng: Random generator of the tree.
+    :param corpus: Text the file contents are cut from.
+    :param files: Median number of files.
+    :param dependencies: collection_info.dependencies.
+    :param tags: collection_info.tags.
+    :return: The number of files and bytes written.
+    """
+    count = max(3, int(rng.lognormvariate(0, 0.6) * files))
+    entries = {".": _file_entry(".", "dir")}
+    total = 0
+
+    for index in range(count):
+        directory = rng.choice(DIRECTORIES)
+        extension = EXTENSIONS[directory.split('/', 1)[0]]
+        relpath = f"{directory}/file_{index:05d}{extension}"
+        size = min(MAX_FILE_SIZE, int(rng.lognormvariate(7.6, 1.4)))
+        offset = rng.randrange(0, len(corpus) - size) if size < len(corpus) else 0
+        data = corpus[offset:offset + size]
+
+        path = os.path.join(collection_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        total += len(data)
+
+        parts = directory.split('/')
+        for depth in range(1, len(parts) + 1):
+            parent = '/'.join(parts[:depth])
+            entries.setdefault(parent, _file_entry(parent, "dir"))
+        entries[relpath] = _file_entry(relpath, "file", hashlib.sha256(data).hexdigest())
+
+    readme = f"# {namespace}.{name}\n\nSynthetic collection for benchmarks.\n".encode()
+    with open(os.path.join(collection_dir, "README.md"), 'wb') as f:
+        f.write(readme)
+    entries["README.md"] = _file_entry("README.md", "file", hashlib.sha256(readme).hexdigest())
+
+    files_json = json.dumps({"files": [entries[key] for key in sorted(entries)], "format": 1}).encode()
+    with open(os.path.join(collection_dir, "FILES.json"), 'wb') as f:
+        f.write(files_json)
+
+    manifest = {
+        "collection_info": {
+            "namespace": namespace,
+            "name": name,
+            "version": f"1.{rng.randint(0, 9)}.{rng.randint(0, 20)}",
+            "authors": ["Benchmark Author <bench@example.com>"],
+            "readme": "README.md",
+            "tags": tags,
+            "description": f"Synthetic collection {namespace}.{name}",
+            "license": ["GPL-3.0-or-later"],
+            "license_file": None,
+            "dependencies": dependencies,
+            "repository": f"https://example.com/{namespace}/{name}",
+            "documentation": None,
+            "homepage": None,
+            "issues": None,
+        },
+        "file_manifest_file": {
+            "name": "FILES.json",
+            "ftype": "file",
+            "chksum_type": "sha256",
+            "chksum_sha256": hashlib.sha256(files_json).hexdigest(),
+            "format": 1,
+        },
+        "format": 1,
+    }
+    with open(os.path.join(collection_dir, "MANIFEST.json"), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    return {"files": count + 1, "bytes": total + len(readme)}
+
+
+def generate_tree(output_dir: str, namespaces: int = 10, collections: int = 10, files: int = 60,
+                  seed: int = 0, certified_ratio: float = 0.1, dependency_ratio: float = 0.2) -> Dict[str, Any]:
+    """
+    Generates a synthetic ansible_collections tree.
+
+    :param output_dir: Directory the ansible_collections tree is created in.
+    :param namespaces: Number of namespaces.
+    :param collections: Number of collections per namespace.
+    :param files: Median number of files per collection.
+    :param seed: Seed of the random generator, the same seed produces the same tree.
+    :param certified_ratio: Share of collections tagged for the certified repository.
+    :param dependency_ratio: Share of collections that depend on a collection of an earlier namespace.
+    :return: A dict with the collections_dir and the number of collections, files and bytes.
+    """
+    rng = random.Random(seed)
+    corpus = make_corpus(rng)
+    collections_dir = os.path.join(output_dir, "ansible_collections")
+    summary = {"collections_dir": collections_dir, "collections": 0, "files": 0, "bytes": 0}
+
+    for ns_index in range(namespaces):
+        namespace = f"bench_ns{ns_index:03d}"
+        for name_index in range(collections):
+            name = f"coll{name_index:03d}"
+            dependencies = {}
+            if ns_index and rng.random() < dependency_ratio:
+                dependency = f"bench_ns{rng.randrange(ns_index):03d}.coll{rng.randrange(collections):03d}"
+                dependencies[dependency] = ">=1.0.0"
+            tags = ["aacertified"] if rng.random() < certified_ratio else ["benchmark"]
+
+            collection_dir = os.path.join(collections_dir, namespace, name)
+            os.makedirs(collection_dir, exist_ok=True)
+            written = write_collection(collection_dir, namespace, name, rng, corpus, files, dependencies, tags)
+            summary["collections"] += 1
+            summary["files"] += written["files"]
+            summary["bytes"] += written["bytes"]
+
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output_dir", help="Directory the ansible_collections tree is created in")
+    parser.add_argument("--namespaces", type=int, default=10, help="Number of namespaces (default: 10)")
+    parser.add_argument("--collections", type=int, default=10, help="Collections per namespace (default: 10)")
+    parser.add_argument("--files", type=int, default=60, help="Median number of files per collection (default: 60)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    summary = generate_tree(args.output_dir, args.namespaces, args.collections, args.files, args.seed)
+    print(f"Generated {summary['collections']} collections, {summary['files']} files, "
+          f"{summary['bytes'] / 1024 / 1024:.1f} MiB in {summary['collections_dir']}")
+
+
+if __name__ == "__main__":
+    main()
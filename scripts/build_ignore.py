@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Generated build_ignore lists for galaxy.yml.
+
+Installed collections often carry tests, docs, CI configuration, caches and changelog fragments that
+are not needed where the collection is installed from Galaxy. A policy names categories of such
+content (and extra patterns); every collection is analyzed against its FILES.json and only the patterns
+that match something are written into build_ignore, so the tarballs get smaller and the builds and
+uploads cheaper. A pattern that would drop a file the collection needs (README, license, meta/) is
+not used for that collection.
+
+Patterns follow ansible-galaxy: fnmatch patterns matched against the path relative to the collection
+root, a matching directory excludes everything below it.
+
+A policy file is YAML, for example:
+
+    categories: [tests, docs, ci, caches, changelog-fragments]
+    patterns: [extensions/molecule]
+    keep: [docs/docsite/extra-docs.yml]
+
+Usage:
+python build_ignore.py [--collections-dir DIR] [--policy FILE] [--top N]
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import yaml
+
+from collection_inventory import scan_inventory
+
+# Content an installed collection does not need at runtime, as build_ignore patterns per category
+IGNORE_CATEGORIES = {
+    "tests": ["tests"],
+    "docs": ["docs"],
+    "ci": [".github", ".gitlab-ci.yml", ".azure-pipelines", ".circleci", ".travis.yml", ".zuul.yaml", ".zuul.d",
+           "codecov.yml", ".pre-commit-config.yaml"],
+    "caches": ["__pycache__", "*/__pycache__", "*.pyc", ".pytest_cache", ".mypy_cache", ".tox", ".cache"],
+    "changelog-fragments": ["changelogs/fragments"],
+    "dev-files": [".gitignore", ".gitattributes", ".yamllint", ".ansible-lint", ".flake8", "tox.ini", "noxfile.py",
+                  "requirements-dev.txt", "test-requirements.txt"],
+}
+
+DEFAULT_POLICY = {"categories": ["tests", "docs", "ci", "caches", "changelog-fragments"], "patterns": [], "keep": []}
+
+# Files that are never ignored, besides the readme and license_file of collection_info
+ALWAYS_KEEP = ["MANIFEST.json", "FILES.json", "README*", "LICENSE*", "COPYING*", "meta", "meta/*"]
+
+
+def load_ignore_policy(policy_file: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    :param policy_file: Path of a YAML policy file, None for DEFAULT_POLICY.
+    :return: The policy with "patterns" (in order, the categories expanded) and "keep".
+    :raises ValueError: When the file names an unknown category or is not a mapping.
+    """
+    policy = DEFAULT_POLICY
+    if policy_file:
+        with open(policy_file, 'r', encoding='utf-8') as f:
+            policy = yaml.safe_load(f) or {}
+        if not isinstance(policy, dict):
+            raise ValueError(f"{policy_file}: expected a mapping with categories, patterns and keep")
+
+    unknown = [category for category in policy.get("categories") or () if category not in IGNORE_CATEGORIES]
+    if unknown:
+        raise ValueError(f"unknown build_ignore categories: {', '.join(unknown)} "
+                         f"(known: {', '.join(IGNORE_CATEGORIES)})")
+
+    patterns = []
+    for category in policy.get("categories") or ():
+        patterns.extend(IGNORE_CATEGORIES[category])
+    patterns.extend(str(pattern) for pattern in policy.get("patterns") or ())
+    return {"patterns": list(dict.fromkeys(patterns)), "keep": [str(pattern) for pattern in policy.get("keep") or ()]}
+
+
+def matching_pattern(name: str, patterns: Iterable[str]) -> Optional[str]:
+    """
+    :param name: Path relative to the collection root, as in FILES.json.
+    :param patterns: build_ignore patterns.
+    :return: The first pattern that matches the path or one of its parent directories, None when it is kept.
+    """
+    parts = name.split('/')
+    prefixes = ['/'.join(parts[:index]) for index in range(1, len(parts) + 1)]
+    for pattern in patterns:
+        if any(fnmatch.fnmatch(prefix, pattern) for prefix in prefixes):
+            return pattern
+    return None
+
+
+def analyze_build_ignore(collection_dir: str, policy: Dict[str, List[str]],
+                         collection_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Finds the patterns of a policy that apply to a collection and the bytes they save.
+
+    :param collection_dir: Path to the installed collection.
+    :param policy: A policy returned by load_ignore_policy.
+    :param collection_info: Collection metadata; its readme and license_file are never ignored.
+    :return: A dict with the applicable "patterns" in policy order, "ignored_files", "ignored_bytes",
+             the bytes per pattern in "by_pattern" and the patterns left out in "skipped".
+    """
+    with open(os.path.join(collection_dir, 'FILES.json'), 'r', encoding='utf-8') as f:
+        files = json.load(f)["files"]
+
+    keep = ALWAYS_KEEP + policy["keep"]
+    for key in ("readme", "license_file"):
+        if collection_info and collection_info.get(key):
+            keep.append(collection_info[key])
+
+    matched = {}   # pattern -> names of the files and directories it ignores
+    for entry in files:
+        if entry["name"] in (".", ""):
+            continue
+        pattern = matching_pattern(entry["name"], policy["patterns"])
+        if pattern is not None:
+            matched.setdefault(pattern, []).append(entry)
+
+    report = {"patterns": [], "ignored_files": 0, "ignored_bytes": 0, "by_pattern": {}, "skipped": []}
+    for pattern in policy["patterns"]:
+        if pattern not in matched:
+            continue
+        if any(matching_pattern(entry["name"], keep) for entry in matched[pattern]):
+            report["skipped"].append(pattern)
+            continue
+
+        size = 0
+        for entry in matched[pattern]:
+            if entry.get("ftype") == "file":
+                report["ignored_files"] += 1
+                try:
+                    size += os.lstat(os.path.join(collection_dir, entry["name"])).st_size
+                except OSError:
+                    pass
+        report["patterns"].append(pattern)
+        report["by_pattern"][pattern] = size
+        report["ignored_bytes"] += size
+    return report
+
+
+def apply_build_ignore(galaxy_data: Dict[str, Any], collection_dir: str,
+                       policy: Dict[str, List[str]]) -> Dict[str, Any]:
+    """
+    Sets build_ignore of the galaxy.yml data of a collection from a policy, keeping patterns the
+    collection already ignores.
+
+    :param galaxy_data: The galaxy.yml data, changed in place.
+    :param collection_dir: Path to the installed collection.
+    :param policy: A policy returned by load_ignore_policy.
+    :return: The report of analyze_build_ignore.
+    """
+    report = analyze_build_ignore(collection_dir, policy, galaxy_data)
+    patterns = list(dict.fromkeys(list(galaxy_data.get("build_ignore") or ()) + report["patterns"]))
+    if patterns:
+        galaxy_data["build_ignore"] = patterns
+    return report
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def print_ignore_report(reports: Dict[str, Dict[str, Any]], top: int = 20) -> None:
+    """
+    Prints the collections ranked by the bytes their build_ignore saves.
+
+    :param reports: A collection to analyze_build_ignore report mapping.
+    :param top: Number of collections to list.
+    """
+    ranked = sorted((item for item in reports.items() if item[1]["ignored_bytes"]),
+                    key=lambda item: (-item[1]["ignored_bytes"], item[0]))
+    if not ranked:
+        print("\nbuild_ignore saves nothing on these collections")
+        return
+
+    width = max(len("COLLECTION"), *(len(collection) for collection, _ in ranked[:top]))
+    print(f"\n{'COLLECTION'.ljust(width)}  {'SAVED':>10}  {'FILES':>6}  PATTERNS")
+    for collection, report in ranked[:top]:
+        patterns = ", ".join(f"{pattern} ({format_size(report['by_pattern'][pattern])})"
+                             for pattern in sorted(report["patterns"], key=lambda p: -report["by_pattern"][p]))
+        print(f"{collection.ljust(width)}  {format_size(report['ignored_bytes']):>10}  "
+              f"{report['ignored_files']:>6}  {patterns}")
+    if len(ranked) > top:
+        print(f"... and {len(ranked) - top} more collections")
+
+    total = sum(report["ignored_bytes"] for _, report in ranked)
+    files = sum(report["ignored_files"] for _, report in ranked)
+    print(f"build_ignore saves {format_size(total)} in {files} files across {len(ranked)} collections")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Report the bytes a build_ignore policy saves per collection.")
+    parser.add_argument("--collections-dir", default="/usr/share/ansible/collections/ansible_collections/",
+                        help="Path to the ansible_collections directory")
+    parser.add_argument("--policy", metavar="FILE", help="YAML policy file (default: the built-in policy)")
+    parser.add_argument("--top", type=int, default=20, help="Number of collections to list (default: 20)")
+    args = parser.parse_args()
+
+    policy = load_ignore_policy(args.policy)
+    reports = {}
+    for entry in scan_inventory(args.collections_dir):
+        try:
+            with open(entry["manifest_file"], 'r', encoding='utf-8') as f:
+                collection_info = json.load(f).get("collection_info", {})
+            reports[entry["fqcn"]] = analyze_build_ignore(entry["path"], policy, collection_info)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Skipping {entry['fqcn']}: {e}")
+    print_ignore_report(reports, args.top)
+
+
+if __name__ == "__main__":
+    main()
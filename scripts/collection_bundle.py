@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Indexed bundles of built collection tarballs for bulk transfer to disconnected sites.
+
+A bundle is one file: an 8 byte magic, the collection tarballs back to back, a JSON index and a
+fixed-size trailer with the offset and length of the index. Every index entry names a collection
+(namespace, name, version, dependencies and tags from its MANIFEST.json) and the offset, length and
+sha256 of its tarball. Readers memory-map the bundle, read the trailer and the index from the end and
+then reach any collection by its offset, so extracting or uploading one collection does not read
+the others; uploads stream straight from the mapped slice.
+
+Usage:
+python collection_bundle.py create BUNDLE TARBALL|DIR ...
+python collection_bundle.py list BUNDLE
+python collection_bundle.py verify BUNDLE
+python collection_bundle.py extract BUNDLE <namespace>.<name>[:<version>] ... [--output-dir DIR]
+python collection_bundle.py publish BUNDLE [<namespace>.<name>[:<version>] ...] [--targets FILE | --publish-url URL]
+                                         [--jobs N]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tarfile
+from typing import Any, Dict, Iterable, List, Optional
+
+from galaxy_client import CHUNK_SIZE
+
+BUNDLE_MAGIC = b"ACBNDL01"
+BUNDLE_FORMAT = 1
+# Offset and length of the index, then the magic again
+TRAILER = struct.Struct("<QQ8s")
+
+
+def read_manifest_info(collection_tar: str) -> Dict[str, Any]:
+    """
+    :param collection_tar: Path to a collection tarball.
+    :return: The collection_info of its MANIFEST.json, which builds write as the first member.
+    :raises ValueError: When the tarball has no MANIFEST.json.
+    """
+    with tarfile.open(collection_tar, "r|gz") as tar:
+        for member in tar:
+            if member.name == "MANIFEST.json" and member.isfile():
+                return json.load(tar.extractfile(member))["collection_info"]
+    raise ValueError(f"{collection_tar} has no MANIFEST.json")
+
+
+def write_bundle(bundle_file: str, tarballs: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Packs collection tarballs into a bundle, replacing bundle_file atomically.
+
+    :param bundle_file: Path of the bundle.
+    :param tarballs: Paths of built collection tarballs.
+    :return: The index entries.
+    :raises ValueError: When a tarball is not a collection or a collection version is given twice.
+    """
+    members = []
+    seen = set()
+    tmp_file = f"{bundle_file}.tmp"
+    try:
+        with open(tmp_file, 'wb') as out:
+            out.write(BUNDLE_MAGIC)
+            for collection_tar in tarballs:
+                info = read_manifest_info(collection_tar)
+                key = (f"{info['namespace']}.{info['name']}", info["version"])
+                if key in seen:
+                    raise ValueError(f"{key[0]} {key[1]} is given twice ({collection_tar})")
+                seen.add(key)
+
+                offset = out.tell()
+                digest = hashlib.sha256()
+                with open(collection_tar, 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                        out.write(chunk)
+                members.append({"collection": key[0], "namespace": info["namespace"], "name": info["name"],
+                                "version": info["version"], "dependencies": info.get("dependencies") or {},
+                                "tags": info.get("tags") or [], "filename": os.path.basename(collection_tar),
+                                "offset": offset, "length": out.tell() - offset, "sha256": digest.hexdigest()})
+
+            index = json.dumps({"format": BUNDLE_FORMAT, "collections": members}, sort_keys=True).encode()
+            index_offset = out.tell()
+            out.write(index)
+            out.write(TRAILER.pack(index_offset, len(index), BUNDLE_MAGIC))
+        os.replace(tmp_file, bundle_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return members
+
+
+def is_bundle(path: str) -> bool:
+    """
+    :return: True when path is a collection bundle, not a single tarball.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+    except OSError:
+        return False
+
+
+class CollectionBundle:
+    """
+    Memory-mapped reader of a bundle written by write_bundle.
+    """
+
+    def __init__(self, bundle_file: str) -> None:
+        """
+        :param bundle_file: Path of the bundle.
+        :raises ValueError: When the file is not a bundle or its index is damaged.
+        """
+        self.bundle_file = bundle_file
+        with open(bundle_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(BUNDLE_MAGIC) + TRAILER.size:
+                raise ValueError(f"{bundle_file} is not a collection bundle")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index_offset, index_length, magic = TRAILER.unpack(self._mmap[-TRAILER.size:])
+        if self._mmap[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC or magic != BUNDLE_MAGIC \
+                or index_offset + index_length + TRAILER.size != size:
+            self.close()
+            raise ValueError(f"{bundle_file} is not a collection bundle or is truncated")
+        index = json.loads(self._mmap[index_offset:index_offset + index_length])
+        if index.get("format") != BUNDLE_FORMAT:
+            self.close()
+            raise ValueError(f"{bundle_file}: unsupported bundle format {index.get('format')}")
+        self.members = index["collections"]
+
+    def find(self, collection: str, version: Optional[str] = None) -> Dict[str, Any]:
+        """
+        :param collection: "<namespace>.<name>".
+        :param version: Version to find, the only (or last packed) version of the collection when None.
+        :return: The index entry.
+        :raises KeyError: When the bundle does not contain the collection version.
+        """
+        found = [member for member in self.members
+                 if member["collection"] == collection and version in (None, member["version"])]
+        if not found:
+            raise KeyError(f"{collection}{':' + version if version else ''} is not in {self.bundle_file}")
+        return found[-1]
+
+    def select(self, specs: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        :param specs: "<namespace>.<name>[:<version>]" specs, all members when None or empty.
+        :return: The index entries of the specs.
+        :raises KeyError: When a spec is not in the bundle.
+        """
+        if not specs:
+            return list(self.members)
+        return [self.find(*spec.split(":", 1)) for spec in specs]
+
+    def data(self, member: Dict[str, Any]) -> memoryview:
+        """
+        :param member: An index entry.
+        :return: The tarball bytes as a view of the mapping, without copying them.
+        """
+        return memoryview(self._mmap)[member["offset"]:member["offset"] + member["length"]]
+
+    def verify(self, member: Dict[str, Any]) -> bool:
+        """
+        :return: True when the tarball of an index entry matches its sha256.
+        """
+        with self.data(member) as view:
+            return hashlib.sha256(view).hexdigest() == member["sha256"]
+
+    def extract(self, member: Dict[str, Any], output_dir: str = ".", verify: bool = True) -> str:
+        """
+        Writes the tarball of one collection.
+
+        :param member: An index entry.
+        :param output_dir: Directory the tarball is written to.
+        :param verify: Check the sha256 first.
+        :return: The path of the tarball.
+        :raises ValueError: When the tarball does not match its sha256.
+        """
+        if verify and not self.verify(member):
+            raise ValueError(f"{member['filename']} in {self.bundle_file} does not match its sha256")
+        path = os.path.join(output_dir, member["filename"])
+        with self.data(member) as view, open(path, 'wb') as f:
+            for start in range(0, len(view), CHUNK_SIZE):
+                f.write(view[start:start + CHUNK_SIZE])
+        return path
+
+    def close(self) -> None:
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass    # views handed out are still in use, the mapping goes away with the last of them
+
+    def __enter__(self) -> "CollectionBundle":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def bundle_inputs(paths: Iterable[str]) -> List[str]:
+    """
+    :param paths: Tarballs and directories of tarballs.
+    :return: The tarballs, those of a directory sorted by name.
+    """
+    tarballs = []
+    for path in paths:
+        if os.path.isdir(path):
+            tarballs.extend(sorted(glob.glob(os.path.join(path, "*-*-*.tar.gz"))))
+        else:
+            tarballs.append(path)
+    return tarballs
+
+
+def print_members(members: List[Dict[str, Any]]) -> None:
+    width = max([len("COLLECTION")] + [len(member["collection"]) for member in members])
+    print(f"{'COLLECTION'.ljust(width)}  {'VERSION':<12} {'OFFSET':>12} {'SIZE':>10}  SHA256")
+    for member in members:
+        print(f"{member['collection'].ljust(width)}  {member['version']:<12} {member['offset']:>12} "
+              f"{member['length']:>10}  {member['sha256'][:16]}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create, inspect and publish indexed collection bundles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="Pack built collection tarballs into a bundle")
+    create.add_argument("bundle", metavar="BUNDLE")
+    create.add_argument("inputs", nargs="+", metavar="TARBALL|DIR")
+    commands.add_parser("list", help="List the collections of a bundle").add_argument("bundle", metavar="BUNDLE")
+    commands.add_parser("verify", help="Check every collection against its sha256").add_argument("bundle",
+                                                                                                   metavar="BUNDLE")
+    extract = commands.add_parser("extract", help="Write the tarballs of single collections")
+    extract.add_argument("bundle", metavar="BUNDLE")
+    extract.add_argument("specs", nargs="+", metavar="<namespace>.<name>[:<version>]")
+    extract.add_argument("--output-dir", default=".", help="Directory for the tarballs (default: current directory)")
+    publish = commands.add_parser("publish", help="Upload the collections of a bundle concurrently")
+    publish.add_argument("bundle", metavar="BUNDLE")
+    publish.add_argument("specs", nargs="*", metavar="<namespace>.<name>[:<version>]",
+                         help="Collections to upload (default: all)")
+    route = publish.add_mutually_exclusive_group()
+    route.add_argument("--targets", metavar="FILE",
+                       help="YAML file with the publish targets and routing rules, see exports_collections.py "
+                            "(default: the validated and aa-certified repositories of "
+                            "$ANSIBLE_GALAXY_SERVER_GALAXY_URL)")
+    route.add_argument("--publish-url", metavar="URL",
+                       help="Upload every collection to this repository URL instead of routing them by their tags")
+    publish.add_argument("--publisher", choices=("native", "ansible-galaxy"), default="native",
+                         help="Upload with the in-process Galaxy client (native) or `ansible-galaxy collection publish`")
+    publish.add_argument("--jobs", type=int, default=4, metavar="N", help="Concurrent uploads (default: 4)")
+    publish.add_argument("--retries", type=int, default=3, metavar="N",
+                         help="Retry an upload that failed transiently up to N times (default: 3)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            members = write_bundle(args.bundle, bundle_inputs(args.inputs))
+            print(f"Packed {len(members)} collections into {args.bundle} ({os.path.getsize(args.bundle)} bytes)")
+            return
+
+        if args.command == "publish":
+            import yaml
+            from exports_collections import publish_bundle
+            from publish_targets import load_targets
+            if not (args.targets or args.publish_url or os.getenv("ANSIBLE_GALAXY_SERVER_GALAXY_URL")):
+                parser.error("--targets, --publish-url or $ANSIBLE_GALAXY_SERVER_GALAXY_URL is required")
+            try:
+                targets = load_targets(args.targets) if args.targets else None
+            except yaml.YAMLError as e:
+                raise ValueError(f"invalid targets file {args.targets}: {e}")
+            statuses = publish_bundle(args.bundle, args.publish_url, publisher=args.publisher, jobs=args.jobs,
+                                      retries=args.retries, collections=args.specs, targets=targets)
+            if any(status not in ("published", "exists") for status in statuses.values()):
+                sys.exit(1)
+            return
+
+        with CollectionBundle(args.bundle) as bundle:
+            if args.command == "list":
+                print_members(bundle.members)
+            elif args.command == "verify":
+                damaged = [member for member in bundle.members if not bundle.verify(member)]
+                for member in damaged:
+                    print(f"{member['collection']} {member['version']}: sha256 mismatch")
+                print(f"{len(bundle.members) - len(damaged)} of {len(bundle.members)} collections are intact")
+                if damaged:
+                    sys.exit(1)
+            else:
+                for member in bundle.select(args.specs):
+                    print(f"Extracted {bundle.extract(member, args.output_dir)}")
+    except (OSError, ValueError, KeyError, tarfile.TarError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
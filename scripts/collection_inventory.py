@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Inventory of the installed collections tree.
+
+Walks ansible_collections once with os.scandir, reads every MANIFEST.json once and keeps an
+in-memory index of namespace, name, version, tags, dependencies and paths. The index can be
+persisted together with the directory and manifest mtimes, so a rerun only lists namespaces
+that changed and only re-reads manifests whose mtime or size changed.
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+INVENTORY_FORMAT = 1
+
+
+def _read_entry(namespace: str, name: str, path: str, manifest_stat: os.stat_result) -> Dict[str, Any]:
+    manifest_file = os.path.join(path, 'MANIFEST.json')
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest_data = json.load(f)
+    collection_info = manifest_data.get("collection_info", {})
+
+    return {
+        "fqcn": f"{namespace}.{name}",
+        "namespace": namespace,
+        "name": name,
+        "version": collection_info.get("version", ""),
+        "tags": collection_info.get("tags") or [],
+        "dependencies": collection_info.get("dependencies") or {},
+        "path": path,
+        "relpath": os.path.join(namespace, name),
+        "manifest_file": manifest_file,
+        "files_file": os.path.join(path, 'FILES.json'),
+        "manifest_mtime_ns": manifest_stat.st_mtime_ns,
+        "manifest_size": manifest_stat.st_size,
+    }
+
+
+class Inventory:
+    """
+    In-memory index of the collections installed under an ansible_collections directory.
+    """
+
+    def __init__(self, collections_dir: str) -> None:
+        self.collections_dir = collections_dir
+        self.entries = {}            # fqcn -> entry dict
+        self.missing_manifest = []   # collection directories without MANIFEST.json
+        self.errors = {}             # collection directory -> error reading its manifest
+        self._namespaces = {}        # namespace -> {"mtime_ns": ..., "collections": [...]}
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.collections())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, fqcn: str) -> Optional[Dict[str, Any]]:
+        """
+        :param fqcn: Collection name in <namespace>.<collection> format.
+        :return: The entry of the collection or None.
+        """
+        return self.entries.get(fqcn)
+
+    def collections(self, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        :param namespace: Return only the collections of this namespace.
+        :return: Entries sorted by namespace and name.
+        """
+        return [self.entries[fqcn] for fqcn in sorted(self.entries)
+                if namespace is None or self.entries[fqcn]["namespace"] == namespace]
+
+    def namespaces(self) -> List[str]:
+        return sorted(self._namespaces)
+
+    def scan(self, previous: Optional["Inventory"] = None) -> "Inventory":
+        """
+        Fills the index in a single os.scandir pass.
+
+        :param previous: An earlier inventory of the same tree; namespaces whose mtime is unchanged
+                         are not listed again and manifests whose mtime and size are unchanged are not re-read.
+        :return: self.
+        """
+        old_namespaces = previous._namespaces if previous else {}
+        old_entries = previous.entries if previous else {}
+
+        with os.scandir(self.collections_dir) as namespaces:
+            for namespace_entry in namespaces:
+                if namespace_entry.name.endswith('.info') or not namespace_entry.is_dir():
+                    continue
+
+                namespace = namespace_entry.name
+                mtime_ns = namespace_entry.stat().st_mtime_ns
+                old = old_namespaces.get(namespace)
+                if old and old["mtime_ns"] == mtime_ns:
+                    names = old["collections"]
+                else:
+                    with os.scandir(namespace_entry.path) as collections:
+                        names = sorted(entry.name for entry in collections if entry.is_dir())
+                self._namespaces[namespace] = {"mtime_ns": mtime_ns, "collections": names}
+
+                for name in names:
+                    self._add(namespace, name, old_entries.get(f"{namespace}.{name}"))
+        return self
+
+    def _add(self, namespace: str, name: str, old_entry: Optional[Dict[str, Any]]) -> None:
+        path = os.path.join(self.collections_dir, namespace, name)
+        try:
+            manifest_stat = os.stat(os.path.join(path, 'MANIFEST.json'))
+        except FileNotFoundError:
+            if os.path.isdir(path):
+                self.missing_manifest.append(path)
+            return
+
+        if (old_entry and old_entry["manifest_mtime_ns"] == manifest_stat.st_mtime_ns
+                and old_entry["manifest_size"] == manifest_stat.st_size):
+            self.entries[old_entry["fqcn"]] = old_entry
+            return
+
+        try:
+            entry = _read_entry(namespace, name, path, manifest_stat)
+        except (OSError, ValueError) as e:
+            self.errors[path] = str(e)
+            return
+        self.entries[entry["fqcn"]] = entry
+
+    def save(self, cache_file: str) -> None:
+        """
+        Persists the index with its mtimes.
+
+        :param cache_file: Path of the JSON cache file.
+        """
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "format": INVENTORY_FORMAT,
+                "collections_dir": self.collections_dir,
+                "namespaces": self._namespaces,
+                "entries": self.entries,
+            }, f)
+        os.replace(tmp_file, cache_file)
+
+    @classmethod
+    def load(cls, cache_file: str, collections_dir: str) -> Optional["Inventory"]:
+        """
+        Loads a persisted index of collections_dir.
+
+        :param cache_file: Path of the JSON cache file.
+        :param collections_dir: The tree the index must describe.
+        :return: The inventory or None when the cache is missing, stale in format or of another tree.
+        """
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get("format") != INVENTORY_FORMAT or data.get("collections_dir") != collections_dir:
+            return None
+
+        inventory = cls(collections_dir)
+        inventory._namespaces = data["namespaces"]
+        inventory.entries = data["entries"]
+        return inventory
+
+
+def scan_inventory(collections_dir: str, cache_file: Optional[str] = None) -> Inventory:
+    """
+    Builds the inventory of a collections tree, reusing and refreshing a persisted index when cache_file is given.
+
+    :param collections_dir: Path to the ansible_collections directory.
+    :param cache_file: Optional path of the persisted index.
+    :return: The inventory.
+    """
+    previous = Inventory.load(cache_file, collections_dir) if cache_file else None
+    inventory = Inventory(collections_dir).scan(previous)
+    if cache_file:
+        inventory.save(cache_file)
+    return inventory
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Deterministic sharding of a collections tree across build nodes.
+
+Every node runs `exports_collections.py --all --shard i/N` against the same collections tree and
+computes the same assignment without talking to the others. Collections are placed largest first on
+the shard their stable hash ranks highest (rendezvous hashing over sha256 of the name), unless that
+shard already holds more than its share of the total size; then the next shard in the collection's
+own ranking is used. Shards thus carry about the same number of bytes, and a collection only moves
+when the sizes around it change noticeably. Collections that depend on each other (directly or
+through other collections of the tree) are placed as one unit, so every dependency is built and
+published on the node of its dependents, in dependency order. The size of a collection is the size of the files listed
+in its FILES.json, so files written locally (galaxy.yml, caches) do not change the assignment.
+
+Each shard can write a JSON report with --report; the reports of all shards are merged with:
+python collection_shards.py report-1.json ... report-N.json [--output merged.json]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Share a shard may exceed the average load by before collections spill to their next shard
+DEFAULT_SLACK = 0.05
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    :param value: Shard in "i/N" format, 1 <= i <= N.
+    :return: The (index, count) pair.
+    :raises argparse.ArgumentTypeError: When the value is not a valid shard.
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 1 and {count}, got {index}")
+    return index, count
+
+
+def collection_weight(entry: Dict[str, Any]) -> int:
+    """
+    :param entry: Inventory entry of a collection.
+    :return: The total size of the files listed in its FILES.json in bytes, at least 1.
+    """
+    try:
+        with open(entry["files_file"], 'r', encoding='utf-8') as f:
+            files = json.load(f).get("files", [])
+    except (OSError, ValueError):
+        return 1
+
+    size = 0
+    for file_info in files:
+        if file_info.get("ftype") == "file":
+            try:
+                size += os.lstat(os.path.join(entry["path"], file_info["name"])).st_size
+            except OSError:
+                pass
+    return max(size, 1)
+
+
+def _rank(collection: str, count: int) -> List[int]:
+    # Rendezvous hashing: every shard gets a pseudo-random score per collection, highest first
+    scores = [(hashlib.sha256(f"{collection}/{shard}".encode()).digest(), shard) for shard in range(1, count + 1)]
+    return [shard for _, shard in sorted(scores, reverse=True)]
+
+
+def assign_shards(weights: Dict[str, int], count: int, slack: float = DEFAULT_SLACK) -> Dict[str, int]:
+    """
+    :param weights: Collection to size mapping.
+    :param count: Number of shards.
+    :param slack: Share a shard may exceed the average load by.
+    :return: A collection to shard (1..count) mapping.
+    """
+    capacity = max(sum(weights.values()) / count * (1 + slack), max(weights.values(), default=0))
+    loads = {shard: 0 for shard in range(1, count + 1)}
+    assignment = {}
+    for collection in sorted(weights, key=lambda name: (-weights[name], name)):
+        ranking = _rank(collection, count)
+        shard = next((shard for shard in ranking if loads[shard] + weights[collection] <= capacity),
+                     min(ranking, key=lambda shard: loads[shard]))
+        assignment[collection] = shard
+        loads[shard] += weights[collection]
+    return assignment
+
+
+def dependency_components(entries: Iterable[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Groups the collections connected by collection_info.dependencies; dependencies outside the
+    entries are ignored.
+
+    :param entries: Inventory entries of the collections.
+    :return: A collection to component mapping; a component is named by its smallest collection name.
+    """
+    entries = list(entries)
+    parent = {entry["fqcn"]: entry["fqcn"] for entry in entries}
+
+    def find(collection: str) -> str:
+        while parent[collection] != collection:
+            parent[collection] = parent[parent[collection]]
+            collection = parent[collection]
+        return collection
+
+    for entry in entries:
+        for dependency in entry.get("dependencies") or {}:
+            if dependency in parent:
+                first, second = sorted((find(entry["fqcn"]), find(dependency)))
+                parent[second] = first
+    return {collection: find(collection) for collection in parent}
+
+
+def tree_digest(entries: Iterable[Dict[str, Any]], weights: Dict[str, int]) -> str:
+    """
+    :return: A short digest of the collections, versions and sizes the assignment was computed from;
+             shards of one run must print the same digest.
+    """
+    digest = hashlib.sha256()
+    for entry in sorted(entries, key=lambda item: item["fqcn"]):
+        digest.update(f"{entry['fqcn']} {entry['version']} {weights[entry['fqcn']]}\n".encode())
+    return digest.hexdigest()[:12]
+
+
+def select_shard(entries: List[Dict[str, Any]], index: int, count: int,
+                 slack: float = DEFAULT_SLACK) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    :param entries: Inventory entries of all selected collections.
+    :param index: Shard of this node, 1..count.
+    :param count: Number of shards.
+    :param slack: Share a shard may exceed the average load by.
+    :return: The entries of the shard and a dict with the shard, its number of collections and size,
+             the sizes of all shards, the tree digest and the collections of the other shards.
+    """
+    weights = {entry["fqcn"]: collection_weight(entry) for entry in entries}
+    # A dependency and its dependents always land on the same shard
+    components = dependency_components(entries)
+    units = {}
+    for collection, component in components.items():
+        units[component] = units.get(component, 0) + weights[collection]
+    placed = assign_shards(units, count, slack)
+    assignment = {collection: placed[component] for collection, component in components.items()}
+    loads = [0] * count
+    for collection, shard in assignment.items():
+        loads[shard - 1] += weights[collection]
+
+    selected = [entry for entry in entries if assignment[entry["fqcn"]] == index]
+    info = {"shard": f"{index}/{count}", "collections": len(selected), "weight": loads[index - 1],
+            "loads": loads, "digest": tree_digest(entries, weights),
+            "others": sorted(collection for collection, shard in assignment.items() if shard != index)}
+    return selected, info
+
+
+def print_shard(info: Dict[str, Any]) -> None:
+    """
+    Prints the share of a shard and the tree digest.
+    """
+    total = sum(info["loads"]) or 1
+    print(f"Shard {info['shard']}: {info['collections']} collections, {info['weight'] / 1024 / 1024:.1f} MiB "
+          f"({info['weight'] / total:.0%} of the tree; shard sizes "
+          f"{', '.join(f'{load / 1024 / 1024:.1f}' for load in info['loads'])} MiB), tree digest {info['digest']}")
+
+
+def write_report(report_file: str, results: List[Dict[str, Any]], shard: Optional[Dict[str, Any]] = None,
+                 started: Optional[float] = None) -> None:
+    """
+    Writes the results of a run as a JSON report.
+
+    :param report_file: Path of the report.
+    :param results: Results of run_collections.
+    :param shard: Shard info of select_shard, None for an unsharded run.
+    :param started: time.time() of the start of the run.
+    """
+    report = {"shard": shard["shard"] if shard else None, "digest": shard["digest"] if shard else None,
+              "started": started, "finished": time.time(), "results": results}
+    tmp_file = f"{report_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, sort_keys=True, default=str)
+    os.replace(tmp_file, report_file)
+
+
+def merge_reports(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combines the reports of the shards of one run.
+
+    :param reports: Loaded reports written by write_report.
+    :return: A report with the results of all shards, the merged shards and the "problems" found:
+             missing or duplicate shards, differing tree digests and collections reported by several shards.
+    """
+    problems = []
+    shards = [report.get("shard") for report in reports]
+    counts = {int(shard.split("/")[1]) for shard in shards if shard}
+    if None in shards:
+        problems.append("a report was written by an unsharded run")
+    if len(counts) > 1:
+        problems.append(f"reports of different shard counts: {', '.join(map(str, sorted(counts)))}")
+    elif counts:
+        count = counts.pop()
+        present = [int(shard.split("/")[0]) for shard in shards if shard]
+        missing = sorted(set(range(1, count + 1)) - set(present))
+        duplicates = sorted({index for index in present if present.count(index) > 1})
+        if missing:
+            problems.append(f"missing shards: {', '.join(f'{index}/{count}' for index in missing)}")
+        if duplicates:
+            problems.append(f"duplicate shards: {', '.join(f'{index}/{count}' for index in duplicates)}")
+    digests = sorted({report.get("digest") for report in reports if report.get("digest")})
+    if len(digests) > 1:
+        problems.append(f"shards saw different collection trees (digests {', '.join(digests)})")
+
+    results = {}
+    for report in reports:
+        for result in report.get("results", []):
+            if result["collection"] in results:
+                problems.append(f"{result['collection']} was processed by more than one shard")
+            results[result["collection"]] = dict(result, shard=report.get("shard"))
+
+    started = [report["started"] for report in reports if report.get("started")]
+    return {"shards": sorted(shard for shard in shards if shard), "digest": digests[0] if len(digests) == 1 else None,
+            "started": min(started, default=None), "finished": max((report.get("finished") or 0 for report in reports),
+                                                                  default=None),
+            "problems": problems, "results": [results[name] for name in sorted(results)]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Merge the result reports of the shards of a run.")
+    parser.add_argument("reports", nargs="+", metavar="REPORT", help="Reports written with --report")
+    parser.add_argument("--output", metavar="FILE", help="Write the merged report to FILE")
+    args = parser.parse_args()
+
+    reports = []
+    for report_file in args.reports:
+        with open(report_file, 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+    merged = merge_reports(reports)
+
+    from exports_collections import print_summary
+    print_summary(merged["results"])
+    if merged["started"] and merged["finished"]:
+        print(f"Shards: {', '.join(merged['shards']) or 'none'}; wall time {merged['finished'] - merged['started']:.0f}s")
+    for problem in merged["problems"]:
+        print(f"Problem: {problem}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, indent=1, sort_keys=True)
+    if merged["problems"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Copy-free staging of installed collections into a writable tree.
+
+The staged tree mirrors the source directories as real (writable) directories while the files
+are reflinks, hardlinks or symlinks to the originals, so only galaxy.yml has to be written.
+Staging is idempotent: entries that already point at the right source are kept, changed ones
+are replaced and entries that disappeared from the source are removed. Every staged collection
+carries a marker file, and only marked collections are ever pruned, so a staging directory shared
+with other data is safe.
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+from typing import Dict, Iterable
+
+# ioctl(2) request code of FICLONE from linux/fs.h
+FICLONE = 0x40049409
+
+# Link modes tried in this order by the "auto" mode
+AUTO_MODES = ("reflink", "hardlink", "symlink")
+LINK_MODES = ("auto",) + AUTO_MODES + ("copy",)
+
+# Marker written into every staged collection; prune_collections removes only marked directories
+STAGED_MARKER = ".collection-staging"
+
+# Files that are generated in the staged tree instead of being linked
+GENERATED_FILES = ("galaxy.yml", STAGED_MARKER)
+
+TMPFS_DIR = "/dev/shm"
+
+
+def default_staging_dir(tmpfs: bool = False) -> str:
+    """
+    :param tmpfs: Place the staging tree on tmpfs (/dev/shm) when it is available.
+    :return: The directory for the staged ansible_collections tree.
+    """
+    base = TMPFS_DIR if tmpfs and os.path.isdir(TMPFS_DIR) else "/tmp"
+    return os.path.join(base, "ansible_collections")
+
+
+def _reflink(src: str, dst: str) -> None:
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _is_current(src: str, dst: str) -> bool:
+    """
+    Checks whether dst already stages src: a symlink to it, a hardlink of it,
+    or a reflink/copy with the same size and mtime.
+    """
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+
+    if os.path.islink(dst):
+        return os.readlink(dst) == src
+
+    src_stat = os.stat(src)
+    return os.path.samestat(dst_stat, src_stat) or (
+        dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+    )
+
+
+def _link_file(src: str, dst: str, mode: str) -> None:
+    if mode == "reflink":
+        _reflink(src, dst)
+    elif mode == "hardlink":
+        os.link(src, dst)
+    elif mode == "symlink":
+        os.symlink(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+class Stager:
+    """
+    Stages files with the first link mode that works on the given filesystems.
+    In "auto" mode a mode that fails once (for example a hardlink across filesystems
+    or to a file protected by fs.protected_hardlinks) is not tried again.
+    """
+
+    def __init__(self, mode: str = "auto") -> None:
+        if mode not in LINK_MODES:
+            raise ValueError(f"Unknown link mode {mode!r}, expected one of {', '.join(LINK_MODES)}")
+        self.modes = list(AUTO_MODES) if mode == "auto" else [mode]
+        self.stats = {"kept": 0, "linked": 0, "removed": 0}
+
+    @property
+    def mode(self) -> str:
+        """
+        The link mode currently in use.
+        """
+        return self.modes[0]
+
+    def stage_file(self, src: str, dst: str) -> None:
+        """
+        Stages a single file, keeping dst when it already points at src.
+
+        :param src: Source file.
+        :param dst: Path in the staged tree.
+        """
+        if _is_current(src, dst):
+            self.stats["kept"] += 1
+            return
+
+        if os.path.lexists(dst):
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                shutil.rmtree(dst)
+            else:
+                os.unlink(dst)
+
+        while True:
+            try:
+                _link_file(src, dst, self.modes[0])
+                break
+            except OSError as e:
+                if len(self.modes) == 1 or e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP,
+                                                          errno.EINVAL, errno.ENOTTY, errno.EACCES):
+                    raise
+                self.modes.pop(0)
+        self.stats["linked"] += 1
+
+    def stage_tree(self, src_dir: str, dst_dir: str, exclude: Iterable[str] = GENERATED_FILES) -> None:
+        """
+        Mirrors src_dir into dst_dir: real directories, linked files, stale entries removed.
+
+        :param src_dir: Installed collection directory.
+        :param dst_dir: Staged collection directory.
+        :param exclude: Top-level file names that are not staged because they are generated.
+        """
+        exclude = set(exclude)
+        os.makedirs(dst_dir, exist_ok=True)
+
+        for root, dirs, files in os.walk(src_dir):
+            rel_root = os.path.relpath(root, src_dir)
+            dst_root = dst_dir if rel_root == os.curdir else os.path.join(dst_dir, rel_root)
+            wanted = set(dirs) | set(files)
+            if rel_root == os.curdir:
+                wanted -= exclude
+
+            for name in dirs:
+                src_path = os.path.join(root, name)
+                dst_path = os.path.join(dst_root, name)
+                if os.path.islink(src_path):
+                    # os.walk does not descend into symlinked directories, keep them as symlinks
+                    target = os.readlink(src_path)
+                    if not (os.path.islink(dst_path) and os.readlink(dst_path) == target):
+                        if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+                            shutil.rmtree(dst_path)
+                        elif os.path.lexists(dst_path):
+                            os.unlink(dst_path)
+                        os.symlink(target, dst_path)
+                    continue
+                if os.path.islink(dst_path) or (os.path.lexists(dst_path) and not os.path.isdir(dst_path)):
+                    os.unlink(dst_path)
+                os.makedirs(dst_path, exist_ok=True)
+
+            for name in files:
+                if rel_root == os.curdir and name in exclude:
+                    continue
+                self.stage_file(os.path.join(root, name), os.path.join(dst_root, name))
+
+            with os.scandir(dst_root) as staged:
+                for entry in staged:
+                    if entry.name in wanted or (rel_root == os.curdir and entry.name in exclude):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                    self.stats["removed"] += 1
+
+    def stage_collection(self, src_dir: str, dst_dir: str) -> None:
+        """
+        Stages an installed collection and marks dst_dir as created by the stager.
+
+        :param src_dir: Installed collection directory.
+        :param dst_dir: Staged collection directory.
+        """
+        self.stage_tree(src_dir, dst_dir)
+        marker = os.path.join(dst_dir, STAGED_MARKER)
+        if not os.path.isfile(marker):
+            with open(marker, 'w') as f:
+                f.write(f"{src_dir}\n")
+
+
+def is_staged(path: str) -> bool:
+    """
+    :return: True when path is a collection directory written by Stager.stage_collection.
+    """
+    return os.path.isfile(os.path.join(path, STAGED_MARKER)) and not os.path.islink(path)
+
+
+def prune_collections(staging_dir: str, keep: Dict[str, Iterable[str]]) -> int:
+    """
+    Removes staged collections that are no longer installed, and namespaces left empty by that.
+    Only directories with the marker of Stager.stage_collection are removed; anything else in
+    staging_dir was not created by the stager and is left alone.
+
+    :param staging_dir: Root of the staged ansible_collections tree.
+    :param keep: Namespace to collection names mapping of the installed collections.
+    :return: Number of removed collection directories.
+    """
+    removed = 0
+    if not os.path.isdir(staging_dir):
+        return removed
+
+    for namespace in os.listdir(staging_dir):
+        namespace_path = os.path.join(staging_dir, namespace)
+        if not os.path.isdir(namespace_path) or os.path.islink(namespace_path):
+            continue
+        names = set(keep.get(namespace, ()))
+        for name in os.listdir(namespace_path):
+            collection_path = os.path.join(namespace_path, name)
+            if name not in names and is_staged(collection_path):
+                shutil.rmtree(collection_path, ignore_errors=True)
+                removed += 1
+        if not names:
+            try:
+                os.rmdir(namespace_path)
+            except OSError:
+                pass    # not empty: holds data the stager did not create
+    return removed
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Persistent state store for collection publishing.
+
+Every processed collection is recorded in a SQLite file keyed by server, namespace.name and version,
+together with a digest of its MANIFEST.json and FILES.json. A collection whose digest has not changed
+since it was last published successfully can be skipped before galaxy.yml is generated or a build starts.
+
+The same file keeps the build and publish durations and sizes of every collection across runs,
+which the scheduler uses to start the longest builds first.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+DEFAULT_STATE_FILE = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "ansible-collections-publish",
+    "state.sqlite"
+)
+
+# Statuses after which a collection with an unchanged digest does not have to be processed again
+DONE_STATUSES = ("published", "exists")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    server     TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    version    TEXT NOT NULL,
+    digest     TEXT NOT NULL,
+    status     TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (server, collection, version)
+)
+"""
+
+_DURATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS durations (
+    collection      TEXT PRIMARY KEY,
+    build_seconds   REAL,
+    publish_seconds REAL,
+    tarball_size    INTEGER,
+    source_size     INTEGER,
+    runs            INTEGER NOT NULL,
+    updated_at      REAL NOT NULL
+)
+"""
+
+# Weight of the newest run in the stored durations, damps one-off slow runs
+DURATION_WEIGHT = 0.5
+
+
+def build_state_key(server: str) -> str:
+    """
+    Build-only runs record "built" rows, which must not replace the publish rows of the same
+    collection version, so they are kept under their own server key.
+
+    :param server: Galaxy server the collection is built for.
+    :return: The state store key of build-only runs for the server.
+    """
+    return f"build:{server}"
+
+
+def collection_digest(collection_dir: str) -> str:
+    """
+    Calculates a digest of the collection content from its MANIFEST.json and FILES.json.
+    FILES.json holds a checksum for every file, so the two files are enough to detect any change.
+
+    :param collection_dir: Path to the installed collection.
+    :return: The hex sha256 digest.
+    """
+    digest = hashlib.sha256()
+    for file_name in ("MANIFEST.json", "FILES.json"):
+        digest.update(file_name.encode())
+        try:
+            with open(os.path.join(collection_dir, file_name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            digest.update(b"\0missing")
+    return digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """
+    Calculates the sha256 of a file without reading it into memory at once.
+
+    :param path: Path to the file.
+    :return: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CollectionState:
+    """
+    SQLite backed record of the last digest and publish status of every collection version.
+    """
+
+    def __init__(self, state_file: str = DEFAULT_STATE_FILE) -> None:
+        """
+        :param state_file: Path to the SQLite file, created on first use.
+        """
+        state_dir = os.path.dirname(state_file)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self.state_file = state_file
+        self.connection = sqlite3.connect(state_file)
+        self.connection.execute(_SCHEMA)
+        self.connection.execute(_DURATIONS_SCHEMA)
+        self.connection.commit()
+
+    def get(self, server: str, collection: str, version: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the stored (digest, status) of a collection version.
+
+        :param server: Galaxy server the collection is published to.
+        :param collection: Collection name in <namespace>.<collection> format.
+        :param version: Collection version.
+        :return: A (digest, status) tuple or None when the version is unknown.
+        """
+        return self.connection.execute(
+            "SELECT digest, status FROM collections WHERE server = ? AND collection = ? AND version = ?",
+            (server, collection, version)
+        ).fetchone()
+
+    def is_unchanged(self, server: str, collection: str, version: str, digest: str,
+                     statuses: Iterable[str] = DONE_STATUSES) -> bool:
+        """
+        Checks whether a collection version was already processed with the same content.
+
+        :param server: Galaxy server the collection is published to.
+        :param collection: Collection name in <namespace>.<collection> format.
+        :param version: Collection version.
+        :param digest: Current digest returned by collection_digest.
+        :param statuses: Stored statuses that count as successfully processed.
+        :return: True when the stored digest matches and the stored status is one of statuses.
+        """
+        row = self.get(server, collection, version)
+        return row is not None and row[0] == digest and row[1] in statuses
+
+    def record(self, server: str, collection: str, version: str, digest: str, status: str) -> None:
+        """
+        Stores the digest and status of a processed collection version.
+
+        :param server: Galaxy server the collection is published to.
+        :param collection: Collection name in <namespace>.<collection> format.
+        :param version: Collection version.
+        :param digest: Digest returned by collection_digest.
+        :param status: Outcome of the run, for example published, exists or error.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO collections (server, collection, version, digest, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (server, collection, version, digest, status, time.time())
+        )
+        self.connection.commit()
+
+    def record_durations(self, collection: str, build_seconds: Optional[float] = None,
+                         publish_seconds: Optional[float] = None, tarball_size: Optional[int] = None,
+                         source_size: Optional[int] = None) -> None:
+        """
+        Folds the durations and sizes of a run into the history of a collection.
+        Values that are None keep their stored value.
+
+        :param collection: Collection name in <namespace>.<collection> format.
+        :param build_seconds: Convert, build and verify time of the run.
+        :param publish_seconds: Upload and import time of the run.
+        :param tarball_size: Size of the built tarball in bytes.
+        :param source_size: Size of the installed collection in bytes.
+        """
+        old = self.durations().get(collection, {})
+
+        def fold(key: str, value: Optional[float]) -> Optional[float]:
+            if value is None or old.get(key) is None:
+                return old.get(key) if value is None else value
+            return old[key] + DURATION_WEIGHT * (value - old[key])
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO durations (collection, build_seconds, publish_seconds, tarball_size, "
+            "source_size, runs, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (collection, fold("build_seconds", build_seconds), fold("publish_seconds", publish_seconds),
+             tarball_size if tarball_size is not None else old.get("tarball_size"),
+             source_size if source_size is not None else old.get("source_size"),
+             old.get("runs", 0) + 1, time.time())
+        )
+        self.connection.commit()
+
+    def durations(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: A collection to history mapping with build_seconds, publish_seconds, tarball_size,
+                 source_size and the number of recorded runs.
+        """
+        rows = self.connection.execute(
+            "SELECT collection, build_seconds, publish_seconds, tarball_size, source_size, runs FROM durations"
+        ).fetchall()
+        return {row[0]: {"build_seconds": row[1], "publish_seconds": row[2], "tarball_size": row[3],
+                         "source_size": row[4], "runs": row[5]} for row in rows}
+
+    def close(self) -> None:
+        """
+        Closes the SQLite connection.
+        """
+        self.connection.close()
+
+    def __enter__(self) -> "CollectionState":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Watching of the installed collections tree for new or changed collections.
+
+On Linux the tree is watched with inotify (through ctypes, no extra package): the ansible_collections
+directory, every namespace directory and every collection directory, so a MANIFEST.json written or
+renamed into place by a package install is noticed right away. Without inotify the tree is polled
+with the incremental inventory scan instead.
+
+Changes are debounced per collection: a collection is handed on once its directory has been quiet
+for the debounce delay (or after max_delay at the latest), so a package that installs dozens of
+collections in one burst becomes a single batch. Batches go through a bounded queue to a single
+publish thread; while the queue is full new changes keep coalescing in the debouncer instead of
+piling up.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import signal
+import struct
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Set, Tuple, Union
+
+from collection_inventory import Inventory
+
+MANIFEST_FILE = "MANIFEST.json"
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_MODIFY | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class InotifyWatcher:
+    """
+    Reports changed collections of an ansible_collections tree from inotify events.
+    """
+
+    def __init__(self, collections_dir: str) -> None:
+        """
+        :param collections_dir: Path to the ansible_collections directory.
+        :raises OSError: When inotify is not available.
+        """
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name or "libc.so.6", use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+
+        self.collections_dir = collections_dir
+        self._paths = {}   # watch descriptor -> (namespace, name); None for the root and namespace directories
+        self._add_tree()
+
+    def _watch(self, path: str, key: Tuple[Optional[str], Optional[str]]) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return  # removed again before it could be watched
+            raise OSError(error, f"inotify_add_watch {path}: {os.strerror(error)}")
+        self._paths[wd] = key
+
+    def _add_namespace(self, namespace: str) -> Set[str]:
+        path = os.path.join(self.collections_dir, namespace)
+        self._watch(path, (namespace, None))
+        changed = set()
+        try:
+            with os.scandir(path) as collections:
+                for entry in collections:
+                    if entry.is_dir():
+                        changed |= self._add_collection(namespace, entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        return changed
+
+    def _add_collection(self, namespace: str, name: str) -> Set[str]:
+        path = os.path.join(self.collections_dir, namespace, name)
+        self._watch(path, (namespace, name))
+        # A manifest written before the watch was added would be missed otherwise
+        return {f"{namespace}.{name}"} if os.path.isfile(os.path.join(path, MANIFEST_FILE)) else set()
+
+    def _add_tree(self) -> Set[str]:
+        self._paths.clear()
+        self._watch(self.collections_dir, (None, None))
+        changed = set()
+        with os.scandir(self.collections_dir) as namespaces:
+            for entry in namespaces:
+                if entry.is_dir() and not entry.name.endswith('.info'):
+                    changed |= self._add_namespace(entry.name)
+        return changed
+
+    def changes(self, timeout: float) -> Tuple[Set[str], Set[str]]:
+        """
+        Waits up to timeout seconds for events.
+
+        :param timeout: Maximum time to wait in seconds.
+        :return: The collections whose MANIFEST.json changed and the collections with any other activity
+                 in their directory (used to extend the debounce of a pending collection).
+        """
+        changed, active = set(), set()
+        readable, _, _ = select.select([self._fd], [], [], max(timeout, 0))
+        if not readable:
+            return changed, active
+
+        data = os.read(self._fd, READ_SIZE)
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            name = os.fsdecode(data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b"\0"))
+            pos += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: watch the tree again and treat every collection as changed
+                os.close(self._fd)
+                self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+                return changed | self._add_tree(), active
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            if wd not in self._paths or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+
+            namespace, collection = self._paths[wd]
+            if namespace is None:
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and not name.endswith('.info'):
+                    changed |= self._add_namespace(name)
+            elif collection is None:
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    changed |= self._add_collection(namespace, name)
+            elif name == MANIFEST_FILE and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed.add(f"{namespace}.{collection}")
+            else:
+                active.add(f"{namespace}.{collection}")
+        return changed, active
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    Reports changed collections by rescanning the inventory; used where inotify is not available.
+    """
+
+    def __init__(self, collections_dir: str, interval: float = 10.0) -> None:
+        """
+        :param collections_dir: Path to the ansible_collections directory.
+        :param interval: Time between two scans in seconds.
+        """
+        self.collections_dir = collections_dir
+        self.interval = interval
+        self._inventory = Inventory(collections_dir).scan()
+        self._next_scan = time.monotonic() + interval
+
+    def changes(self, timeout: float) -> Tuple[Set[str], Set[str]]:
+        time.sleep(max(min(timeout, self._next_scan - time.monotonic()), 0))
+        if time.monotonic() < self._next_scan:
+            return set(), set()
+
+        self._next_scan = time.monotonic() + self.interval
+        previous = self._inventory
+        self._inventory = Inventory(self.collections_dir).scan(previous)
+        changed = {fqcn for fqcn, entry in self._inventory.entries.items() if previous.entries.get(fqcn) is not entry}
+        return changed, set()
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(collections_dir: str, poll_interval: float = 10.0) -> Union[InotifyWatcher, PollingWatcher]:
+    """
+    :param collections_dir: Path to the ansible_collections directory.
+    :param poll_interval: Scan interval of the polling fallback in seconds.
+    :return: An InotifyWatcher, or a PollingWatcher when inotify is not available.
+    """
+    try:
+        return InotifyWatcher(collections_dir)
+    except OSError as e:
+        print(f"inotify is not available ({e}), scanning {collections_dir} every {poll_interval:.0f}s instead")
+        return PollingWatcher(collections_dir, poll_interval)
+
+
+class Debouncer:
+    """
+    Holds back changed collections until their directory has been quiet for a while.
+    """
+
+    def __init__(self, delay: float = 2.0, max_delay: float = 30.0) -> None:
+        """
+        :param delay: Quiet time after the last event of a collection in seconds.
+        :param max_delay: Maximum time a collection is held back after its first event in seconds.
+        """
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending = {}  # fqcn -> [first event, last event]
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, collections: Iterable[str], now: float) -> None:
+        for fqcn in collections:
+            self._pending.setdefault(fqcn, [now, now])[1] = now
+
+    def touch(self, collections: Iterable[str], now: float) -> None:
+        """
+        Extends the quiet time of the collections that are already pending.
+        """
+        for fqcn in collections:
+            if fqcn in self._pending:
+                self._pending[fqcn][1] = now
+
+    def _due(self, fqcn: str) -> float:
+        first, last = self._pending[fqcn]
+        return min(last + self.delay, first + self.max_delay)
+
+    def ready(self, now: float) -> List[str]:
+        """
+        :return: The sorted collections that are due and removes them.
+        """
+        due = sorted(fqcn for fqcn in self._pending if self._due(fqcn) <= now)
+        for fqcn in due:
+            del self._pending[fqcn]
+        return due
+
+    def restore(self, collections: Iterable[str], now: float) -> None:
+        """
+        Puts back collections that could not be queued, so they are handed on with the next batch.
+        """
+        for fqcn in collections:
+            self._pending.setdefault(fqcn, [now, now])
+
+    def timeout(self, now: float) -> Optional[float]:
+        """
+        :return: Seconds until the next collection is due, None when nothing is pending.
+        """
+        if not self._pending:
+            return None
+        return max(min(self._due(fqcn) for fqcn in self._pending) - now, 0)
+
+
+def watch_collections(collections_dir: str, handler: Callable[[List[str]], None],
+                      selected: Optional[Callable[[str], bool]] = None, debounce: float = 2.0,
+                      max_delay: float = 30.0, queue_size: int = 4, poll_interval: float = 10.0,
+                      stop: Optional[threading.Event] = None) -> None:
+    """
+    Watches a collections tree and hands batches of changed collections to handler until interrupted.
+
+    :param collections_dir: Path to the ansible_collections directory.
+    :param handler: Called from the publish thread with a sorted list of collection names.
+    :param selected: Filter of the collection names to watch, all collections by default.
+    :param debounce: Quiet time of a collection before it is handed on in seconds.
+    :param max_delay: Maximum time a collection is held back after its first event in seconds.
+    :param queue_size: Maximum number of batches waiting for the publish thread.
+    :param poll_interval: Scan interval when inotify is not available in seconds.
+    :param stop: Event that ends the watch; SIGTERM and KeyboardInterrupt end it as well.
+    """
+    stop = stop or threading.Event()
+    batches = queue.Queue(maxsize=max(queue_size, 1))
+    debouncer = Debouncer(debounce, max_delay)
+    watcher = open_watcher(collections_dir, poll_interval)
+
+    def publisher() -> None:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            try:
+                handler(batch)
+            except Exception as e:  # one failed batch must not end the watch
+                print(f"Publishing {', '.join(batch)} failed: {e}")
+
+    previous_handler = None
+    if threading.current_thread() is threading.main_thread():
+        previous_handler = signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    thread = threading.Thread(target=publisher, name="collection-publisher")
+    thread.start()
+    print(f"Watching {collections_dir} for new or changed collections")
+
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            timeout = debouncer.timeout(now)
+            # Wake up regularly to notice the stop event and a drained queue
+            changed, active = watcher.changes(1.0 if timeout is None else min(timeout, 1.0))
+
+            now = time.monotonic()
+            if selected is not None:
+                changed = {fqcn for fqcn in changed if selected(fqcn)}
+            debouncer.add(changed, now)
+            debouncer.touch(active, now)
+
+            batch = debouncer.ready(now)
+            if batch:
+                try:
+                    batches.put_nowait(batch)
+                    print(f"Queued {len(batch)} changed collection(s): {', '.join(batch)}")
+                except queue.Full:
+                    debouncer.restore(batch, now)
+    except KeyboardInterrupt:
+        print("Stopping the watch, waiting for the queued batches")
+    finally:
+        if previous_handler is not None:
+            signal.signal(signal.SIGTERM, previous_handler)
+        watcher.close()
+        batches.put(None)
+        thread.join()
@@ -1,6 +1,8 @@
 import os
 import json
-import yaml
+
+from collection_inventory import scan_inventory
+from galaxy_yaml import write_galaxy_file
 
 # Функция для преобразования MANIFEST.json в galaxy.yml
 def convert_manifest_to_galaxy(manifest_file, galaxy_file):
@@ -27,28 +29,26 @@ def convert_manifest_to_galaxy(manifest_file, galaxy_file):
         "issues": collection_info.get("issues")
     }
 
-    # Запись данных в galaxy.yml
-    with open(galaxy_file, 'w', encoding='utf-8') as f:
-        yaml.dump(collection_info, f, default_flow_style=False, allow_unicode=True)
+    # Запись данных в galaxy.yml, только если содержимое изменилось
+    return write_galaxy_file(galaxy_file, collection_info, default_flow_style=False, allow_unicode=True)
 
 # Функция для обработки коллекций
 def process_collections(collections_dir):
-    # Проходим по директориям коллекций
-    for namespace in os.listdir(collections_dir):
-        namespace_path = os.path.join(collections_dir, namespace)
-        if os.path.isdir(namespace_path) and not namespace.endswith('.info'):
-            for collection in os.listdir(namespace_path):
-                collection_path = os.path.join(namespace_path, collection)
-                manifest_file = os.path.join(collection_path, 'MANIFEST.json')
-                galaxy_file = os.path.join(collection_path, 'galaxy.yml')
+    counts = {"changed": 0, "unchanged": 0}
+
+    # Проходим по коллекциям из индекса (один проход os.scandir)
+    for entry in scan_inventory(collections_dir):
+        collection_path = entry["path"]
+        galaxy_file = os.path.join(collection_path, 'galaxy.yml')
+        try:
+            changed = convert_manifest_to_galaxy(entry["manifest_file"], galaxy_file)
+            counts["changed" if changed else "unchanged"] += 1
+            print("hello, hello")
+            print(f"Successfully processed collection: {collection_path}")
+        except Exception as e:
+            print(f"Failed to process collection {collection_path}: {e}")
 
-                if os.path.isdir(collection_path) and os.path.isfile(manifest_file):
-                    try:
-                        convert_manifest_to_galaxy(manifest_file, galaxy_file)
-                        print("hello, hello")
-                        print(f"Successfully processed collection: {collection_path}")
-                    except Exception as e:
-                        print(f"Failed to process collection {collection_path}: {e}")
+    print(f"galaxy.yml changed: {counts['changed']}, unchanged: {counts['unchanged']}")
 
 # Пример использования
 if __name__ == "__main__":
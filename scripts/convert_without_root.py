@@ -1,7 +1,10 @@
+import argparse
 import os
 import json
-import yaml
-import shutil
+
+from collection_inventory import scan_inventory
+from collection_staging import LINK_MODES, Stager, default_staging_dir, prune_collections
+from galaxy_yaml import write_galaxy_file
 
 # Функция для преобразования MANIFEST.json в galaxy.yml
 def convert_manifest_to_galaxy(manifest_file, galaxy_file):
@@ -29,40 +32,61 @@ def convert_manifest_to_galaxy(manifest_file, galaxy_file):
         "issues": collection_info.get("issues")
     }
 
-    # Запись данных в galaxy.yml
-    with open(galaxy_file, 'w', encoding='utf-8') as f:
-        yaml.dump(galaxy_data, f, default_flow_style=False, allow_unicode=True)
+    # Запись данных в galaxy.yml, только если содержимое изменилось.
+    # Файл заменяется переименованием, поэтому ссылка на исходный файл никогда не перезаписывается
+    return write_galaxy_file(galaxy_file, galaxy_data, default_flow_style=False, allow_unicode=True)
 
 # Функция для обработки коллекций
-def process_collections(collections_dir):
-    temp_dir = "/tmp/ansible_collections"
+def process_collections(collections_dir, temp_dir=None, link_mode="auto", tmpfs=False):
+    # По умолчанию /tmp/ansible_collections, с tmpfs=True - /dev/shm/ansible_collections
+    temp_dir = temp_dir or default_staging_dir(tmpfs)
     
     # Создаем временную директорию
     os.makedirs(temp_dir, exist_ok=True)
 
-    # Проходим по директориям коллекций
-    for namespace in os.listdir(collections_dir):
-        namespace_path = os.path.join(collections_dir, namespace)
-        if os.path.isdir(namespace_path) and not namespace.endswith('.info'):
-            for collection in os.listdir(namespace_path):
-                collection_path = os.path.join(namespace_path, collection)
-                manifest_file = os.path.join(collection_path, 'MANIFEST.json')
+    # Файлы не копируются: каталоги создаются заново, а файлы связываются с исходными
+    # (reflink, hardlink или symlink), настоящим файлом записывается только galaxy.yml.
+    # Повторный запуск обновляет только изменившиеся файлы.
+    stager = Stager(link_mode)
+    staged = {}
+    counts = {"changed": 0, "unchanged": 0}
+
+    # Проходим по коллекциям из индекса (один проход os.scandir)
+    for entry in scan_inventory(collections_dir):
+        dest_collection_path = os.path.join(temp_dir, entry["namespace"], entry["name"])
+        staged.setdefault(entry["namespace"], []).append(entry["name"])
+        try:
+            stager.stage_collection(entry["path"], dest_collection_path)
+        except OSError as e:
+            print(f"Failed to stage collection {dest_collection_path}: {e}")
+            continue
 
-                if os.path.isdir(collection_path) and os.path.isfile(manifest_file):
-                    # Копируем коллекцию в /tmp
-                    dest_collection_path = os.path.join(temp_dir, namespace, collection)
-                    os.makedirs(os.path.dirname(dest_collection_path), exist_ok=True)
-                    shutil.copytree(collection_path, dest_collection_path)
+        # Создаем galaxy.yml в подготовленной директории
+        galaxy_file = os.path.join(dest_collection_path, 'galaxy.yml')
+        try:
+            changed = convert_manifest_to_galaxy(entry["manifest_file"], galaxy_file)
+            counts["changed" if changed else "unchanged"] += 1
+            print(f"Successfully processed collection: {dest_collection_path}")
+        except Exception as e:
+            print(f"Failed to process collection {dest_collection_path}: {e}")
 
-                    # Создаем galaxy.yml в скопированной директории
-                    galaxy_file = os.path.join(dest_collection_path, 'galaxy.yml')
-                    try:
-                        convert_manifest_to_galaxy(manifest_file, galaxy_file)
-                        print(f"Successfully processed collection: {dest_collection_path}")
-                    except Exception as e:
-                        print(f"Failed to process collection {dest_collection_path}: {e}")
+    # Удаляем коллекции, которых больше нет в исходном дереве. Удаляются только каталоги
+    # с маркером Stager; если в исходном дереве ничего не найдено, не удаляем ничего
+    removed = prune_collections(temp_dir, staged) if staged else 0
+    if not staged:
+        print(f"No collections found in {collections_dir}, nothing is pruned from {temp_dir}")
+    linked = f"{stager.stats['linked']} linked ({stager.mode})" if stager.stats['linked'] else "0 linked"
+    print(f"Staged {temp_dir}: {linked}, {stager.stats['kept']} unchanged, "
+          f"{stager.stats['removed'] + removed} removed")
+    print(f"galaxy.yml changed: {counts['changed']}, unchanged: {counts['unchanged']}")
 
 # Пример использования
 if __name__ == "__main__":
-    collections_dir = "/usr/share/ansible/collections/ansible_collections/"
-    process_collections(collections_dir)
+    parser = argparse.ArgumentParser(description="Stage installed collections into a writable tree with galaxy.yml")
+    parser.add_argument("--collections-dir", default="/usr/share/ansible/collections/ansible_collections/")
+    parser.add_argument("--staging-dir", help="Staged tree (default: /tmp/ansible_collections)")
+    parser.add_argument("--link-mode", choices=LINK_MODES, default="auto",
+                        help="How files are staged: auto tries reflink, hardlink, then symlink")
+    parser.add_argument("--tmpfs", action="store_true", help="Place the staged tree on tmpfs (/dev/shm)")
+    args = parser.parse_args()
+    process_collections(args.collections_dir, args.staging_dir, args.link_mode, args.tmpfs)
@@ -6,18 +6,50 @@ Module for automatic building and publishing of Ansible collections to the Ansib
 The program checks for necessary environment variables, builds a collection, and publishes it.
 """
 
+import argparse
 import glob
 import json
 import os
 import subprocess
 import sys
-from typing import List
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+import requests
 import yaml
 
+from build_ignore import apply_build_ignore, load_ignore_policy, print_ignore_report
+from collection_bundle import CollectionBundle, is_bundle
+from collection_inventory import Inventory, scan_inventory
+from collection_shards import parse_shard, print_shard, select_shard, write_report
+from collection_watcher import watch_collections
+from collection_state import DEFAULT_STATE_FILE, DONE_STATUSES, CollectionState, collection_digest, file_sha256
+from galaxy_builder import build_collection_tarball
+from galaxy_catalog import get_catalog_or_none, plan_publish, print_plan
+from galaxy_client import get_client
+from galaxy_imports import ImportPoller
+from galaxy_limits import configure_limiter, set_limit_listener
+from galaxy_workers import close_galaxy_workers, configure_galaxy_workers, galaxy_pool, run_galaxy
+from galaxy_yaml import convert_batch, write_galaxy_file
+from publish_scheduler import estimate_durations, expected_makespan, lpt_order, print_makespan, print_schedule, schedule
+from publish_targets import (AA_CERTIFIED_PATH, CERTIFIED_TAG, VALIDATED_PATH, default_targets, join_publish_url,
+                             load_targets, make_target, route_targets)
+from run_journal import (BUILT, CONVERTED, DEFAULT_JOURNAL_FILE, PUBLISHED as JOURNAL_PUBLISHED, RunJournal,
+                         build_options)
+from run_metrics import RunMetrics, run_profiled, stage_timing
+from tarball_verify import format_report, verify_collection_tarball
+
 ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN = os.getenv("ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN")
 ANSIBLE_GALAXY_SERVER_GALAXY_URL = os.getenv("ANSIBLE_GALAXY_SERVER_GALAXY_URL")
 
+COLLECTIONS_DIR = "/usr/share/ansible/collections/ansible_collections/"
+
+GALAXY_YAML_OPTIONS = {"default_flow_style": False, "sort_keys": False}
+
 def check_env() -> List[str]:
     """
     Checks for the presence of required environment variables.
@@ -28,64 +60,114 @@ def check_env() -> List[str]:
     return [env for env in required_envs if not globals()[env]]
 
 
-def convert_manifest_to_galaxy(manifest_file: str, galaxy_file: str) -> None:
+def publish_path_for_tags(tags: List[str]) -> str:
     """
-    Converts data from the MANIFEST.json file into the galaxy.yml format.
+    Chooses the repository a collection is published to by its tags.
+
+    :param tags: The tags from collection_info.
+    :return: The publish_url path for galaxy.yml.
+    """
+    if CERTIFIED_TAG in tags:
+        return AA_CERTIFIED_PATH
+    return VALIDATED_PATH
+
+
+def manifest_to_galaxy_data(manifest_file: str) -> Dict[str, Any]:
+    """
+    Reads the MANIFEST.json file and returns the data for galaxy.yml.
 
     :param manifest_file: Path to the MANIFEST.json file.
-    :param galaxy_file: Path to the galaxy.yml file.
+    :return: The galaxy.yml data, including the publish_url chosen by the collection tags.
     """
     with open(manifest_file, 'r') as f:
         manifest_data = json.load(f)
 
     galaxy_data = manifest_data.get("collection_info", {})
 
-    if "aacertified" in galaxy_data.get("tags", []):
-        galaxy_data['publish_url'] = "/api/galaxy/content/aa-certified/"
-    else:
-        galaxy_data['publish_url'] = "/api/galaxy/content/validated/"
+    galaxy_data['publish_url'] = publish_path_for_tags(galaxy_data.get("tags") or [])
 
     if galaxy_data.get("license_file", ""):
         galaxy_data.pop("license", None)
     else:
         galaxy_data.pop("license_file", None)
 
-    with open(galaxy_file, 'w') as f:
-        yaml.dump(galaxy_data, f, default_flow_style=False, sort_keys=False)
+    return galaxy_data
 
 
-def build_collection(base_path: str, collection_path: str) -> str:
+def convert_manifest_to_galaxy(manifest_file: str, galaxy_file: str,
+                               ignore_policy: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
     """
-    Builds an Ansible collection using ansible-galaxy.
+    Converts data from the MANIFEST.json file into the galaxy.yml format.
+    galaxy.yml is only rewritten when its content changes.
+
+    :param manifest_file: Path to the MANIFEST.json file.
+    :param galaxy_file: Path to the galaxy.yml file.
+    :param ignore_policy: build_ignore policy (see build_ignore.load_ignore_policy); the collection is
+                          analyzed and the patterns that apply to it are written into build_ignore.
+    :return: The data written to galaxy.yml.
+    """
+    galaxy_data = manifest_to_galaxy_data(manifest_file)
+    if ignore_policy is not None:
+        apply_build_ignore(galaxy_data, os.path.dirname(manifest_file), ignore_policy)
+    write_galaxy_file(galaxy_file, galaxy_data, **GALAXY_YAML_OPTIONS)
+    return galaxy_data
+
+
+def convert_collections(entries: List[Dict[str, Any]],
+                        ignore_policy: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    """
+    Converts the MANIFEST.json of many collections into galaxy.yml in one call.
+
+    :param entries: Inventory entries of the collections.
+    :param ignore_policy: build_ignore policy applied to every collection.
+    :return: A dict with the changed and unchanged counts, the failed galaxy.yml files and, with a policy,
+             the build_ignore report of every collection in "build_ignore".
+    """
+    files = [(entry["manifest_file"], os.path.join(entry["path"], 'galaxy.yml')) for entry in entries]
+    if ignore_policy is None:
+        return convert_batch(files, manifest_to_galaxy_data, **GALAXY_YAML_OPTIONS)
+
+    ignore_reports = {}
+
+    def to_galaxy_data(manifest_file: str) -> Dict[str, Any]:
+        galaxy_data = manifest_to_galaxy_data(manifest_file)
+        collection = f"{galaxy_data.get('namespace')}.{galaxy_data.get('name')}"
+        ignore_reports[collection] = apply_build_ignore(galaxy_data, os.path.dirname(manifest_file), ignore_policy)
+        return galaxy_data
+
+    report = convert_batch(files, to_galaxy_data, **GALAXY_YAML_OPTIONS)
+    report["build_ignore"] = ignore_reports
+    return report
+
+
+def build_collection(base_path: str, collection_path: str, output_path: str = ".") -> str:
+    """
+    Builds an Ansible collection using ansible-galaxy (on a warm worker when they are configured).
 
     :param base_path: Base path to the collection.
     :param collection_path: Path to a specific collection relative to the base path.
-    :return: The name of the built archive (.tar.gz).
+    :param output_path: Directory the tarball is written to.
+    :return: The path of the built archive (.tar.gz).
     """
     collection_dir = os.path.join(base_path, collection_path)
 
     print(f"Building collection: {collection_dir}")
 
     try:
-        with open(os.devnull, 'wb') as devnull:
-            subprocess.run(['ansible-galaxy', 'collection', 'build', '-c', collection_dir],
-                           check=True,
-                           stdout=devnull,
-                           stderr=devnull,
-                           text=True)
+        run_galaxy(['collection', 'build', '-c', collection_dir, '--output-path', output_path]).check_returncode()
     except subprocess.CalledProcessError as e:
         print(f"Error building collection {collection_dir}: {e}")
         return ""
 
     namespace, collection = collection_path.split('/')
-    tarball_pattern = f"{namespace}-{collection}-*.tar.gz"
+    tarball_pattern = os.path.join(output_path, f"{namespace}-{collection}-*.tar.gz")
     tarballs = glob.glob(tarball_pattern)
 
     if not tarballs:
         print(f"Could not find built collection matching pattern: {tarball_pattern}")
         return ""
 
-    return os.path.basename(tarballs[0])
+    return os.path.normpath(tarballs[0])
 
 def get_publish_url(galaxy_file: str, galaxy_url: str) -> str:
     """
@@ -95,28 +177,46 @@ def get_publish_url(galaxy_file: str, galaxy_url: str) -> str:
     :param galaxy_url: The base URL of the Ansible Galaxy server. 
     :return: The full URL for publishing the collection.
     """
-    if galaxy_url.startswith("http://") or galaxy_url.startswith("https://"):
-        publish_url = galaxy_url
-    else:
-        publish_url = f"https://{galaxy_url}"
-
     with open(galaxy_file, 'r') as f:
         galaxy_data = yaml.safe_load(f)
-        publish_url += galaxy_data['publish_url']
 
-    return publish_url
+    return join_publish_url(galaxy_url, galaxy_data['publish_url'])
 
-def publish_collection(collection_tar: str, publish_url: str) -> None:
+def publish_collection(collection_tar: str, publish_url: str, token: Optional[str] = None) -> str:
     """
-    Publishes a collection to the Ansible Galaxy server.
+    Publishes a collection to the Ansible Galaxy server with ansible-galaxy (on a warm worker when
+    they are configured). A bundle (see collection_bundle) publishes all its collections with publish_bundle.
 
-    :param collection_tar: Name of the archived collection file.
+    :param collection_tar: Path to the archived collection file or to a bundle.
     :param publish_url: URL for publication on the Ansible Galaxy server.
+    :param token: API token, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN by default.
+    :return: The publish status: published, exists, missing-namespace or error; for a bundle
+             the worst status of its collections.
     """
-    validated_token = ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN
+    if is_bundle(collection_tar):
+        statuses = set(publish_bundle(collection_tar, publish_url, token, publisher="ansible-galaxy").values())
+        failed = statuses - set(DONE_STATUSES)
+        if failed:
+            return "missing-namespace" if failed == {"missing-namespace"} else "error"
+        return "published" if "published" in statuses else "exists"
+
+    published = publish_collection_galaxy(collection_tar, publish_url, token)
+    print(publish_message(collection_tar, published["status"], published["message"]))
+    return published["status"]
+
+
+def publish_collection_galaxy(collection_tar: str, publish_url: str, token: Optional[str] = None) -> Dict[str, str]:
+    """
+    Publishes a collection with ansible-galaxy without printing, so it can run in upload threads.
+
+    :param collection_tar: Path to the archived collection file.
+    :param publish_url: URL for publication on the Ansible Galaxy server.
+    :param token: API token, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN by default.
+    :return: A publish result with status (published, exists, missing-namespace or error) and message.
+    """
+    validated_token = token or ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN
 
     command = [
-        'ansible-galaxy',
         'collection',
         'publish',
         collection_tar,
@@ -126,146 +226,1088 @@ def publish_collection(collection_tar: str, publish_url: str) -> None:
     ]
 
     try:
-        subprocess.run(command, check=True, capture_output=True)
-        print(f"Collection {collection_tar} successfully published.")
+        run_galaxy(command).check_returncode()
+        return {"status": "published", "message": ""}
 
     except subprocess.CalledProcessError as e:
         if "already exists" in str(e.stderr):
-            print(f"Collection {collection_tar} already exists on Galaxy.")
+            return {"status": "exists", "message": ""}
 
         elif "Namespace" in str(e.stderr):
-            print(f"Namespace for {collection_tar} does not exist on Galaxy.")
+            return {"status": "missing-namespace", "message": ""}
 
         else:
-            print(f"Error publishing collection {collection_tar}: {e}")
+            return {"status": "error", "message": str(e)}
 
 
-def main() -> None:
+def publish_message(collection_tar: str, status: str, message: str = "", queued: bool = False) -> str:
     """
-    Main entry point of the program.
-    Performs the building and publishing of Ansible collections.
+    :param collection_tar: Path or file name of the collection tarball.
+    :param status: The publish status.
+    :param message: The error message of a failed upload.
+    :param queued: The upload was accepted and its import is still to be polled.
+    :return: The line reported for an upload. Upload threads return their outcome and the
+             main thread prints this line, so the lines of concurrent uploads do not interleave.
+    """
+    if status == "published" and queued:
+        return f"Collection {collection_tar} uploaded, import queued."
+    elif status == "published":
+        return f"Collection {collection_tar} successfully published."
+    elif status == "exists":
+        return f"Collection {collection_tar} already exists on Galaxy."
+    elif status == "missing-namespace":
+        return f"Namespace for {collection_tar} does not exist on Galaxy."
+    return f"Error publishing collection {collection_tar}: {message}"
 
-    Usage:
-    python script.py --collection <namespace>.<collection>  # Publish a single collection
-    python script.py --namespace <namespace>                # Publish all collections within a given namespace
-    python script.py --all                                  # Publish all available collections
+
+def find_collections(inventory: Inventory, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
     """
-    collections_dir = "/usr/share/ansible/collections/ansible_collections/"
+    Finds the collections to process in the inventory of the collections directory.
 
-    missing_envs = check_env()
-    if missing_envs:
-        print(f"The following required environment variables are missing: {', '.join(missing_envs)}")
-        sys.exit(1)
+    :param inventory: Inventory of the ansible_collections directory.
+    :param namespace: Restrict the search to a single namespace.
+    :return: A list of inventory entries sorted by namespace and name.
+    """
+    for collection_path in inventory.missing_manifest:
+        if namespace is None or os.path.basename(os.path.dirname(collection_path)) == namespace:
+            print(f"MANIFEST.json file is missing for {collection_path}")
+    for collection_path, error in inventory.errors.items():
+        print(f"Could not read MANIFEST.json of {collection_path}: {error}")
 
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print("python script.py --collection <namespace>.<collection>  # Publish a single collection")
-        print("python script.py --namespace <namespace>                # Publish all collections within a given namespace")
-        print("python script.py --all                                  # Publish all available collections")
-        sys.exit(1)
-    
-    if sys.argv[1] == "--collection":
-        if len(sys.argv) == 3:
-            target_collection = sys.argv[2]
+    return inventory.collections(namespace)
+
+
+def build_stage(collections_dir: str, collection_path: str, output_path: str,
+                builder: str = "native", verify: bool = False, verify_workers: int = 4,
+                ignore_policy: Optional[Dict[str, List[str]]] = None) -> Dict[str, str]:
+    """
+    Converts MANIFEST.json into galaxy data and builds the collection tarball.
+    Runs inside a worker process when --jobs is used, so it must not rely on shared state.
 
-            parts = target_collection.split(".")
-            if len(parts) != 2:
-                print("Incorrect collection format. Expected: <namespace>.<collection>")
-                sys.exit(1)
+    The native builder streams the tarball straight from the installed collection and keeps
+    galaxy.yml in memory; the ansible-galaxy builder writes galaxy.yml into the collection
+    and runs `ansible-galaxy collection build`. With verify the tarball is checked against the
+    checksums in FILES.json and a mismatch is reported as "verify-error".
 
-            namespace, collection = parts
+    :param collections_dir: Path to the ansible_collections directory.
+    :param collection_path: Path to a specific collection relative to collections_dir.
+    :param output_path: Directory the tarball is written to.
+    :param builder: Either "native" or "ansible-galaxy".
+    :param verify: Verify the tarball against FILES.json.
+    :param verify_workers: Number of hashing threads of the verification.
+    :param ignore_policy: build_ignore policy; its report is kept in the "build_ignore" of the result.
+    :return: A result dict with the collection name, publish path, tarball path, status
+             and the timings of the convert, build and verify stages.
+    """
+    full_collection_path = os.path.join(collections_dir, collection_path)
+    manifest_file = os.path.join(full_collection_path, 'MANIFEST.json')
+    result = {
+        "collection": collection_path.replace('/', '.'),
+        "publish_path": "",
+        "tarball": "",
+        "status": "built",
+        "message": "",
+        "timings": {},
+    }
 
-            collection_path = os.path.join(namespace, collection)
+    started = time.time()
+    try:
+        galaxy_data = manifest_to_galaxy_data(manifest_file)
+        if ignore_policy is not None:
+            result["build_ignore"] = apply_build_ignore(galaxy_data, full_collection_path, ignore_policy)
+        if builder != "native":
+            write_galaxy_file(os.path.join(full_collection_path, 'galaxy.yml'), galaxy_data, **GALAXY_YAML_OPTIONS)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        result.update(status="convert-error", message=str(e))
+        result["timings"]["convert"] = stage_timing(started, "convert-error")
+        return result
 
-            full_collection_path = os.path.join(collections_dir, collection_path)
-            if not os.path.exists(full_collection_path):
-                print(f"Collection path '{full_collection_path}' does not exist.")
-                sys.exit(1)
+    result["publish_path"] = galaxy_data['publish_url']
+    result["timings"]["convert"] = stage_timing(started, "converted")
 
-            manifest_file = os.path.join(full_collection_path, 'MANIFEST.json')
-            galaxy_file = os.path.join(full_collection_path, 'galaxy.yml')
+    started = time.time()
+    if builder == "native":
+        print(f"Building collection: {full_collection_path}")
+        try:
+            collection_tar = build_collection_tarball(full_collection_path, output_path, galaxy_data)
+        except (OSError, ValueError, KeyError, tarfile.TarError) as e:
+            result.update(status="build-error", message=str(e))
+            result["timings"]["build"] = stage_timing(started, "build-error")
+            return result
+    else:
+        collection_tar = build_collection(
+            base_path=collections_dir,
+            collection_path=collection_path,
+            output_path=output_path
+        )
+        if not collection_tar:
+            result.update(status="build-error", message="ansible-galaxy collection build failed")
+            result["timings"]["build"] = stage_timing(started, "build-error")
+            return result
 
-            if os.path.exists(manifest_file):
-                convert_manifest_to_galaxy(manifest_file, galaxy_file)
-                collection_tar = build_collection(
-                    base_path=collections_dir,
-                    collection_path=collection_path
-                )
+    result["tarball"] = collection_tar
+    result["timings"]["build"] = stage_timing(started, "built")
 
-                if collection_tar:
-                    publish_url = get_publish_url(galaxy_file, ANSIBLE_GALAXY_SERVER_GALAXY_URL)
-                    publish_collection(collection_tar, publish_url)
+    if verify:
+        started = time.time()
+        try:
+            report = verify_collection_tarball(collection_tar, full_collection_path, verify_workers,
+                                               galaxy_data.get("build_ignore") or ())
+        except (OSError, ValueError) as e:
+            report = {"ok": False, "error": str(e)}
+        if not report["ok"]:
+            result.update(status="verify-error", message=report.get("error") or format_report(report))
+        result["timings"]["verify"] = stage_timing(started, "verified" if report["ok"] else "verify-error")
+    return result
 
-            else:
-                print(f"MANIFEST.json file is missing for {full_collection_path}")
-                sys.exit(0)
 
-        else:
-            print("Usage: --collection <namespace>.<collection>")
-            sys.exit(1)
+def publish_collection_native(collection_tar: str, publish_url: str, retries: int = 0,
+                              wait: bool = True, token: Optional[str] = None, data: Any = None) -> Dict[str, str]:
+    """
+    Publishes a collection through the in-process Galaxy client.
+    Uploads to the same server reuse one keep-alive connection pool.
 
-    elif sys.argv[1] == "--namespace":
-        if len(sys.argv) == 3:
-            target_namespace = sys.argv[2]
-            namespace_path = os.path.join(collections_dir, target_namespace)
-            if os.path.exists(namespace_path):
-
-                for collection in os.listdir(namespace_path):
-                    collection_path = os.path.join(namespace_path, collection)
-
-                    if os.path.isdir(collection_path):
-                        manifest_file = os.path.join(collection_path, 'MANIFEST.json')
-                        galaxy_file = os.path.join(collection_path, 'galaxy.yml')
-
-                        if os.path.exists(manifest_file):
-                            convert_manifest_to_galaxy(manifest_file, galaxy_file)
-                            collection_tar = build_collection(
-                                base_path=collections_dir,
-                                collection_path=os.path.join(target_namespace, collection)
-                            )
-
-                            if collection_tar:
-                                publish_url = get_publish_url(galaxy_file, ANSIBLE_GALAXY_SERVER_GALAXY_URL)
-                                publish_collection(collection_tar, publish_url)
+    :param collection_tar: Path to the archived collection file.
+    :param publish_url: URL for publication on the Ansible Galaxy server.
+    :param retries: Number of retries after a transient failure, with exponential backoff and jitter.
+    :param wait: Wait for the import task; otherwise the result carries the task URL to poll later.
+    :param token: API token, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN by default.
+    :param data: Contents of the tarball (a bundle member) instead of reading collection_tar.
+    :return: A structured publish result with status and message, see publish_message; nothing is
+             printed here because the uploads run in threads.
+    """
+    client = get_client(publish_url, token or ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)
+    return client.publish(collection_tar, wait=wait, retries=retries, data=data)
+
+
+def publish_bundle(bundle_file: str, publish_url: Optional[str] = None, token: Optional[str] = None,
+                   publisher: str = "native", jobs: int = 4, retries: int = 0,
+                   collections: Optional[List[str]] = None,
+                   targets: Optional[List[Dict[str, Any]]] = None) -> Dict[Tuple[str, str], str]:
+    """
+    Publishes the collection versions of a bundle in dependency waves, up to jobs uploads at a time.
+    Like run_collections, every version is routed to the targets matching its tags and namespace
+    (by default the validated or the aa-certified repository) and uploaded to all of them.
+    The native publisher uploads straight from the memory-mapped bundle; ansible-galaxy needs a file,
+    so each collection is extracted to a temporary directory first.
+
+    The waves are computed per collection name: every version of a dependency is uploaded before
+    the versions of its dependents, whose dependencies count as published once one version is.
+
+    :param bundle_file: Path of a bundle written by collection_bundle.write_bundle.
+    :param publish_url: Upload every collection to this repository URL instead of routing them.
+    :param token: API token, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN by default.
+    :param publisher: Either "native" or "ansible-galaxy".
+    :param jobs: Number of concurrent uploads.
+    :param retries: Number of retries of a transient failure (native publisher only).
+    :param collections: "<namespace>.<name>[:<version>]" specs to publish, all collections by default.
+    :param targets: Publish targets, the default targets of ANSIBLE_GALAXY_SERVER_GALAXY_URL when None.
+    :return: A ("<namespace>.<name>", version) to publish status mapping, the status combined over the
+             targets like combine_target_results; versions that match no target are "no-target" and
+             versions whose dependencies in the bundle failed are "dependency-error".
+    """
+    if publish_url:
+        targets = [make_target("default", publish_url, "", token)]
+    elif targets is None:
+        targets = default_targets(ANSIBLE_GALAXY_SERVER_GALAXY_URL, token or ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)
+
+    with CollectionBundle(bundle_file) as bundle:
+        members = {(member["collection"], member["version"]): member for member in bundle.select(collections)}
+        versions = {}
+        for key, member in members.items():
+            entry = versions.setdefault(key[0], {"fqcn": key[0], "dependencies": {}, "keys": []})
+            entry["dependencies"].update(member["dependencies"])
+            entry["keys"].append(key)
+        plan = schedule(list(versions.values()))
+        statuses = {}
+        for collection, reason in sorted(plan["blocked"].items()):
+            for key in versions[collection]["keys"]:
+                statuses[key] = "dependency-error"
+            print(f"Skipping {collection}: {reason}")
+
+        def published(collection: str) -> bool:
+            return any(statuses.get(key) in DONE_STATUSES for key in versions[collection]["keys"])
+
+        def upload(item: Tuple[Dict[str, Any], Dict[str, Any]]) -> Dict[str, str]:
+            member, target = item
+            if publisher == "native":
+                with bundle.data(member) as data:
+                    outcome = publish_collection_native(member["filename"], target["publish_url"], retries, True,
+                                                        target["token"], data=data)
+                return {"status": outcome["status"], "message": outcome["message"]}
+            with tempfile.TemporaryDirectory(prefix="bundle-") as tmp_dir:
+                return publish_collection_galaxy(bundle.extract(member, tmp_dir, verify=False),
+                                                 target["publish_url"], target["token"])
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            for wave in plan["waves"]:
+                keys = []
+                for collection in wave:
+                    failed = sorted(dependency for dependency in versions[collection]["dependencies"]
+                                    if dependency in versions and not published(dependency))
+                    for key in sorted(versions[collection]["keys"]):
+                        if failed:
+                            statuses[key] = "dependency-error"
+                            print(f"Skipping {key[0]} {key[1]}: dependency not published: {', '.join(failed)}")
                         else:
-                            print(f"MANIFEST.json file is missing for {collection_path}")
-            else:
-                print(f"Namespace directory '{target_namespace}' does not exist.")
-                sys.exit(1)
+                            keys.append(key)
+
+                results = {}
+                for key, intact in zip(keys, executor.map(lambda key: bundle.verify(members[key]), keys)):
+                    if not intact:
+                        statuses[key] = "error"
+                        print(publish_message(members[key]["filename"], "error",
+                                              "it does not match its sha256 in the bundle"))
+                    elif not route_targets(members[key], targets):
+                        statuses[key] = "no-target"
+                        print(f"Skipping {key[0]} {key[1]}: no publish target matches its tags and namespace")
+                    else:
+                        results[key] = {"collection": key[0], "tarball": members[key]["filename"], "targets": {}}
+
+                uploads = [(members[key], target) for key in results for target in route_targets(members[key], targets)]
+                for (member, target), outcome in zip(uploads, executor.map(upload, uploads)):
+                    result = results[(member["collection"], member["version"])]
+                    result["targets"][target["name"]] = outcome
+                    print_outcome(result, target["name"], outcome)
+                for key, result in results.items():
+                    statuses[key] = combine_target_results(result)["status"]
+    return statuses
+
+
+def publish_target(result: Dict[str, Any], target: Dict[str, Any], publisher: str = "native",
+                   retries: int = 0, wait: bool = True) -> Dict[str, Any]:
+    """
+    Uploads a built collection to one publish target.
+
+    :param result: A result dict returned by build_stage with status "built".
+    :param target: The target, see publish_targets.
+    :param publisher: Either "native" or "ansible-galaxy".
+    :param retries: Number of retries of a transient failure (native publisher only, ansible-galaxy
+                    does not tell transient failures apart).
+    :param wait: Wait for the import task (the ansible-galaxy publisher always waits). Without waiting
+                 an accepted upload keeps the absolute import task URL in "task", see poll_imports.
+    :return: The outcome on the target: status, message, the task URL and the timing of the upload.
+    """
+    started = time.time()
+    outcome = {"status": "", "message": ""}
+    if publisher == "native":
+        published = publish_collection_native(result["tarball"], target["publish_url"], retries, wait,
+                                              target["token"])
+        outcome["status"] = published["status"]
+        if published["status"] == "error":
+            outcome["message"] = published["message"]
+        if not wait and published["status"] == "published" and published["task"]:
+            outcome["task"] = requests.compat.urljoin(target["publish_url"], published["task"])
+    else:
+        outcome.update(publish_collection_galaxy(result["tarball"], target["publish_url"], target["token"]))
+    outcome["timing"] = stage_timing(started, outcome["status"])
+    return outcome
+
+
+def print_outcome(result: Dict[str, Any], name: str, outcome: Dict[str, Any]) -> None:
+    """
+    Prints the outcome of an upload on a target, from the main thread.
+
+    :param result: The result dict of the collection.
+    :param name: Name of the target.
+    :param outcome: The outcome returned by publish_target.
+    """
+    print(f"[{name}] " + publish_message(result["tarball"], outcome["status"], outcome["message"],
+                                         queued="task" in outcome))
+
+
+def combine_target_results(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Derives the status, message and publish timing of a collection from its per-target outcomes
+    in result["targets"]. The collection is published when every target has it; otherwise the status
+    is the failure of a target (error before any other) and the message names the failed targets.
+
+    :param result: A result dict with "targets".
+    :return: The same dict.
+    """
+    outcomes = result["targets"]
+    failed = {name: outcome for name, outcome in outcomes.items() if outcome["status"] not in DONE_STATUSES}
+    if not failed:
+        statuses = {outcome["status"] for outcome in outcomes.values()}
+        result["status"] = "published" if "published" in statuses else "exists"
+        result["message"] = ""
+    else:
+        statuses = [outcome["status"] for outcome in failed.values()]
+        result["status"] = "error" if "error" in statuses else statuses[0]
+        if len(outcomes) == 1:
+            result["message"] = next(iter(failed.values()))["message"]
         else:
-            print("Usage: --namespace <namespace>")
-            sys.exit(1)
+            result["message"] = "; ".join(f"{name}: {outcome['message'] or outcome['status']}"
+                                          for name, outcome in sorted(failed.items()))
+
+    uploads = [outcome["timing"] for outcome in outcomes.values() if "timing" in outcome]
+    if uploads:
+        result.setdefault("timings", {})["publish"] = {"start": min(timing["start"] for timing in uploads),
+                                                       "end": max(timing["end"] for timing in uploads),
+                                                       "outcome": result["status"]}
+    return result
+
+
+def publish_stage(result: Dict[str, Any], publisher: str = "native", retries: int = 0, wait: bool = True,
+                  targets: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Publishes a built collection to its targets one after another and records the outcomes in its
+    result dict. run_collections uploads to several targets concurrently instead.
+
+    :param result: A result dict returned by build_stage.
+    :param publisher: Either "native" or "ansible-galaxy".
+    :param retries: Number of retries of a transient failure, see publish_target.
+    :param wait: Wait for the import tasks, see publish_target.
+    :param targets: Targets to upload to; by default the default target of the collection's publish path.
+    :return: The same dict with the per-target outcomes in "targets" and the combined status filled in.
+    """
+    if result["status"] != "built":
+        return result
+
+    if targets is None:
+        targets = [target for target in default_targets(ANSIBLE_GALAXY_SERVER_GALAXY_URL,
+                                                        ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)
+                   if target["publish_path"] == result["publish_path"]]
+        targets = targets or [make_target("default", ANSIBLE_GALAXY_SERVER_GALAXY_URL, result["publish_path"],
+                                          ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)]
+    outcomes = result.setdefault("targets", {})
+    for target in targets:
+        outcomes[target["name"]] = publish_target(result, target, publisher, retries, wait)
+        print_outcome(result, target["name"], outcomes[target["name"]])
+    return combine_target_results(result)
+
 
-    elif sys.argv[1] == "--all":
-        for namespace in os.listdir(collections_dir):
-            namespace_path = os.path.join(collections_dir, namespace)
-            if os.path.isdir(namespace_path) and not namespace.endswith('.info'):
+def poll_imports(uploaded: List[Dict[str, Any]], timeout: float = 300, workers: int = 8,
+                 targets: Optional[List[Dict[str, Any]]] = None) -> None:
+    """
+    Waits for the import tasks of uploads made without waiting, polling all of them concurrently,
+    and updates the per-target outcomes and the combined status of their result dicts.
+
+    :param uploaded: Result dicts whose targets were published with wait=False.
+    :param timeout: Maximum time to wait for an import in seconds.
+    :param workers: Maximum number of concurrent poll requests.
+    :param targets: Targets of the uploads, the default targets when None.
+    """
+    if targets is None:
+        targets = default_targets(ANSIBLE_GALAXY_SERVER_GALAXY_URL, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)
+    by_name = {target["name"]: target for target in targets}
+
+    poller = ImportPoller(workers=workers, timeout=timeout)
+    waiting = []
+    for result in uploaded:
+        for name, outcome in result.get("targets", {}).items():
+            if outcome.get("task"):
+                if name in by_name:
+                    client = get_client(by_name[name]["publish_url"], by_name[name]["token"])
+                else:
+                    client = get_client(ANSIBLE_GALAXY_SERVER_GALAXY_URL, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)
+                poller.add((result["collection"], name), outcome.pop("task"), client)
+                waiting.append((result, name))
+    if not waiting:
+        return
+    imports = poller.wait()
+
+    finished = {}
+    for result, name in waiting:
+        imported = imports[(result["collection"], name)]
+        outcome = result["targets"][name]
+        outcome.update(status=imported["status"], message=imported["message"], import_messages=imported["messages"])
+        uploaded_at = outcome["timing"]["end"]
+        span = finished.setdefault(result["collection"], {"start": uploaded_at, "end": 0.0, "outcome": "completed"})
+        span["start"] = min(span["start"], uploaded_at)
+        span["end"] = max(span["end"], uploaded_at + imported["seconds"])
+        if imported["status"] != "published":
+            span["outcome"] = imported["state"]
+
+        if imported["status"] == "published":
+            print(f"Collection {result['tarball']} imported on {name} after {imported['seconds']:.1f}s "
+                  f"({imported['polls']} polls).")
+        else:
+            print(f"Import of {result['tarball']} on {name} ended with {imported['state']}: {imported['message']}")
 
-                for collection in os.listdir(namespace_path):
-                    collection_path = os.path.join(namespace_path, collection)
+    for result in uploaded:
+        if result["collection"] in finished:
+            combine_target_results(result)
+            result["timings"]["import"] = finished[result["collection"]]
 
-                    if os.path.isdir(collection_path):
-                        manifest_file = os.path.join(collection_path, 'MANIFEST.json')
-                        galaxy_file = os.path.join(collection_path, 'galaxy.yml')
 
-                        if os.path.exists(manifest_file):
-                            convert_manifest_to_galaxy(manifest_file, galaxy_file)
-                            collection_tar = build_collection(
-                                base_path=collections_dir,
-                                collection_path=os.path.join(namespace, collection)
-                            )
+def _silence_worker(galaxy_workers: bool = False) -> None:
+    """
+    Discards the stdout of a build worker; its outcome is reported through the result dict.
+
+    :param galaxy_workers: Give the build worker its own warm ansible-galaxy worker.
+    """
+    sys.stdout = open(os.devnull, 'w')
+    configure_galaxy_workers(1 if galaxy_workers else 0)
+
 
-                            if collection_tar:
-                                publish_url = get_publish_url(galaxy_file, ANSIBLE_GALAXY_SERVER_GALAXY_URL)
-                                publish_collection(collection_tar, publish_url)
+def plan_collections(entries: List[Dict[str, Any]], targets: List[Dict[str, Any]], max_age: float = 3600,
+                     workers: int = 8
+                     ) -> Tuple[Dict[str, Dict[str, List[Tuple[str, str]]]], Dict[str, Dict[str, str]], Optional[Set[str]]]:
+    """
+    Fetches the remote catalog of every target the collections are published to (once per target,
+    cached for max_age seconds) and works out which local versions still have to be published.
+
+    :param entries: Inventory entries of the collections.
+    :param targets: Publish targets, see publish_targets.
+    :param max_age: Maximum age of a cached catalog in seconds, 0 forces a refresh.
+    :param workers: Number of concurrent catalog requests.
+    :return: The plan of every target, a collection to {target name: status} mapping of the targets
+             that need no upload ("exists" or "missing-namespace") and the names of all collections
+             available on the servers (None when no catalog could be fetched).
+    """
+    local = {}
+    for entry in entries:
+        for target in route_targets(entry, targets):
+            local.setdefault(target["name"], []).append((entry["fqcn"], entry["version"]))
+
+    plans = {}
+    planned = {}
+    available = None
+    for target in targets:
+        if target["name"] not in local:
+            continue
+        client = get_client(target["publish_url"], target["token"])
+        catalog = get_catalog_or_none(client, max_age=max_age, workers=workers)
+        if catalog is None:
+            continue
+
+        available = (available or set()) | set(catalog["collections"])
+        plan = plans[f"{target['publish_url']} ({target['name']})"] = plan_publish(local[target["name"]], catalog)
+        for status in ("exists", "missing-namespace"):
+            for collection, _ in plan[status]:
+                planned.setdefault(collection, {})[target["name"]] = status
+
+    return plans, planned, available
+
+
+def run_collections(collections_dir: str, entries: List[Dict[str, Any]], jobs: int = 1,
+                    output_dir: str = ".", state: Optional[CollectionState] = None,
+                    force: bool = False, builder: str = "native",
+                    publisher: str = "native",
+                    planned: Optional[Dict[str, Dict[str, str]]] = None,
+                    available: Optional[Set[str]] = None,
+                    publish_jobs: int = 1,
+                    journal: Optional[RunJournal] = None,
+                    retries: int = 0,
+                    metrics: Optional[RunMetrics] = None,
+                    verify: bool = False,
+                    wait_imports: bool = True,
+                    import_timeout: float = 300,
+                    targets: Optional[List[Dict[str, Any]]] = None,
+                    ignore_policy: Optional[Dict[str, List[str]]] = None) -> List[Dict[str, Any]]:
+    """
+    Runs the convert, build and publish stages for a list of collections.
+    With more than one job the build stage runs in a process pool; every worker writes
+    its tarball into a separate directory so concurrent builds never pick up each other's files.
+
+    Every collection is built once and uploaded to all publish targets its tags and namespace are
+    routed to; the uploads of a wave to all targets share the pool of publish_jobs threads. The
+    per-target outcomes are kept in the "targets" of each result, its status combines them.
+
+    Publishing follows the dependency order from collection_info.dependencies: the collections are
+    split into topological waves, each wave is uploaded concurrently once the previous wave is
+    published. Collections with missing dependencies or in a dependency cycle are reported up front
+    and not built; dependents of a failed upload are not uploaded.
+
+    When a state store is given, targets whose MANIFEST.json/FILES.json digest is unchanged since the
+    collection was last published there are skipped, and collections unchanged on all their targets
+    are skipped before galaxy.yml is generated. Targets listed in planned (already published or
+    without a remote namespace) are skipped as well.
+
+    Every stage is appended to the run journal when one is given. A resumed journal skips the
+    targets an earlier attempt already published to and reuses the tarballs it already built.
+
+    Builds are started longest first from the durations the state store recorded in earlier runs
+    (or the collection sizes), and the expected makespan is printed before the first build starts.
+
+    :param collections_dir: Path to the ansible_collections directory.
+    :param entries: Inventory entries of the collections.
+    :param jobs: Number of build processes.
+    :param output_dir: Directory for the built tarballs.
+    :param state: State store used to skip unchanged collections and record publish results.
+    :param force: Process unchanged collections as well; results are still recorded.
+    :param builder: Tarball builder passed to build_stage.
+    :param publisher: Publisher passed to publish_target.
+    :param planned: Collection to {target name: status} mapping of the targets known from the remote
+                    catalogs to need no upload.
+    :param available: Collections available on the server, used to detect missing dependencies.
+    :param publish_jobs: Number of concurrent uploads within a wave.
+    :param journal: Run journal to checkpoint every stage in and to resume from.
+    :param retries: Number of retries of an upload that failed transiently.
+    :param metrics: Collector of the per-collection stage events.
+    :param verify: Verify every built tarball against FILES.json before it is uploaded.
+    :param wait_imports: Wait for every import right after its upload. Otherwise a wave is uploaded without
+                         waiting and the import tasks of the whole wave are polled concurrently.
+    :param import_timeout: Maximum time to wait for an import in seconds.
+    :param targets: Publish targets, the default targets of ANSIBLE_GALAXY_SERVER_GALAXY_URL when None.
+    :param ignore_policy: build_ignore policy applied to every build, see build_stage.
+    :return: A list of per-collection result dicts.
+    """
+    if targets is None:
+        targets = default_targets(ANSIBLE_GALAXY_SERVER_GALAXY_URL, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)
+    results = []
+    fingerprints = {}
+    # Checkpoints of a resumed journal count only when they were made with the same build options
+    options = build_options(builder, ignore_policy, verify)
+    # The journal keeps the tarball paths, which must stay valid when a run is resumed from another directory
+    output_dir = os.path.abspath(output_dir)
+    pending = []
+    routes = {}   # collection -> targets it is published to
+    done = {}     # collection -> {target name: outcome} of the targets that need no upload
+    estimates = {}
+
+    def record(result: Dict[str, Any]) -> None:
+        if state is not None:
+            version, digest = fingerprints[result["collection"]]
+            statuses = {target["state_key"]: result["status"] for target in routes[result["collection"]]}
+            for target in routes[result["collection"]]:
+                if target["name"] in result.get("targets", {}):
+                    statuses[target["state_key"]] = result["targets"][target["name"]]["status"]
+            for server, status in statuses.items():
+                state.record(server, result["collection"], version, digest, status)
+            record_durations(result)
+        if metrics is not None:
+            metrics.record_result(result)
+        results.append(result)
+
+    def record_durations(result: Dict[str, Any]) -> None:
+        timings = result.get("timings", {})
+        if timings.get("build", {}).get("outcome") != "built":
+            return
+
+        def seconds(*stages: str) -> Optional[float]:
+            spans = [timings[stage]["end"] - timings[stage]["start"] for stage in stages if stage in timings]
+            return sum(spans) if spans else None
+
+        publish_seconds = seconds("publish", "import") if result["status"] in DONE_STATUSES else None
+        state.record_durations(result["collection"], seconds("convert", "build", "verify"), publish_seconds,
+                               os.path.getsize(result["tarball"]) if os.path.isfile(result["tarball"]) else None,
+                               estimates.get(result["collection"], {}).get("source_size"))
+
+    def record_build(result: Dict[str, str]) -> Dict[str, str]:
+        if journal is not None and result["status"] != "convert-error" and not result.get("reused"):
+            version, digest = fingerprints[result["collection"]]
+            journal.record(result["collection"], CONVERTED, version, digest, options,
+                           publish_path=result["publish_path"])
+            if result["status"] == "built":
+                journal.record(result["collection"], BUILT, version, digest, options,
+                               publish_path=result["publish_path"], tarball=result["tarball"],
+                               sha256=file_sha256(result["tarball"]))
+        return result
+
+    def record_publish(result: Dict[str, Any]) -> None:
+        if journal is not None and result["tarball"]:
+            version, digest = fingerprints[result["collection"]]
+            journal.record(result["collection"], JOURNAL_PUBLISHED, version, digest, options,
+                           status=result["status"], message=result["message"],
+                           targets={name: outcome["status"] for name, outcome in result.get("targets", {}).items()})
+        record(result)
+
+    for entry in entries:
+        collection = entry["fqcn"]
+        routes[collection] = route_targets(entry, targets)
+        if not routes[collection]:
+            results.append({"collection": collection, "tarball": "", "status": "no-target",
+                            "message": "no publish target matches its tags and namespace"})
+            continue
+
+        done[collection] = {}
+        if state is not None or journal is not None:
+            version, digest = entry["version"], collection_digest(entry["path"])
+            fingerprints[collection] = (version, digest)
+        if state is not None and not force:
+            unchanged = {}
+            for target in routes[collection]:
+                if state.is_unchanged(target["state_key"], collection, version, digest):
+                    status = state.get(target["state_key"], collection, version)[1]
+                    unchanged[target["name"]] = {"status": status, "message": "unchanged since the last run"}
+            if len(unchanged) == len(routes[collection]):
+                results.append({"collection": collection, "tarball": "", "status": "unchanged", "message": ""})
+                continue
+            done[collection].update(unchanged)
+
+        if journal is not None:
+            published = journal.checkpoint(collection, JOURNAL_PUBLISHED, version, digest, options)
+            if published:
+                statuses = published.get("targets") or {target["name"]: published["status"]
+                                                         for target in routes[collection]}
+                for name, status in statuses.items():
+                    if status in DONE_STATUSES:
+                        done[collection].setdefault(name, {"status": status, "message": "from the run journal"})
+
+        if planned and collection in planned:
+            for name, status in planned[collection].items():
+                done[collection].setdefault(name, {"status": status, "message": "from the remote catalog"})
+
+        if all(target["name"] in done[collection] for target in routes[collection]):
+            result = combine_target_results({"collection": collection, "tarball": "", "status": "",
+                                             "message": "", "targets": done[collection]})
+            if not result["message"]:
+                result["message"] = ", ".join(sorted({outcome["message"] for outcome in done[collection].values()}))
+            record(result)
+            continue
+
+        pending.append(entry)
+
+    if available is not None:
+        available = available | {result["collection"] for result in results
+                                 if result["status"] in ("unchanged",) + DONE_STATUSES}
+    plan = schedule(pending, available)
+    print_schedule(plan)
+
+    for collection, reason in sorted(plan["blocked"].items()):
+        record({"collection": collection, "tarball": "", "status": "dependency-error", "message": reason})
+
+    relpaths = {entry["fqcn"]: entry["relpath"] for entry in pending}
+    # Share the CPUs between the build processes and their hashing threads
+    verify_workers = max(1, (os.cpu_count() or 1) // max(jobs, 1))
+    reusable = {}
+    if journal is not None:
+        for entry in pending:
+            checkpoint = journal.built_tarball(entry["fqcn"], *fingerprints[entry["fqcn"]], options)
+            if checkpoint:
+                reusable[entry["fqcn"]] = {"collection": entry["fqcn"], "publish_path": checkpoint["publish_path"],
+                                           "tarball": checkpoint["tarball"], "status": "built",
+                                           "message": "", "reused": True}
+    dependencies = {entry["fqcn"]: set(entry.get("dependencies") or {}) for entry in pending}
+    failed = set()
+
+    scheduled = {collection for wave in plan["waves"] for collection in wave}
+    estimates.update(estimate_durations([entry for entry in pending if entry["fqcn"] in scheduled],
+                                        state.durations() if state is not None else {}))
+    # Blocked collections have a reusable tarball too but are neither scheduled nor estimated
+    for collection in reusable.keys() & scheduled:
+        estimates[collection]["build"] = 0.0
+    print_makespan(expected_makespan(plan["waves"], estimates, jobs, max(publish_jobs, 1)), estimates)
+
+    def build_failed(collection: str, e: Exception) -> Dict[str, str]:
+        return {"collection": collection, "tarball": "", "status": "build-error", "message": str(e)}
+
+    def upload(item: Tuple[Dict[str, Any], Dict[str, Any]]) -> Dict[str, Any]:
+        return publish_target(item[0], item[1], publisher, retries, wait_imports)
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_silence_worker,
+                             initargs=(builder != "native" and galaxy_pool() is not None,)) \
+            if jobs > 1 else nullcontext() as executor, \
+            ThreadPoolExecutor(max_workers=max(publish_jobs, 1)) as uploader:
+        builds = {}
+        if executor is not None:
+            # Submit every build longest first up front, so the longest builds never start last
+            # and later waves build while earlier ones upload
+            for collection in lpt_order(scheduled, {name: estimate["build"] for name, estimate in estimates.items()}):
+                if collection in reusable:
+                    continue
+                worker_output = os.path.join(output_dir, collection.replace('.', '-'))
+                os.makedirs(worker_output, exist_ok=True)
+                builds[collection] = executor.submit(build_stage, collections_dir, relpaths[collection],
+                                                     worker_output, builder, verify, verify_workers, ignore_policy)
+
+        for wave in plan["waves"]:
+            built = []
+            for collection in wave:
+                if dependencies[collection] & failed:
+                    failed.add(collection)
+                    record({"collection": collection, "tarball": "", "status": "dependency-error",
+                            "message": f"dependency not published: {', '.join(sorted(dependencies[collection] & failed))}"})
+                    if collection in builds:
+                        builds[collection].cancel()
+                    continue
+
+                try:
+                    if collection in reusable:
+                        print(f"Reusing the tarball built before: {reusable[collection]['tarball']}")
+                        built.append(reusable[collection])
+                    elif collection in builds:
+                        built.append(record_build(builds[collection].result()))
                     else:
-                        print(f"MANIFEST.json file is missing for {collection_path}")
+                        built.append(record_build(build_stage(collections_dir, relpaths[collection], output_dir,
+                                                              builder, verify, verify_workers, ignore_policy)))
+                except Exception as e:  # a crashed worker must not abort the whole run
+                    built.append(build_failed(collection, e))
+
+            # Fan out: every built tarball goes to all its remaining targets at once
+            uploads = [(result, target) for result in built if result["status"] == "built"
+                       for target in routes[result["collection"]] if target["name"] not in done[result["collection"]]]
+            uploads.sort(key=lambda item: -estimates[item[0]["collection"]]["publish"])
+            for (result, target), outcome in zip(uploads, uploader.map(upload, uploads)):
+                result.setdefault("targets", dict(done[result["collection"]]))[target["name"]] = outcome
+                print_outcome(result, target["name"], outcome)
+            for result in built:
+                if "targets" in result:
+                    combine_target_results(result)
+            poll_imports(built, import_timeout, max(publish_jobs, 1), targets)
+
+            for result in built:
+                if result["status"] not in DONE_STATUSES:
+                    failed.add(result["collection"])
+                record_publish(result)
+
+    return sorted(results, key=lambda item: item["collection"])
+
+
+def print_summary(results: List[Dict[str, Any]]) -> None:
+    """
+    Prints a per-collection result table and the totals per status, and per target and status
+    when the collections were published to more than one target.
+
+    :param results: A list of result dicts returned by run_collections.
+    """
+    if not results:
+        print("No collections were processed.")
+        return
+
+    width = max(len("COLLECTION"), *(len(result["collection"]) for result in results))
+    print()
+    print(f"{'COLLECTION'.ljust(width)}  STATUS")
+    for result in results:
+        line = f"{result['collection'].ljust(width)}  {result['status']}"
+        if result.get("message"):
+            line += f" ({result['message']})"
+        print(line)
+
+    totals = {}
+    for result in results:
+        totals[result["status"]] = totals.get(result["status"], 0) + 1
+    print()
+    print("Total: " + ", ".join(f"{status}: {count}" for status, count in sorted(totals.items())))
+
+    per_target = {}
+    for result in results:
+        for name, outcome in result.get("targets", {}).items():
+            per_target.setdefault(name, {}).setdefault(outcome["status"], 0)
+            per_target[name][outcome["status"]] += 1
+    if len(per_target) > 1:
+        for name, counts in sorted(per_target.items()):
+            print(f"  {name}: " + ", ".join(f"{status}: {count}" for status, count in sorted(counts.items())))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments.
+
+    :param argv: Arguments to parse, sys.argv[1:] by default.
+    :return: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Build and publish Ansible collections to the Ansible Galaxy server."
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--collection", metavar="<namespace>.<collection>",
+                        help="Publish a single collection")
+    target.add_argument("--namespace", metavar="<namespace>",
+                        help="Publish all collections within a given namespace")
+    target.add_argument("--all", action="store_true",
+                        help="Publish all available collections")
+    parser.add_argument("--jobs", "-j", type=int, nargs="?", const=os.cpu_count() or 1, default=1,
+                        metavar="N",
+                        help="Build collections in N parallel processes (CPU count when N is omitted)")
+    parser.add_argument("--publish-jobs", type=int, default=4, metavar="N",
+                        help="Upload up to N collections of the same dependency wave concurrently (default: 4)")
+    parser.add_argument("--max-concurrency", type=int, default=32, metavar="N",
+                        help="Upper bound of the adaptive number of concurrent requests per server (default: 32; "
+                             "a target's concurrency settings override it, --publish-jobs still caps uploads)")
+    parser.add_argument("--collections-dir", default=COLLECTIONS_DIR,
+                        help=f"Path to the ansible_collections directory (default: {COLLECTIONS_DIR})")
+    parser.add_argument("--inventory-cache", metavar="FILE",
+                        help="Persist the collections inventory in FILE so reruns only re-read what changed")
+    parser.add_argument("--targets", metavar="FILE",
+                        help="YAML file with the publish targets, their tokens and routing rules; every collection "
+                             "is built once and uploaded to all matching targets (default: the validated and "
+                             "aa-certified repositories of ANSIBLE_GALAXY_SERVER_GALAXY_URL)")
+    parser.add_argument("--output-dir", default=".",
+                        help="Directory for the built tarballs (default: current directory)")
+    parser.add_argument("--builder", choices=("native", "ansible-galaxy"), default="native",
+                        help="Build tarballs in-process (native) or with `ansible-galaxy collection build`")
+    parser.add_argument("--publisher", choices=("native", "ansible-galaxy"), default="native",
+                        help="Upload with the in-process Galaxy client (native) or `ansible-galaxy collection publish`")
+    parser.add_argument("--build-ignore", nargs="?", const="default", metavar="POLICY",
+                        help="Analyze every collection and write the matching patterns of a build_ignore policy "
+                             "(YAML file, the built-in policy without a value) into galaxy.yml, leaving tests, docs, "
+                             "CI files, caches and changelog fragments out of the tarballs; prints the bytes saved")
+    parser.add_argument("--warm-galaxy", action="store_true",
+                        help="Run the ansible-galaxy builds and uploads on warm worker processes that import ansible "
+                             "once, instead of starting a new ansible-galaxy process for every command")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE,
+                        help=f"SQLite file with the digests of published collections (default: {DEFAULT_STATE_FILE})")
+    parser.add_argument("--journal-file", default=DEFAULT_JOURNAL_FILE,
+                        help=f"Append-only journal of the run's stages (default: {DEFAULT_JOURNAL_FILE})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the run recorded in the journal: skip published collections, reuse built tarballs")
+    parser.add_argument("--retries", type=int, default=3, metavar="N",
+                        help="Retry an upload that failed transiently up to N times with backoff (default: 3)")
+    parser.add_argument("--events-file", metavar="FILE",
+                        help="Write a JSON-lines timing event for every collection and stage to FILE ('-' for stderr)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Run under cProfile, write the stats to FILE and print the top functions "
+                             "(build worker processes are not profiled)")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="Upload a dependency wave without waiting for each import, then poll all its "
+                             "import tasks concurrently (native publisher only)")
+    parser.add_argument("--import-timeout", type=float, default=300, metavar="SECONDS",
+                        help="Maximum time to wait for an import task (default: 300)")
+    parser.add_argument("--watch", action="store_true",
+                        help="After the run keep watching the collections directory and publish the selected "
+                             "collections as soon as they are installed or changed")
+    parser.add_argument("--debounce", type=float, default=2.0, metavar="SECONDS",
+                        help="With --watch, wait until a collection has been quiet for SECONDS (default: 2)")
+    parser.add_argument("--watch-queue", type=int, default=4, metavar="N",
+                        help="With --watch, hold at most N batches waiting to be published (default: 4)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Verify every built tarball against the FILES.json checksums before uploading it")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild and republish collections even if they are unchanged")
+    parser.add_argument("--convert-only", action="store_true",
+                        help="Only write galaxy.yml for the selected collections and report how many changed")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Only process shard i of N: every collection belongs to exactly one shard by a stable, "
+                             "size-balanced hash, so N nodes can split the tree without coordination; collections "
+                             "that depend on each other stay on one shard")
+    parser.add_argument("--report", metavar="FILE",
+                        help="Write the results of the run as JSON to FILE; merge the reports of all shards with "
+                             "collection_shards.py")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only print which collection versions are missing on the server and exit")
+    parser.add_argument("--no-catalog", action="store_true",
+                        help="Do not fetch the remote catalog before building")
+    parser.add_argument("--catalog-max-age", type=float, default=3600, metavar="SECONDS",
+                        help="Reuse a cached remote catalog younger than SECONDS (default: 3600, 0 refreshes)")
+    args = parser.parse_args(argv)
+    if args.shard and args.watch:
+        # New collections would shift the assignment of the other shards
+        parser.error("--shard cannot be combined with --watch")
+    return args
+
+
+def run(args: argparse.Namespace, metrics: RunMetrics, targets: List[Dict[str, Any]]) -> None:
+    """
+    Selects the collections and runs the pipeline for them.
+
+    :param args: Parsed command line arguments.
+    :param metrics: Collector of the stage events.
+    :param targets: Publish targets.
+    """
+    collections_dir = args.collections_dir
+
+    started = time.time()
+    inventory = scan_inventory(collections_dir, args.inventory_cache)
+    metrics.stage("inventory", started, time.time(), count=len(inventory))
+
+    if args.collection:
+        parts = args.collection.split(".")
+        if len(parts) != 2:
+            print("Incorrect collection format. Expected: <namespace>.<collection>")
+            sys.exit(1)
+
+        full_collection_path = os.path.join(collections_dir, *parts)
+        if not os.path.exists(full_collection_path):
+            print(f"Collection path '{full_collection_path}' does not exist.")
+            sys.exit(1)
+
+        entry = inventory.get(args.collection)
+        if entry is None:
+            print(f"MANIFEST.json file is missing for {full_collection_path}")
+            sys.exit(0)
+
+        entries = [entry]
+
+    elif args.namespace:
+        if args.namespace not in inventory.namespaces():
+            print(f"Namespace directory '{args.namespace}' does not exist.")
+            sys.exit(1)
+
+        entries = find_collections(inventory, args.namespace)
+
+    else:
+        entries = find_collections(inventory)
+
+    shard = None
+    if args.shard:
+        entries, shard = select_shard(entries, *args.shard)
+        print_shard(shard)
+
+    if args.convert_only:
+        started = time.time()
+        report = convert_collections(entries, args.ignore_policy)
+        metrics.stage("convert", started, time.time(), outcome="failed" if report["failed"] else "ok",
+                      count=report["changed"] + report["unchanged"])
+        for galaxy_file, error in sorted(report["failed"].items()):
+            print(f"Error writing {galaxy_file}: {error}")
+        print(f"galaxy.yml changed: {report['changed']}, unchanged: {report['unchanged']}, "
+              f"failed: {len(report['failed'])}")
+        if args.ignore_policy is not None:
+            print_ignore_report(report["build_ignore"])
+        return
+
+    if args.plan:
+        plans, planned, available = catalog_stage(args, entries, metrics, targets)
+        print_plan(plans)
+        print_schedule(schedule([entry for entry in entries
+                                 if len(planned.get(entry["fqcn"], {})) < len(route_targets(entry, targets))],
+                                available))
+        return
+
+    with RunJournal(args.journal_file, resume=args.resume) as journal:
+        # Dependencies on the other shards are published by their nodes
+        results = publish_entries(args, entries, metrics, journal, targets,
+                                  external=set(shard["others"]) if shard else None)
+        if args.report:
+            write_report(args.report, results, shard, started)
+        if args.watch:
+            watch_and_publish(args, inventory, metrics, journal, targets)
+    metrics.print_summary()
+
+
+def catalog_stage(args: argparse.Namespace, entries: List[Dict[str, Any]], metrics: RunMetrics,
+                  targets: List[Dict[str, Any]]
+                  ) -> Tuple[Dict[str, Dict[str, List[Tuple[str, str]]]], Dict[str, Dict[str, str]], Optional[Set[str]]]:
+    """
+    Runs plan_collections and records it as the "catalog" stage.
+
+    :return: The return value of plan_collections.
+    """
+    started = time.time()
+    plans, planned, available = plan_collections(entries, targets, max_age=args.catalog_max_age)
+    metrics.stage("catalog", started, time.time(), outcome="ok" if plans else "unavailable", count=len(planned))
+    return plans, planned, available
+
+
+def publish_entries(args: argparse.Namespace, entries: List[Dict[str, Any]], metrics: RunMetrics,
+                    journal: RunJournal, targets: List[Dict[str, Any]],
+                    external: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Runs the pipeline for the given collections and prints the result table.
+
+    :param args: Parsed command line arguments.
+    :param entries: Inventory entries of the collections.
+    :param metrics: Collector of the stage events.
+    :param journal: Run journal of the run.
+    :param targets: Publish targets.
+    :param external: Collections published by another node (the other shards), counted as available dependencies.
+    :return: The results of run_collections.
+    """
+    planned = {}
+    available = None
+    if not args.no_catalog:
+        _, planned, available = catalog_stage(args, entries, metrics, targets)
+    if available is not None and external:
+        available = available | external
+
+    with CollectionState(args.state_file) as state:
+        results = run_collections(args.collections_dir, entries, jobs=args.jobs, output_dir=args.output_dir,
+                                  state=state, force=args.force, builder=args.builder,
+                                  publisher=args.publisher, planned=None if args.force else planned,
+                                  available=available, publish_jobs=args.publish_jobs,
+                                  journal=journal, retries=args.retries, metrics=metrics,
+                                  verify=args.verify, wait_imports=not args.no_wait,
+                                  import_timeout=args.import_timeout, targets=targets,
+                                  ignore_policy=args.ignore_policy)
+    print_summary(results)
+    if args.ignore_policy is not None:
+        print_ignore_report({result["collection"]: result["build_ignore"] for result in results
+                             if "build_ignore" in result})
+    return results
+
+
+def watch_and_publish(args: argparse.Namespace, inventory: Inventory, metrics: RunMetrics,
+                      journal: RunJournal, targets: List[Dict[str, Any]]) -> None:
+    """
+    Watches the collections directory and publishes the selected collections whenever their
+    MANIFEST.json is written, until interrupted. Each batch refreshes the inventory incrementally,
+    so only the manifests of changed collections are read again.
+
+    :param args: Parsed command line arguments.
+    :param inventory: Inventory of the initial run.
+    :param metrics: Collector of the stage events.
+    :param journal: Run journal of the run.
+    :param targets: Publish targets.
+    """
+    if args.collection:
+        selected = lambda fqcn: fqcn == args.collection  # noqa: E731
+    elif args.namespace:
+        selected = lambda fqcn: fqcn.split(".", 1)[0] == args.namespace  # noqa: E731
+    else:
+        selected = None
+    current = {"inventory": inventory}
+
+    def publish_changed(collections: List[str]) -> None:
+        refreshed = Inventory(args.collections_dir).scan(current["inventory"])
+        current["inventory"] = refreshed
+        if args.inventory_cache:
+            refreshed.save(args.inventory_cache)
+
+        entries = []
+        for collection in collections:
+            entry = refreshed.get(collection)
+            if entry is None:
+                print(f"Skipping {collection}: its MANIFEST.json is missing or unreadable")
+            else:
+                entries.append(entry)
+        if entries:
+            publish_entries(args, entries, metrics, journal, targets)
+
+    watch_collections(args.collections_dir, publish_changed, selected, debounce=args.debounce,
+                      queue_size=args.watch_queue)
+
+
+def main() -> None:
+    """
+    Main entry point of the program.
+    Performs the building and publishing of Ansible collections.
+
+    Usage:
+    python script.py --collection <namespace>.<collection>  # Publish a single collection
+    python script.py --namespace <namespace>                # Publish all collections within a given namespace
+    python script.py --all                                  # Publish all available collections
+    python script.py --all --jobs [N]                       # Build in N parallel processes
+    python script.py --all --plan                           # Print what would be published and exit
+    python script.py --all --resume                         # Continue an interrupted run from its journal
+    python script.py --all --events-file events.jsonl       # Write per-stage timing events
+    python script.py --all --watch                          # Keep publishing collections as they are installed
+    python script.py --all --targets targets.yml            # Publish every build to several servers
+    python script.py --all --shard 2/4 --report r2.json     # Process the second of four shards of the tree
+    """
+    args = parse_args()
+    args.ignore_policy = None
+    if args.build_ignore:
+        try:
+            args.ignore_policy = load_ignore_policy(None if args.build_ignore == "default" else args.build_ignore)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            print(f"Invalid build_ignore policy {args.build_ignore}: {e}")
+            sys.exit(1)
+    if args.targets:
+        try:
+            targets = load_targets(args.targets)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            print(f"Invalid targets file {args.targets}: {e}")
+            sys.exit(1)
     else:
-        print(f"Unknown option: {sys.argv[1]}. Use one of the supported options:")
-        print("--collection <namespace>.<collection>  # Publish a single collection")
-        print("--namespace <namespace>                # Publish all collections within a given namespace")
-        print("--all                                  # Publish all available collections")
-        sys.exit(1)
+        missing_envs = check_env()
+        if missing_envs:
+            print(f"The following required environment variables are missing: {', '.join(missing_envs)}")
+            sys.exit(1)
+        targets = default_targets(ANSIBLE_GALAXY_SERVER_GALAXY_URL, ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)
+
+    configure_limiter("*", max_limit=args.max_concurrency)
+    for target in targets:
+        if target["concurrency"]:
+            configure_limiter(target["url"], **target["concurrency"])
+
+    if "ansible-galaxy" in (args.builder, args.publisher) and args.warm_galaxy:
+        configure_galaxy_workers(max(args.publish_jobs, 1) if args.publisher != "native" else 1)
+        # Start the upload workers now, before any thread of the run exists
+        if args.publisher != "native":
+            galaxy_pool().start()
+
+    try:
+        with RunMetrics(args.events_file) as metrics:
+            set_limit_listener(metrics.limit)
+            if args.profile:
+                run_profiled(run, args.profile, args, metrics, targets)
+            else:
+                run(args, metrics, targets)
+    finally:
+        close_galaxy_workers()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
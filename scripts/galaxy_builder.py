@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In-process builder for Galaxy collection tarballs.
+
+Writes the same archive layout as `ansible-galaxy collection build` straight from an installed
+collection directory: MANIFEST.json and FILES.json first, then every entry listed in FILES.json.
+The checksums already stored in FILES.json are reused, MANIFEST.json is generated in memory
+and nothing is written into the source tree, so the collection directory may be read-only.
+Entries matching build_ignore of the collection metadata are left out of the tarball and its FILES.json.
+"""
+
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+from build_ignore import matching_pattern
+
+# Keys of collection_info in a MANIFEST.json built by ansible-galaxy
+MANIFEST_COLLECTION_KEYS = (
+    "namespace", "name", "version", "authors", "readme", "tags", "description", "license",
+    "license_file", "dependencies", "repository", "documentation", "homepage", "issues",
+)
+
+
+def _reset_stat(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+    """
+    Normalizes ownership and permissions of a member the same way ansible-galaxy does.
+    """
+    if tarinfo.type != tarfile.SYMTYPE:
+        tarinfo.mode = 0o0755 if tarinfo.mode & stat.S_IXUSR or tarinfo.isdir() else 0o0644
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    return tarinfo
+
+
+def _add_bytes(tar_file: tarfile.TarFile, name: str, data: bytes, mtime: int) -> None:
+    tar_info = tarfile.TarInfo(name)
+    tar_info.size = len(data)
+    tar_info.mtime = mtime
+    tar_info.mode = 0o0644
+    tar_file.addfile(tarinfo=tar_info, fileobj=io.BytesIO(data))
+
+
+def _is_child_path(path: str, parent_path: str) -> bool:
+    return path == parent_path or path.startswith(parent_path.rstrip(os.sep) + os.sep)
+
+
+def render_manifest(manifest_data: Dict[str, Any], collection_info: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    Renders MANIFEST.json for the tarball.
+
+    :param manifest_data: Contents of the installed MANIFEST.json.
+    :param collection_info: Collection metadata (for example the generated galaxy.yml data)
+                            that replaces collection_info of the installed manifest.
+    :return: The MANIFEST.json bytes in the format written by ansible-galaxy.
+    """
+    manifest = dict(manifest_data)
+    if collection_info is not None:
+        info = {key: collection_info.get(key) for key in MANIFEST_COLLECTION_KEYS}
+        for key in ("authors", "tags", "license"):
+            info[key] = info[key] or []
+        info["dependencies"] = info["dependencies"] or {}
+        manifest["collection_info"] = info
+    return json.dumps(manifest, indent=True, sort_keys=True).encode('utf-8')
+
+
+def build_collection_tarball(collection_dir: str, output_path: str = ".",
+                             collection_info: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Builds a Galaxy-compatible collection tarball without running ansible-galaxy.
+
+    :param collection_dir: Path to the installed collection (containing MANIFEST.json and FILES.json).
+    :param output_path: Directory the tarball is written to.
+    :param collection_info: Collection metadata injected into MANIFEST.json instead of writing galaxy.yml;
+                            its build_ignore patterns are applied.
+    :return: The path of the built archive (.tar.gz).
+    :raises FileNotFoundError: When MANIFEST.json, FILES.json or a file listed in FILES.json is missing.
+    """
+    collection_dir = os.path.realpath(collection_dir)
+
+    with open(os.path.join(collection_dir, 'MANIFEST.json'), 'rb') as f:
+        manifest_data = json.load(f)
+    with open(os.path.join(collection_dir, 'FILES.json'), 'rb') as f:
+        files_json = f.read()
+
+    files_manifest = json.loads(files_json)
+    build_ignore = (collection_info or {}).get("build_ignore")
+    if build_ignore:
+        files_manifest["files"] = [entry for entry in files_manifest["files"]
+                                   if entry["name"] == "." or matching_pattern(entry["name"], build_ignore) is None]
+        files_json = json.dumps(files_manifest, indent=True, sort_keys=True).encode('utf-8')
+        manifest_data = dict(manifest_data, file_manifest_file=dict(manifest_data.get("file_manifest_file") or {},
+                                                                    chksum_sha256=hashlib.sha256(files_json).hexdigest()))
+    manifest_json = render_manifest(manifest_data, collection_info)
+    info = json.loads(manifest_json)["collection_info"]
+
+    tarball = os.path.join(output_path, f"{info['namespace']}-{info['name']}-{info['version']}.tar.gz")
+    mtime = int(time.time())
+
+    # Write into a temporary file first so a failed build never leaves a truncated tarball behind
+    fd, tmp_path = tempfile.mkstemp(prefix=".build-", suffix=".tar.gz", dir=output_path)
+    try:
+        with os.fdopen(fd, 'wb') as raw, tarfile.open(fileobj=raw, mode='w:gz') as tar_file:
+            _add_bytes(tar_file, 'MANIFEST.json', manifest_json, mtime)
+            _add_bytes(tar_file, 'FILES.json', files_json, mtime)
+
+            for file_info in files_manifest['files']:
+                if file_info['name'] == '.':
+                    continue
+
+                filename = file_info['name']
+                src_path = os.path.join(collection_dir, filename)
+
+                if os.path.islink(src_path):
+                    link_target = os.path.realpath(src_path)
+                    if _is_child_path(link_target, collection_dir):
+                        tar_info = tarfile.TarInfo(filename)
+                        tar_info.type = tarfile.SYMTYPE
+                        tar_info.linkname = os.path.relpath(link_target, start=os.path.dirname(src_path))
+                        tar_file.addfile(tarinfo=_reset_stat(tar_info))
+                        continue
+
+                tar_file.add(os.path.realpath(src_path), arcname=filename, recursive=False, filter=_reset_stat)
+
+        os.chmod(tmp_path, 0o0644)
+        os.replace(tmp_path, tarball)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return tarball
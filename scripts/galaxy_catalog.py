@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Remote catalog of a Galaxy / Automation Hub server and the publish plan computed from it.
+
+The catalog (existing namespaces and collection versions) is fetched once per server with
+concurrent paginated requests and cached in a JSON file, so the collections that already exist
+remotely or whose namespace is missing are known before anything is built.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from galaxy_client import GalaxyClient
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "ansible-collections-publish",
+    "catalog"
+)
+PAGE_SIZE = 100
+
+
+def fetch_paginated(client: GalaxyClient, url: str, workers: int = 8) -> List[Dict[str, Any]]:
+    """
+    Fetches every item of a paginated Galaxy v3 list endpoint.
+    The first page gives the total count, the remaining pages are requested concurrently.
+
+    :param client: Client of the server.
+    :param url: Absolute URL of the list endpoint.
+    :param workers: Number of concurrent requests.
+    :return: The items of all pages in server order.
+    """
+    def get_page(offset: int) -> Dict[str, Any]:
+        response = client.request("GET", url, params={"limit": PAGE_SIZE, "offset": offset})
+        response.raise_for_status()
+        return response.json()
+
+    first = get_page(0)
+    items = list(first.get("data", []))
+    count = first.get("meta", {}).get("count", len(items))
+
+    offsets = range(PAGE_SIZE, count, PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page in executor.map(get_page, offsets):
+            items.extend(page.get("data", []))
+    return items
+
+
+def fetch_catalog(client: GalaxyClient, workers: int = 8) -> Dict[str, Any]:
+    """
+    Fetches the namespaces and collection versions of a server.
+
+    :param client: Client of the server.
+    :param workers: Number of concurrent requests.
+    :return: A dict with the sorted namespace list, a "<namespace>.<name>": [versions] mapping and the fetch time.
+    """
+    api_url = client.api_url()
+    namespaces = {item["name"] for item in fetch_paginated(client, api_url + "namespaces/", workers)}
+    collections = fetch_paginated(client, api_url + "collections/", workers)
+
+    def get_versions(collection: Dict[str, Any]) -> Tuple[str, List[str]]:
+        name = f"{collection['namespace']}.{collection['name']}"
+        url = f"{api_url}collections/{collection['namespace']}/{collection['name']}/versions/"
+        return name, sorted(item["version"] for item in fetch_paginated(client, url, workers=1))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        versions = dict(executor.map(get_versions, collections))
+
+    namespaces.update(name.split('.', 1)[0] for name in versions)
+    return {"namespaces": sorted(namespaces), "collections": versions, "fetched_at": time.time()}
+
+
+def catalog_cache_file(server_url: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """
+    :param server_url: Galaxy server URL.
+    :param cache_dir: Directory of the catalog cache.
+    :return: Path of the cache file of the server.
+    """
+    return os.path.join(cache_dir, hashlib.sha256(server_url.encode()).hexdigest()[:16] + ".json")
+
+
+def load_catalog(client: GalaxyClient, max_age: float = 3600, cache_dir: str = DEFAULT_CACHE_DIR,
+                 workers: int = 8) -> Dict[str, Any]:
+    """
+    Returns the catalog of a server from the cache, fetching it when the cache is missing or older than max_age.
+
+    :param client: Client of the server.
+    :param max_age: Maximum age of the cached catalog in seconds, 0 forces a refresh.
+    :param cache_dir: Directory of the catalog cache.
+    :param workers: Number of concurrent requests.
+    :return: The catalog, see fetch_catalog.
+    """
+    cache_file = catalog_cache_file(client.server_url, cache_dir)
+    try:
+        with open(cache_file, 'r') as f:
+            catalog = json.load(f)
+        if time.time() - catalog.get("fetched_at", 0) < max_age:
+            return catalog
+    except (OSError, ValueError):
+        pass
+
+    catalog = fetch_catalog(client, workers)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(tmp_file, cache_file)
+    return catalog
+
+
+def plan_publish(local: Iterable[Tuple[str, str]], catalog: Dict[str, Any]) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Compares local collection versions with the remote catalog.
+
+    :param local: (<namespace>.<collection>, version) pairs of the local collections.
+    :param catalog: The remote catalog, see fetch_catalog.
+    :return: A dict with the "publish", "exists" and "missing-namespace" lists of (collection, version) pairs.
+    """
+    namespaces = set(catalog["namespaces"])
+    plan = {"publish": [], "exists": [], "missing-namespace": []}
+
+    for collection, version in local:
+        if version in catalog["collections"].get(collection, ()):
+            plan["exists"].append((collection, version))
+        elif collection.split('.', 1)[0] not in namespaces:
+            plan["missing-namespace"].append((collection, version))
+        else:
+            plan["publish"].append((collection, version))
+    return plan
+
+
+def print_plan(plans: Dict[str, Dict[str, List[Tuple[str, str]]]]) -> None:
+    """
+    Prints the publish plan of every server.
+
+    :param plans: Server URL to plan mapping, see plan_publish.
+    """
+    for server_url, plan in sorted(plans.items()):
+        print(f"Server: {server_url}")
+        for status in ("publish", "missing-namespace", "exists"):
+            for collection, version in sorted(plan[status]):
+                print(f"  {status:<18} {collection} {version}")
+
+        missing_namespaces = sorted({collection.split('.', 1)[0] for collection, _ in plan["missing-namespace"]})
+        print(f"  to publish: {len(plan['publish'])}, already published: {len(plan['exists'])}, "
+              f"missing namespaces: {', '.join(missing_namespaces) or 'none'}")
+
+
+def get_catalog_or_none(client: GalaxyClient, **kwargs: Any) -> Optional[Dict[str, Any]]:
+    """
+    Like load_catalog, but reports a failure and returns None so the caller can fall back
+    to discovering existing collections at publish time.
+    """
+    try:
+        return load_catalog(client, **kwargs)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Could not fetch the catalog of {client.server_url}: {e}")
+        return None
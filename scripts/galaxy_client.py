@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In-process client for publishing collections to Ansible Galaxy / Automation Hub.
+
+Uses one requests session (a keep-alive connection pool) per server, discovers the API once,
+streams the multipart upload from disk and classifies the outcome from the HTTP status and the
+JSON error body instead of ansible-galaxy stderr. Every request goes through the adaptive
+concurrency limiter of its server, see galaxy_limits.
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import warnings
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from collection_state import file_sha256
+from galaxy_limits import AIMDLimiter, get_limiter, parse_retry_after
+
+# Publish statuses, the same values publish_collection in exports_collections.py returns
+PUBLISHED = "published"
+EXISTS = "exists"
+MISSING_NAMESPACE = "missing-namespace"
+ERROR = "error"
+
+CHUNK_SIZE = 1024 * 1024
+MIB = 1024 * 1024
+
+# Final states of an import task
+IMPORT_FINISHED_STATES = ("completed", "failed", "success", "error")
+IMPORT_OK_STATES = ("completed", "success")
+
+# Upload failures that may go away when the upload is retried a moment later
+TRANSIENT_HTTP_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class MultipartFile:
+    """
+    File-like multipart/form-data body that streams the tarball from disk, or from a buffer such as
+    a member of a memory-mapped bundle. The total length is known up front, so requests sends a
+    Content-Length instead of chunked encoding.
+    """
+
+    def __init__(self, path: str, fields: Dict[str, str], file_field: str = "file", data: Any = None) -> None:
+        """
+        :param path: Tarball to send; only its file name is used when data is given.
+        :param fields: Form fields sent before the file.
+        :param file_field: Name of the file field.
+        :param data: Bytes-like contents of the file (for example a memoryview) instead of reading path.
+        """
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+        head = b""
+        for name, value in fields.items():
+            head += (f"--{self.boundary}\r\n"
+                     f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                     f"{value}\r\n").encode()
+        head += (f"--{self.boundary}\r\n"
+                 f"Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{os.path.basename(path)}\"\r\n"
+                 f"Content-Type: application/octet-stream\r\n\r\n").encode()
+
+        self._parts = [head, path if data is None else data, f"\r\n--{self.boundary}--\r\n".encode()]
+        self._length = (len(head) + (os.path.getsize(path) if data is None else memoryview(data).nbytes)
+                        + len(self._parts[2]))
+        self._current = None
+        self._index = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size: int = -1) -> bytes:
+        result = b""
+        while self._index < len(self._parts) and (size < 0 or len(result) < size):
+            if self._current is None:
+                part = self._parts[self._index]
+                self._current = open(part, 'rb') if isinstance(part, str) else _BytesReader(part)
+
+            chunk = self._current.read(-1 if size < 0 else size - len(result))
+            if chunk:
+                result += chunk
+                continue
+
+            self._current.close()
+            self._current = None
+            self._index += 1
+        return result
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
+class _BytesReader:
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+        self._offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._data) if size < 0 else self._offset + size
+        chunk = self._data[self._offset:end]
+        self._offset += len(chunk)
+        return chunk
+
+    def close(self) -> None:
+        pass
+
+
+def _error_details(response: requests.Response) -> List[str]:
+    """
+    Extracts the error messages from a Galaxy v3 ({"errors": [...]}) or v2 ({"message": ...}) error body.
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        return [response.text.strip()] if response.text.strip() else []
+
+    if isinstance(body, dict):
+        if isinstance(body.get("errors"), list):
+            return [str(error.get("detail") or error.get("title") or error.get("code") or error)
+                    if isinstance(error, dict) else str(error) for error in body["errors"]]
+        if body.get("message") or body.get("detail"):
+            return [str(body.get("message") or body.get("detail"))]
+    return [json.dumps(body)]
+
+
+def classify_response(response: requests.Response) -> Dict[str, Any]:
+    """
+    Turns an upload response into a structured publish result.
+
+    :param response: Response of the artifact upload request.
+    :return: A dict with status (published, exists, missing-namespace or error), message, HTTP code,
+             import task URL and whether the failure is transient.
+    """
+    result = {"status": ERROR, "message": "", "http_status": response.status_code, "task": "",
+              "transient": response.status_code in TRANSIENT_HTTP_STATUSES}
+
+    if response.status_code in (200, 201, 202):
+        result["status"] = PUBLISHED
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            result["task"] = str(body.get("task") or "")
+        return result
+
+    details = _error_details(response)
+    message = "; ".join(details)
+    result["message"] = message or response.reason or ""
+    lowered = message.lower()
+
+    if response.status_code == 409 or "already exists" in lowered:
+        result.update(status=EXISTS, transient=False)
+    elif "namespace" in lowered and ("not exist" in lowered or "not found" in lowered or "unknown" in lowered):
+        result.update(status=MISSING_NAMESPACE, transient=False)
+    return result
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter: a random delay between 0 and base * 2 ** attempt, at most cap.
+    Spreads the retries of concurrent uploads so they do not hit a recovering server at the same moment.
+
+    :param attempt: Number of the retry, starting at 0.
+    :param base: Delay of the first retry in seconds.
+    :param cap: Maximum delay in seconds.
+    :return: The delay in seconds.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class GalaxyClient:
+    """
+    Galaxy / Automation Hub API client bound to a single server URL.
+    """
+
+    def __init__(self, server_url: str, token: Optional[str] = None, verify: bool = False,
+                 timeout: float = 60, pool_size: int = 10, limiter: Optional[AIMDLimiter] = None) -> None:
+        """
+        :param server_url: Galaxy server URL, for example https://hub/api/galaxy/content/validated/.
+        :param token: API token sent as "Authorization: Token <token>".
+        :param verify: Verify TLS certificates (ansible-galaxy --ignore-certs is verify=False).
+        :param timeout: Timeout of a single request in seconds.
+        :param pool_size: Maximum number of keep-alive connections kept open to the server.
+        :param limiter: Concurrency limiter of the requests, the shared limiter of the server by default.
+        """
+        self.server_url = server_url.rstrip('/') + '/'
+        self.timeout = timeout
+        self.limiter = limiter or get_limiter(self.server_url)
+        self._api_path = None
+        self._upload_path = "artifacts/collections/"
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = "application/json"
+        if token:
+            self.session.headers["Authorization"] = f"Token {token}"
+
+    def request(self, method: str, url: str, kind: str = "api", cost: float = 1.0,
+                **kwargs: Any) -> requests.Response:
+        """
+        Sends a request once the server's limiter grants a slot and reports the outcome to the limiter.
+
+        :param method: HTTP method.
+        :param url: Absolute URL.
+        :param kind: Kind of request for the latency comparison of the limiter.
+        :param cost: Size of the request relative to a typical API call.
+        :param kwargs: Keyword arguments of requests.Session.request.
+        :return: The response.
+        """
+        started = self.limiter.acquire()
+        try:
+            with warnings.catch_warnings():
+                if not self.session.verify:
+                    # Like ansible-galaxy --ignore-certs: the unverified requests are intended, do not warn about each
+                    warnings.simplefilter("ignore", urllib3.exceptions.InsecureRequestWarning)
+                # Passed explicitly, requests would let REQUESTS_CA_BUNDLE override the session's verify=False
+                kwargs.setdefault("verify", self.session.verify)
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.limiter.release(started, failed=True, kind=kind, cost=cost)
+            raise
+        except BaseException:
+            self.limiter.release(started, kind=kind, cost=cost)
+            raise
+        self.limiter.release(started, response.status_code, parse_retry_after(response.headers.get("Retry-After")),
+                             kind=kind, cost=cost)
+        return response
+
+    def api_url(self) -> str:
+        """
+        Discovers the API version of the server once and returns the v3 (or v2) API root.
+
+        :return: The absolute URL of the API root.
+        """
+        if self._api_path is None:
+            response = self.request("GET", self.server_url)
+            response.raise_for_status()
+            body = response.json()
+            versions = body.get("available_versions") if isinstance(body, dict) else None
+            versions = versions if isinstance(versions, dict) else {}
+            self._api_path = versions.get("v3") or versions.get("v2") or "v3/"
+            self._upload_path = "artifacts/collections/" if "v3" in versions or not versions else "collections/"
+        return requests.compat.urljoin(self.server_url, self._api_path)
+
+    def upload(self, collection_tar: str, data: Any = None) -> Dict[str, Any]:
+        """
+        Uploads a collection tarball without waiting for the server-side import.
+
+        :param collection_tar: Path to the collection tarball.
+        :param data: Bytes-like contents of the tarball, for example a bundle member; collection_tar
+                     then only names the uploaded file.
+        :return: A structured publish result, see classify_response.
+        """
+        sha256 = file_sha256(collection_tar) if data is None else hashlib.sha256(data).hexdigest()
+        body = MultipartFile(collection_tar, {"sha256": sha256}, data=data)
+        try:
+            response = self.request(
+                "POST",
+                requests.compat.urljoin(self.api_url(), self._upload_path),
+                kind="upload",
+                cost=len(body) / MIB,
+                data=body,
+                headers={"Content-Type": body.content_type}
+            )
+        finally:
+            body.close()
+        return classify_response(response)
+
+    def get_import_task(self, task_url: str) -> Dict[str, Any]:
+        """
+        Fetches the current state of an import task once.
+
+        :param task_url: Task URL returned by the upload, absolute or relative to the server.
+        :return: A dict with the lowercased state, whether the import finished and its messages.
+        """
+        response = self.request("GET", requests.compat.urljoin(self.server_url, task_url))
+        response.raise_for_status()
+        task = response.json()
+        state = str(task.get("state", "")).lower()
+        messages = [message.get("message", "") for message in task.get("messages", []) if isinstance(message, dict)]
+        error = task.get("error") or {}
+        if error.get("description"):
+            messages.append(error["description"])
+        return {"state": state, "finished": state in IMPORT_FINISHED_STATES, "messages": messages}
+
+    def wait_for_import(self, task_url: str, timeout: float = 300, poll_interval: float = 2) -> Dict[str, Any]:
+        """
+        Polls an import task until it finishes.
+
+        :param task_url: Task URL returned by the upload.
+        :param timeout: Maximum time to wait in seconds.
+        :param poll_interval: Initial delay between polls, doubled up to 30 seconds.
+        :return: A dict with the final import state and its messages.
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            task = self.get_import_task(task_url)
+            if task["finished"]:
+                return {"state": task["state"], "messages": task["messages"]}
+
+            if time.monotonic() >= deadline:
+                return {"state": "timeout", "messages": [f"Import task {task_url} did not finish in {timeout}s"]}
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 30)
+
+    def publish(self, collection_tar: str, wait: bool = True, retries: int = 0,
+                backoff: float = 1.0, max_backoff: float = 60.0, data: Any = None) -> Dict[str, Any]:
+        """
+        Uploads a collection tarball and, like ansible-galaxy, waits for the import to finish.
+        Transient failures (connection errors, timeouts, 408/429/5xx) are retried with exponential
+        backoff and jitter; a retried upload that already went through is reported as "exists".
+
+        :param collection_tar: Path to the collection tarball.
+        :param wait: Wait for the import task and report a failed import as an error.
+        :param retries: Number of retries after a transient failure.
+        :param backoff: Delay of the first retry in seconds, see backoff_delay.
+        :param max_backoff: Maximum delay between retries in seconds.
+        :param data: Contents of the tarball instead of reading collection_tar, see upload.
+        :return: A structured publish result, see classify_response, with the number of attempts.
+        """
+        attempt = 0
+        while True:
+            result = self._publish_once(collection_tar, wait, data)
+            result["attempts"] = attempt + 1
+            if not result.get("transient") or attempt >= retries:
+                return result
+            time.sleep(backoff_delay(attempt, backoff, max_backoff))
+            attempt += 1
+
+    def _publish_once(self, collection_tar: str, wait: bool, data: Any = None) -> Dict[str, Any]:
+        try:
+            result = self.upload(collection_tar, data)
+            if wait and result["status"] == PUBLISHED and result["task"]:
+                task = self.wait_for_import(result["task"])
+                if task["state"] not in IMPORT_OK_STATES:
+                    result = dict(result, transient=False, **classify_import_failure(task))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            return {"status": ERROR, "message": str(e), "http_status": 0, "task": "", "transient": True}
+        except requests.HTTPError as e:
+            # A failed discovery or import poll; retrying uploads again and reports "exists" if the first one landed
+            http_status = e.response.status_code if e.response is not None else 0
+            return {"status": ERROR, "message": str(e), "http_status": http_status, "task": "",
+                    "transient": http_status in TRANSIENT_HTTP_STATUSES}
+        except (requests.RequestException, ValueError) as e:
+            return {"status": ERROR, "message": str(e), "http_status": 0, "task": "", "transient": False}
+        return result
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def classify_import_failure(task: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Maps a failed import task onto a publish status.
+
+    :param task: A dict returned by GalaxyClient.wait_for_import.
+    :return: A dict with status and message.
+    """
+    message = "; ".join(task["messages"]) or f"import {task['state']}"
+    lowered = message.lower()
+    if "already exists" in lowered:
+        return {"status": EXISTS, "message": message}
+    if "namespace" in lowered and "not exist" in lowered:
+        return {"status": MISSING_NAMESPACE, "message": message}
+    return {"status": ERROR, "message": message}
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(server_url: str, token: Optional[str] = None, **kwargs: Any) -> GalaxyClient:
+    """
+    Returns the shared client of a server, creating it on first use, so every upload
+    to the same server reuses the same connection pool and API discovery.
+
+    :param server_url: Galaxy server URL.
+    :param token: API token.
+    :return: The GalaxyClient of the server.
+    """
+    key = (server_url.rstrip('/') + '/', token)
+    # Upload and poll threads ask for clients concurrently; two clients of one server would not share a pool
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = GalaxyClient(server_url, token, **kwargs)
+        return _clients[key]
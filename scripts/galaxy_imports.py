@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Concurrent polling of Galaxy import tasks.
+
+Uploads return as soon as the server accepted the artifact; the import tasks of all uploads are then
+polled together from a small thread pool over the shared session of each server. Poll intervals adapt
+to each task: a task is first polled around the time the imports that already finished in this run
+took, and after that with an interval proportional to its age, so short imports are noticed quickly
+while long ones cost only a few requests.
+"""
+
+import heapq
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Hashable, List, Optional
+
+import requests
+
+from galaxy_client import IMPORT_OK_STATES, PUBLISHED, GalaxyClient, classify_import_failure
+
+
+class ImportPoller:
+    """
+    Polls the import tasks of many uploads until every task finished or timed out.
+    """
+
+    def __init__(self, client: Optional[GalaxyClient] = None, workers: int = 8, timeout: float = 300,
+                 min_interval: float = 0.5, max_interval: float = 30, backoff_ratio: float = 0.25) -> None:
+        """
+        :param client: Client whose session is shared by the polls of tasks added without their own client.
+        :param workers: Maximum number of concurrent poll requests.
+        :param timeout: Maximum time to wait for a task, counted from its upload.
+        :param min_interval: Shortest delay between two polls of a task in seconds.
+        :param max_interval: Longest delay between two polls of a task in seconds.
+        :param backoff_ratio: Delay between polls as a share of the task's age.
+        """
+        self.client = client
+        self.workers = workers
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_ratio = backoff_ratio
+        self._tasks = {}       # key -> {"url": ..., "client": ..., "uploaded": ..., "polls": ...}
+        self._durations = []   # import durations of the finished tasks
+
+    def add(self, key: Hashable, task_url: str, client: Optional[GalaxyClient] = None) -> None:
+        """
+        Registers the import task of an upload.
+
+        :param key: Identifier of the upload, for example the collection name.
+        :param task_url: Task URL returned by the upload.
+        :param client: Client of the server the task runs on, the poller's client by default.
+        """
+        client = client or self.client
+        if client is None:
+            raise ValueError(f"no client to poll the import task of {key}")
+        self._tasks[key] = {"url": task_url, "client": client, "uploaded": time.monotonic(), "polls": 0}
+
+    def _interval(self, age: float) -> float:
+        if self._durations:
+            expected = sorted(self._durations)[len(self._durations) // 2]
+            if age < expected:
+                return min(max(expected - age, self.min_interval), self.max_interval)
+        return min(max(age * self.backoff_ratio, self.min_interval), self.max_interval)
+
+    def _finish(self, key: Hashable, state: str, messages: List[str]) -> Dict[str, Any]:
+        task = self._tasks[key]
+        seconds = time.monotonic() - task["uploaded"]
+        if state in IMPORT_OK_STATES:
+            self._durations.append(seconds)
+            outcome = {"status": PUBLISHED, "message": ""}
+        else:
+            outcome = classify_import_failure({"state": state, "messages": messages})
+        return dict(outcome, state=state, messages=messages, polls=task["polls"], seconds=seconds)
+
+    def wait(self) -> Dict[Hashable, Dict[str, Any]]:
+        """
+        Polls all registered tasks until each one finished.
+
+        :return: A key to import result mapping; a result has the publish status (published, exists,
+                 missing-namespace or error), message, import state and messages, number of polls and
+                 the seconds since the upload.
+        """
+        results = {}
+        now = time.monotonic()
+        due = [(now + self._interval(0), key) for key in sorted(self._tasks)]
+        heapq.heapify(due)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            while due or running:
+                now = time.monotonic()
+                while due and due[0][0] <= now and len(running) < self.workers:
+                    _, key = heapq.heappop(due)
+                    self._tasks[key]["polls"] += 1
+                    task = self._tasks[key]
+                    running[executor.submit(task["client"].get_import_task, task["url"])] = key
+
+                timeout = max(due[0][0] - time.monotonic(), 0) if due and len(running) < self.workers else None
+                if not running:
+                    time.sleep(timeout or 0)
+                    continue
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    key = running.pop(future)
+                    age = time.monotonic() - self._tasks[key]["uploaded"]
+                    try:
+                        task = future.result()
+                    except (requests.RequestException, ValueError) as e:
+                        # A failed poll is retried like an unfinished task until the task times out
+                        task = {"finished": False, "error": str(e)}
+
+                    if task["finished"]:
+                        results[key] = self._finish(key, task["state"], task["messages"])
+                    elif age >= self.timeout:
+                        url = self._tasks[key]["url"]
+                        message = task.get("error") or f"Import task {url} did not finish in {self.timeout:.0f}s"
+                        results[key] = self._finish(key, "timeout", [message])
+                    else:
+                        heapq.heappush(due, (time.monotonic() + self._interval(age), key))
+
+        return results
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Client-side adaptive concurrency control toward Galaxy servers.
+
+Every request of a GalaxyClient takes a slot from the AIMD limiter of its server (scheme and host,
+so all repositories and tokens of one Hub share a limiter). The limit grows additively, by about one
+slot per limit's worth of healthy responses, and is cut multiplicatively on 429, 5xx gateway errors,
+connection failures and on latency well above the best latency seen. Only requests started after the
+last cut can cut again, so one overloaded moment hitting many in-flight requests counts once.
+A Retry-After header pauses all new requests to the server until it expires.
+"""
+
+import email.utils
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+# Responses that mean the server is overloaded
+CONGESTION_STATUSES = (429, 502, 503, 504)
+
+# Weight of the newest sample in the smoothed latency
+LATENCY_ALPHA = 0.2
+# The baseline latency forgets slowly, so a server that became permanently slower is the new normal
+BASELINE_DRIFT = 1.01
+
+LimitListener = Callable[[str, float, str], None]
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    :param value: Value of a Retry-After header: delay seconds or an HTTP date.
+    :param now: Current time.time(), used for HTTP dates.
+    :return: The delay in seconds, None when the header is missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - (now if now is not None else time.time()), 0.0)
+
+
+class AIMDLimiter:
+    """
+    Additive-increase / multiplicative-decrease limit of the concurrent requests to one server.
+    """
+
+    def __init__(self, name: str, initial: float = 4, min_limit: float = 1, max_limit: float = 32,
+                 increase: float = 1.0, decrease: float = 0.5, latency_ratio: float = 2.0,
+                 latency_slack: float = 0.05, max_retry_after: float = 300,
+                 listener: Optional[LimitListener] = None) -> None:
+        """
+        :param name: Name of the server, used in the limit events.
+        :param initial: Initial number of concurrent requests.
+        :param min_limit: Lowest limit.
+        :param max_limit: Highest limit.
+        :param increase: Slots added per limit's worth of healthy responses.
+        :param decrease: Factor the limit is multiplied with on congestion.
+        :param latency_ratio: Smoothed latency above this multiple of the baseline counts as congestion.
+        :param latency_slack: Latency increase in seconds that never counts as congestion (ignores jitter of fast calls).
+        :param max_retry_after: Longest pause a Retry-After header can cause in seconds.
+        :param listener: Called with (name, limit, reason) whenever the whole-number limit changes.
+        """
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = min(max(initial, min_limit), self.max_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_ratio = latency_ratio
+        self.latency_slack = latency_slack
+        self.max_retry_after = max_retry_after
+        self.listener = listener
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._baselines = {}       # kind -> best latency per unit of cost
+        self._smoothed = {}        # kind -> smoothed latency per unit of cost
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        Waits for a free slot and for a Retry-After pause to pass.
+
+        :return: The start time of the request (time.monotonic()), to be passed to release().
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self._condition.wait(self.paused_until - now)
+                elif self.in_flight < max(int(self.limit), 1):
+                    self.in_flight += 1
+                    return now
+                else:
+                    self._condition.wait()
+
+    def release(self, started: float, status: Optional[int] = None, retry_after: Optional[float] = None,
+                failed: bool = False, kind: str = "api", cost: float = 1.0) -> None:
+        """
+        Frees the slot of a finished request and adapts the limit to its outcome.
+
+        :param started: Return value of acquire().
+        :param status: HTTP status of the response, None when there was none.
+        :param retry_after: Delay requested by the server in seconds.
+        :param failed: The request failed with a connection error or timeout.
+        :param kind: Kind of request; latencies are only compared within a kind.
+        :param cost: Size of the request relative to a typical API call, for example the upload size in MiB.
+        """
+        now = time.monotonic()
+        change = None
+        with self._condition:
+            self.in_flight -= 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + min(retry_after, self.max_retry_after))
+
+            reason = None
+            if failed:
+                reason = "connection error"
+            elif status in CONGESTION_STATUSES:
+                reason = f"HTTP {status}"
+            elif status is not None and status < 500:
+                reason = self._observe_latency(kind, (now - started) / max(cost, 1.0))
+
+            before = int(self.limit)
+            if reason and started >= self._last_decrease:
+                self.limit = max(self.limit * self.decrease, self.min_limit)
+                self._last_decrease = now
+            elif status is not None and status < 500 and not reason:
+                self.limit = min(self.limit + self.increase / self.limit, self.max_limit)
+                reason = "healthy"
+            if int(self.limit) != before:
+                change = (self.limit, reason)
+            self._condition.notify_all()
+
+        if change and self.listener is not None:
+            self.listener(self.name, *change)
+
+    def _observe_latency(self, kind: str, latency: float) -> Optional[str]:
+        baseline = self._baselines.get(kind)
+        self._baselines[kind] = latency if baseline is None else min(latency, baseline * BASELINE_DRIFT)
+        smoothed = self._smoothed.get(kind, latency)
+        smoothed = self._smoothed[kind] = smoothed + LATENCY_ALPHA * (latency - smoothed)
+        if baseline is not None and smoothed > max(baseline * self.latency_ratio, baseline + self.latency_slack):
+            return "latency"
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        :return: The current limit, in-flight requests and remaining Retry-After pause.
+        """
+        with self._condition:
+            return {"limit": self.limit, "in_flight": self.in_flight,
+                    "paused": max(self.paused_until - time.monotonic(), 0.0)}
+
+
+_limiters = {}
+_settings = {}
+_listener = None
+_lock = threading.Lock()
+
+
+def server_key(server_url: str) -> str:
+    """
+    :param server_url: Any URL of the server.
+    :return: The scheme and host the limiter of the server is registered under.
+    """
+    parts = urlsplit(server_url if "://" in server_url else f"https://{server_url}")
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def configure_limiter(server_url: str, **settings: Any) -> None:
+    """
+    Sets the limiter settings of a server, for example initial, min_limit and max_limit;
+    settings of the key "*" apply to every server unless the server overrides them.
+
+    :param server_url: Any URL of the server, or "*".
+    :param settings: Keyword arguments of AIMDLimiter.
+    """
+    with _lock:
+        key = server_url if server_url == "*" else server_key(server_url)
+        _settings[key] = dict(_settings.get(key, {}), **settings)
+        _limiters.pop(key, None)
+
+
+def set_limit_listener(listener: Optional[LimitListener]) -> None:
+    """
+    :param listener: Called with (server, limit, reason) when the limit of any server changes.
+    """
+    global _listener
+    with _lock:
+        _listener = listener
+        for limiter in _limiters.values():
+            limiter.listener = listener
+
+
+def get_limiter(server_url: str) -> AIMDLimiter:
+    """
+    Returns the shared limiter of a server, creating it on first use.
+
+    :param server_url: Any URL of the server.
+    :return: The AIMDLimiter of the server.
+    """
+    key = server_key(server_url)
+    with _lock:
+        if key not in _limiters:
+            settings = dict(_settings.get("*", {}), **_settings.get(key, {}))
+            _limiters[key] = AIMDLimiter(key, listener=_listener, **settings)
+        return _limiters[key]
@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Mirror collections from a Galaxy / Automation Hub server into a local ansible_collections tree,
+for example to seed an air-gapped site.
+
+Specs are "<namespace>.<name>:<version>", "<namespace>.<name>" for the highest release or
+"<namespace>" for the highest release of every collection of the namespace. Versions are resolved
+concurrently through the v3 API, then the artifacts are downloaded on a thread pool sharing one
+connection pool per server (and the server's adaptive concurrency limit).
+
+Every artifact is read in a single pass: the bytes go into a .part file in the download directory,
+into the sha256 and through a streaming tar reader that unpacks into a staging directory next to the
+destination, so no archive is held in memory. Only when size and sha256 match the server's metadata
+is the staging directory moved into place, together with the <namespace>.<name>-<version>.info
+directory ansible-galaxy writes. A dropped connection is resumed from the end of the .part file with
+an HTTP Range request, a corrupt .part file is discarded and downloaded again. Verified tarballs stay
+in the download directory, so a later run (or another destination) does not fetch them again.
+
+Usage:
+python galaxy_mirror.py [--server URL] [--dest DIR] [--workers N] SPEC [SPEC ...]
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+import yaml
+
+from galaxy_catalog import fetch_paginated
+from galaxy_client import CHUNK_SIZE, MIB, GalaxyClient, backoff_delay, get_client
+
+DEFAULT_DOWNLOAD_DIR = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "ansible-collections-publish",
+    "downloads"
+)
+
+# Mirror statuses
+MIRRORED = "mirrored"
+UNCHANGED = "unchanged"
+ERROR = "error"
+
+# Size of the network reads. urllib3 discards the bytes of a read that is cut off by a dropped
+# connection, so only whole chunks reach the .part file: small reads keep the loss per drop small
+# and let the resume of even a small artifact make progress
+DOWNLOAD_CHUNK_SIZE = 8 * 1024
+
+# Errors a download is resumed or restarted after
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class MirrorError(Exception):
+    """
+    A collection cannot be mirrored.
+    """
+
+
+class ChecksumError(MirrorError):
+    """
+    The downloaded bytes do not match the size or sha256 of the server's metadata.
+    """
+
+
+def parse_spec(spec: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    :param spec: "<namespace>", "<namespace>.<name>" or "<namespace>.<name>:<version>".
+    :return: The (namespace, name, version) triple, name and version None when not given.
+    :raises argparse.ArgumentTypeError: When the spec is malformed.
+    """
+    collection, _, version = spec.partition(":")
+    namespace, _, name = collection.partition(".")
+    if not namespace or "." in name or (version and not name) or (":" in spec and not version):
+        raise argparse.ArgumentTypeError(f"expected <namespace>[.<name>[:<version>]], got {spec!r}")
+    return namespace, name or None, version or None
+
+
+def version_key(version: str) -> Tuple:
+    """
+    Sort key of a semantic version: releases sort above their pre-releases, numeric
+    pre-release parts numerically; build metadata is ignored.
+    """
+    core, _, prerelease = version.split("+", 1)[0].partition("-")
+    numbers = tuple(int(part) if part.isdigit() else 0 for part in core.split("."))
+    parts = tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in prerelease.split(".")) \
+        if prerelease else ()
+    return numbers, not prerelease, parts
+
+
+def highest_version(versions: List[str], prereleases: bool = False) -> Optional[str]:
+    """
+    :param versions: Available versions.
+    :param prereleases: Consider pre-releases even when there is a release.
+    :return: The highest release, the highest pre-release when there is no release, None without versions.
+    """
+    releases = [version for version in versions if prereleases or "-" not in version.split("+", 1)[0]]
+    return max(releases or versions, key=version_key, default=None)
+
+
+def resolve_specs(client: GalaxyClient, specs: List[Tuple[str, Optional[str], Optional[str]]],
+                  workers: int = 8, prereleases: bool = False) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Resolves specs to collection versions and their artifact metadata.
+
+    :param client: Client of the server.
+    :param specs: Parsed specs, see parse_spec.
+    :param workers: Number of concurrent requests.
+    :param prereleases: Pick pre-releases as the highest version.
+    :return: The jobs (collection, namespace, name, version, download_url, filename, sha256, size) and
+             the error results of specs that could not be resolved.
+    """
+    api_url = client.api_url()
+    wanted = {}      # (namespace, name) -> pinned version or None
+    namespaces = sorted({namespace for namespace, name, _ in specs if name is None})
+    for namespace in namespaces:
+        # Servers that ignore the namespace filter return every collection, hence the check
+        for item in fetch_paginated(client, f"{api_url}collections/?namespace={namespace}", workers):
+            if item["namespace"] == namespace:
+                wanted.setdefault((namespace, item["name"]), None)
+    for namespace, name, version in specs:
+        if name is not None and (wanted.get((namespace, name)) is None or version):
+            wanted[(namespace, name)] = version
+
+    def resolve(key: Tuple[str, str]) -> Dict[str, Any]:
+        namespace, name = key
+        collection = f"{namespace}.{name}"
+        version = wanted[key]
+        try:
+            if version is None:
+                url = f"{api_url}collections/{namespace}/{name}/versions/"
+                version = highest_version([item["version"] for item in fetch_paginated(client, url, workers=1)],
+                                          prereleases)
+                if version is None:
+                    raise MirrorError("no versions on the server")
+            response = client.request("GET", f"{api_url}collections/{namespace}/{name}/versions/{version}/")
+            if response.status_code == 404:
+                raise MirrorError(f"version {version} not found on the server")
+            response.raise_for_status()
+            detail = response.json()
+            artifact = detail.get("artifact") or {}
+            return {"collection": collection, "namespace": namespace, "name": name, "version": version,
+                    "download_url": requests.compat.urljoin(client.server_url, detail["download_url"]),
+                    "filename": artifact.get("filename") or f"{namespace}-{name}-{version}.tar.gz",
+                    "sha256": artifact.get("sha256"), "size": artifact.get("size")}
+        except (MirrorError, requests.RequestException, ValueError, KeyError) as e:
+            return {"collection": collection, "version": version, "status": ERROR, "message": f"resolve: {e}"}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resolved = list(executor.map(resolve, sorted(wanted)))
+    missing = [{"collection": namespace, "version": None, "status": ERROR, "message": "no collections on the server"}
+               for namespace in namespaces if not any(key[0] == namespace for key in wanted)]
+    return ([item for item in resolved if "status" not in item],
+            [item for item in resolved if "status" in item] + missing)
+
+
+class _StreamReader:
+    """
+    File-like reader over an iterator of chunks that feeds every byte read into a hash.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self._chunks = chunks
+        self._buffer = b""
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self) -> None:
+        """
+        Reads the bytes the tar reader did not need (end-of-archive padding), so the hash covers the whole file.
+        """
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def _check_member(member: tarfile.TarInfo) -> None:
+    # Only regular files, directories and links that stay inside the collection
+    if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+        raise MirrorError(f"unsupported tar member {member.name}")
+    paths = [member.name]
+    if member.issym():
+        paths.append(os.path.join(os.path.dirname(member.name), member.linkname))
+    elif member.islnk():
+        paths.append(member.linkname)
+    for path in paths:
+        path = os.path.normpath(path)
+        if os.path.isabs(path) or path == os.pardir or path.startswith(os.pardir + os.sep):
+            raise MirrorError(f"tar member {member.name} points outside the collection")
+
+
+def _file_chunks(path: str, length: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def _response_chunks(response: requests.Response, out: Any) -> Iterator[bytes]:
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+        out.write(chunk)
+        yield chunk
+    out.flush()
+
+
+def fetch_and_unpack(client: GalaxyClient, job: Dict[str, Any], part_file: str, staging_dir: str) -> Dict[str, Any]:
+    """
+    Downloads the rest of an artifact into its .part file while unpacking the whole artifact into a
+    staging directory, and verifies the result against the server's metadata.
+
+    :param client: Client of the server.
+    :param job: A job of resolve_specs.
+    :param part_file: Partial download, extended in place; an existing file is resumed with a Range request.
+    :param staging_dir: Empty directory the collection is unpacked into.
+    :return: A dict with the bytes "downloaded" and whether the download was "resumed".
+    :raises ChecksumError: When size or sha256 do not match; the .part file is removed.
+    :raises MirrorError: When the artifact is not a valid collection tarball.
+    """
+    offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+    response = None
+    if not job["size"] or offset < job["size"]:
+        headers = {"Range": f"bytes={offset}-", "Accept": "*/*"} if offset else {"Accept": "*/*"}
+        response = client.request("GET", job["download_url"], kind="download", cost=max((job["size"] or 0) / MIB, 1),
+                                  headers=headers, stream=True)
+        if response.status_code == 416:
+            response.close()
+            response = None
+        elif response.status_code == 200 and offset:
+            offset = 0     # the server ignored the Range header
+        elif response.status_code not in (200, 206):
+            response.raise_for_status()
+            raise MirrorError(f"unexpected HTTP {response.status_code} for {job['download_url']}")
+
+    tar_error = None
+    try:
+        with open(part_file, 'r+b' if offset else 'wb') as out:
+            out.truncate(offset)
+            out.seek(offset)
+            chunks = _file_chunks(part_file, offset)
+            if response is not None:
+                chunks = itertools.chain(chunks, _response_chunks(response, out))
+            reader = _StreamReader(chunks)
+            try:
+                with tarfile.open(fileobj=reader, mode="r|gz") as tar:
+                    for member in tar:
+                        _check_member(member)
+                        tar.extract(member, staging_dir, set_attrs=not member.issym(),
+                                    **({"filter": "data"} if hasattr(tarfile, "data_filter") else {}))
+            except (tarfile.TarError, EOFError, OSError) as e:
+                if isinstance(e, RETRYABLE_ERRORS):
+                    raise
+                tar_error = e
+            reader.drain()
+    finally:
+        if response is not None:
+            response.close()
+
+    if (job["size"] and reader.size != job["size"]) or (job["sha256"] and reader.digest.hexdigest() != job["sha256"]):
+        os.remove(part_file)
+        raise ChecksumError(f"{job['filename']}: got {reader.size} bytes with sha256 {reader.digest.hexdigest()}, "
+                            f"expected {job['size']} bytes with sha256 {job['sha256']}")
+    if tar_error is not None:
+        raise MirrorError(f"{job['filename']} is not a valid collection tarball: {tar_error}")
+    return {"downloaded": reader.size - offset if response is not None else 0,
+            "resumed": bool(offset) and response is not None}
+
+
+def installed_version(collection_dir: str) -> Optional[str]:
+    """
+    :return: The version in the MANIFEST.json of an installed collection, None when there is none.
+    """
+    try:
+        with open(os.path.join(collection_dir, "MANIFEST.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)["collection_info"]["version"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def install_staged(staging_dir: str, dest_dir: str, job: Dict[str, Any], server_url: str) -> None:
+    """
+    Moves an unpacked collection into place and writes its install metadata like ansible-galaxy.
+
+    :param staging_dir: Directory the collection was unpacked into, on the same file system as dest_dir.
+    :param dest_dir: The ansible_collections directory.
+    :param job: The job of the collection.
+    :param server_url: Server the collection was downloaded from.
+    """
+    collection_dir = os.path.join(dest_dir, job["namespace"], job["name"])
+    previous = None
+    if os.path.lexists(collection_dir):
+        previous = tempfile.mkdtemp(prefix=f".{job['name']}-old-", dir=os.path.dirname(collection_dir))
+        os.replace(collection_dir, os.path.join(previous, job["name"]))
+    os.chmod(staging_dir, 0o755)
+    os.replace(staging_dir, collection_dir)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+
+    prefix = f"{job['namespace']}.{job['name']}-"
+    for name in os.listdir(dest_dir):
+        if name.startswith(prefix) and name.endswith(".info"):
+            shutil.rmtree(os.path.join(dest_dir, name), ignore_errors=True)
+    info_dir = os.path.join(dest_dir, f"{prefix}{job['version']}.info")
+    os.makedirs(info_dir, exist_ok=True)
+    with open(os.path.join(info_dir, "GALAXY.yml"), 'w', encoding='utf-8') as f:
+        yaml.safe_dump({"download_url": job["download_url"], "format_version": "1.0.0", "name": job["name"],
+                        "namespace": job["namespace"], "server": server_url, "signatures": [],
+                        "version": job["version"]}, f, default_flow_style=False)
+
+
+def mirror_collection(client: GalaxyClient, job: Dict[str, Any], dest_dir: str, download_dir: str,
+                      retries: int = 3, force: bool = False) -> Dict[str, Any]:
+    """
+    Downloads, verifies and unpacks one collection version.
+
+    :param client: Client of the server.
+    :param job: A job of resolve_specs.
+    :param dest_dir: The ansible_collections directory.
+    :param download_dir: Directory of the .part files and verified tarballs.
+    :param retries: Number of times a dropped or corrupt download is resumed or restarted.
+    :param force: Unpack the collection even when the same version is installed.
+    :return: A result dict with collection, version, status, message, downloaded bytes, resumed and seconds.
+    """
+    started = time.time()
+    result = {"collection": job["collection"], "version": job["version"], "status": ERROR, "message": "",
+              "downloaded": 0, "resumed": False}
+    collection_dir = os.path.join(dest_dir, job["namespace"], job["name"])
+    if not force and installed_version(collection_dir) == job["version"]:
+        return dict(result, status=UNCHANGED, seconds=time.time() - started)
+
+    tarball = os.path.join(download_dir, job["filename"])
+    part_file = f"{tarball}.part"
+    if os.path.isfile(tarball) and not os.path.isfile(part_file):
+        os.replace(tarball, part_file)    # verified before, checked again while unpacking
+    os.makedirs(os.path.dirname(collection_dir), exist_ok=True)
+
+    for attempt in range(retries + 1):
+        before = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+        staging_dir = tempfile.mkdtemp(prefix=f".{job['name']}-", dir=os.path.dirname(collection_dir))
+        try:
+            outcome = fetch_and_unpack(client, job, part_file, staging_dir)
+            os.replace(part_file, tarball)
+            install_staged(staging_dir, dest_dir, job, client.server_url)
+            result.update(status=MIRRORED, downloaded=result["downloaded"] + outcome["downloaded"],
+                          resumed=result["resumed"] or outcome["resumed"])
+            break
+        except RETRYABLE_ERRORS + (ChecksumError,) as e:
+            result["message"] = str(e)
+            if os.path.isfile(part_file):
+                result["downloaded"] += max(os.path.getsize(part_file) - before, 0)
+            if attempt < retries:
+                time.sleep(backoff_delay(attempt, base=0.5))
+        except (MirrorError, requests.RequestException, OSError) as e:
+            result["message"] = str(e)
+            break
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    if result["status"] == MIRRORED:
+        result["message"] = ""
+    result["seconds"] = time.time() - started
+    return result
+
+
+def mirror(client: GalaxyClient, jobs: List[Dict[str, Any]], dest_dir: str, download_dir: str = DEFAULT_DOWNLOAD_DIR,
+           workers: int = 4, retries: int = 3, force: bool = False) -> List[Dict[str, Any]]:
+    """
+    Mirrors collection versions concurrently, largest artifacts first.
+
+    :param client: Client of the server, with a connection pool of at least workers connections.
+    :param jobs: Jobs of resolve_specs.
+    :param dest_dir: The ansible_collections directory.
+    :param download_dir: Directory of the .part files and verified tarballs.
+    :param workers: Number of concurrent downloads.
+    :param retries: See mirror_collection.
+    :param force: See mirror_collection.
+    :return: The results of mirror_collection, in job order.
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    order = sorted(range(len(jobs)), key=lambda index: -(jobs[index]["size"] or 0))
+    results = [None] * len(jobs)
+
+    def run(index: int) -> None:
+        results[index] = mirror_collection(client, jobs[index], dest_dir, download_dir, retries, force)
+        result = results[index]
+        detail = f": {result['message']}" if result["message"] else ""
+        resumed = ", resumed" if result["resumed"] else ""
+        print(f"{result['collection']} {result['version']}: {result['status']} "
+              f"({result['downloaded'] / MIB:.1f} MiB{resumed}, {result['seconds']:.1f}s){detail}")
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        list(executor.map(run, order))
+    return results
+
+
+def print_mirror_summary(results: List[Dict[str, Any]], seconds: float) -> None:
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    downloaded = sum(result.get("downloaded", 0) for result in results)
+    print(f"\n{len(results)} collections: {', '.join(f'{status}: {count}' for status, count in sorted(counts.items()))}; "
+          f"downloaded {downloaded / MIB:.1f} MiB in {seconds:.1f}s "
+          f"({downloaded / MIB / seconds if seconds else 0.0:.1f} MiB/s)")
+    for result in results:
+        if result["status"] == ERROR:
+            print(f"  {result['collection']} {result['version'] or ''}: {result['message']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mirror collections from a Galaxy server into an ansible_collections tree.")
+    parser.add_argument("specs", nargs="+", type=parse_spec, metavar="SPEC",
+                        help="<namespace>.<name>:<version>, <namespace>.<name> (highest release) or <namespace>")
+    parser.add_argument("--server", default=os.getenv("ANSIBLE_GALAXY_SERVER_GALAXY_URL"),
+                        help="Galaxy server URL (default: $ANSIBLE_GALAXY_SERVER_GALAXY_URL)")
+    parser.add_argument("--token", default=os.getenv("ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN"),
+                        help="API token (default: $ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN)")
+    parser.add_argument("--dest", default="./ansible_collections",
+                        help="ansible_collections directory to mirror into (default: ./ansible_collections)")
+    parser.add_argument("--download-dir", default=DEFAULT_DOWNLOAD_DIR,
+                        help=f"Directory for partial downloads and verified tarballs (default: {DEFAULT_DOWNLOAD_DIR})")
+    parser.add_argument("--workers", type=int, default=4, metavar="N", help="Concurrent downloads (default: 4)")
+    parser.add_argument("--retries", type=int, default=3, metavar="N",
+                        help="Resume or restart a failed download up to N times (default: 3)")
+    parser.add_argument("--pre", action="store_true", help="Consider pre-releases for the highest version")
+    parser.add_argument("--force", action="store_true", help="Download even when the version is installed")
+    args = parser.parse_args()
+    if not args.server:
+        parser.error("--server or $ANSIBLE_GALAXY_SERVER_GALAXY_URL is required")
+
+    started = time.time()
+    client = get_client(args.server, args.token, pool_size=max(args.workers, 8))
+    jobs, results = resolve_specs(client, args.specs, prereleases=args.pre)
+    os.makedirs(args.dest, exist_ok=True)
+    results.extend(mirror(client, jobs, args.dest, args.download_dir, args.workers, args.retries, args.force))
+    print_mirror_summary(results, time.time() - started)
+    if any(result["status"] == ERROR for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Warm ansible-galaxy worker processes.
+
+Most of a small `ansible-galaxy collection build` or `publish` is start-up: importing ansible, parsing
+the configuration and loading plugins. A GalaxyWorkerPool starts worker processes that import ansible's
+Galaxy CLI once and then run one command line after another, sent over a pipe. The stdout and stderr of
+a command are captured at the file descriptor level and returned with its exit code, so callers get the
+same CompletedProcess as from subprocess.run(capture_output=True). Before every command the worker resets
+what ansible keeps once per process (the parsed arguments, the collection finder and the warnings already
+shown), so a command gives the same result as in a fresh process.
+
+A worker that dies is replaced and its command runs as a subprocess instead; workers are recycled after
+max_requests commands, so state ansible keeps between commands cannot pile up. When ansible cannot be
+imported by this interpreter (for example ansible-galaxy installed with pipx), every command runs as a
+subprocess. Pools are per process: a build process of run_collections starts its own worker on first use.
+"""
+
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+
+PROG = "ansible-galaxy"
+
+# Exit code of a command whose worker did not answer in time, like a process killed by SIGKILL
+TIMEOUT_EXIT_CODE = -9
+
+
+class GalaxyWorkerError(Exception):
+    """
+    A worker could not be started, died or did not answer in time.
+    """
+
+
+def _exit_code(code: Any) -> int:
+    # sys.exit() semantics: None is success, a message is failure
+    if code is None:
+        return 0
+    return code if isinstance(code, int) else 1
+
+
+def _load_galaxy_main() -> Callable[[List[str]], int]:
+    """
+    Imports ansible's Galaxy CLI.
+
+    :return: A function that runs an ansible-galaxy command line in-process and returns its exit code.
+    """
+    from ansible.cli.galaxy import GalaxyCLI
+    from ansible.utils.collection_loader._collection_finder import _AnsibleCollectionFinder
+    from ansible.utils.context_objects import GlobalCLIArgs
+    from ansible.utils.display import Display
+
+    if not hasattr(GalaxyCLI, "cli_executor"):
+        raise ImportError("ansible-core is too old for in-process ansible-galaxy (no CLI.cli_executor)")
+
+    def galaxy_main(args: List[str]) -> int:
+        # A CLI parses its arguments into the GlobalCLIArgs singleton and installs the collection finder
+        # once per process, and Display shows every warning once per process. Without resetting them,
+        # every command would rerun the arguments of the worker's first command, warn that the finder
+        # is already configured and leave out the warnings an earlier command printed
+        GlobalCLIArgs._Singleton__instance = None
+        _AnsibleCollectionFinder._remove()
+        display = Display()
+        for shown in ("_deprecations", "_warns", "_errors"):
+            getattr(display, shown, set()).clear()
+        try:
+            GalaxyCLI.cli_executor([PROG] + args)
+        except SystemExit as e:
+            return _exit_code(e.code)
+        return 0
+
+    return galaxy_main
+
+
+def _run_captured(galaxy_main: Callable[[List[str]], int], args: List[str]) -> Tuple[int, bytes, bytes]:
+    """
+    Runs a command with fds 1 and 2 redirected into temporary files.
+
+    :return: The exit code, stdout and stderr of the command.
+    """
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved = os.dup(1), os.dup(2)
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        try:
+            code = galaxy_main(args)
+        except BaseException as e:  # the CLI reports its own errors, anything else is a crash of the command
+            sys.stderr.write(f"ERROR! Unexpected exception in {PROG}: {type(e).__name__}: {e}\n")
+            code = 250
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+        out.seek(0)
+        err.seek(0)
+        return code, out.read(), err.read()
+
+
+def _worker_main(connection: Any, loader: Callable[[], Callable[[List[str]], int]]) -> None:
+    """
+    Main loop of a worker: imports the CLI once, then runs the command lines received until None or EOF.
+    """
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)  # never wait for a prompt
+    os.close(devnull)
+    try:
+        galaxy_main = loader()
+    except Exception as e:
+        connection.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    connection.send(("ready", None))
+
+    while True:
+        try:
+            args = connection.recv()
+        except EOFError:
+            return
+        if args is None:
+            return
+        connection.send(("done", _run_captured(galaxy_main, args)))
+
+
+class GalaxyWorker:
+    """
+    One worker process with the Galaxy CLI imported.
+    """
+
+    def __init__(self, context: Any, loader: Callable[[], Callable[[List[str]], int]],
+                 start_timeout: float = 120) -> None:
+        """
+        :param context: multiprocessing context the process is started with.
+        :param loader: Importable function returning the in-process command runner, see _load_galaxy_main.
+        :param start_timeout: Maximum time for the imports in seconds.
+        :raises GalaxyWorkerError: When the worker cannot import the CLI.
+        """
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, loader), name="galaxy-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self.requests = 0
+
+        status, detail = self._receive(start_timeout)
+        if status != "ready":
+            self.close()
+            raise GalaxyWorkerError(detail)
+
+    def _receive(self, timeout: float) -> Tuple[str, Any]:
+        if not self.connection.poll(timeout):
+            raise GalaxyWorkerError(f"{PROG} worker {self.process.pid} did not answer in {timeout:.0f}s")
+        try:
+            return self.connection.recv()
+        except (EOFError, ConnectionError):
+            self.process.join(1)
+            raise GalaxyWorkerError(f"{PROG} worker {self.process.pid} exited with {self.process.exitcode}")
+
+    def run(self, args: List[str], timeout: float) -> Tuple[int, bytes, bytes]:
+        """
+        :param args: Command line without the program name.
+        :param timeout: Maximum time for the command in seconds.
+        :return: The exit code, stdout and stderr of the command.
+        :raises GalaxyWorkerError: When the worker died or timed out.
+        """
+        self.requests += 1
+        try:
+            self.connection.send(list(args))
+        except (BrokenPipeError, ConnectionError, OSError):
+            raise GalaxyWorkerError(f"{PROG} worker {self.process.pid} is gone")
+        return self._receive(timeout)[1]
+
+    def close(self, kill: bool = False) -> None:
+        if not kill:
+            try:
+                self.connection.send(None)
+                self.process.join(5)
+            except (BrokenPipeError, ConnectionError, OSError):
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class GalaxyWorkerPool:
+    """
+    Runs ansible-galaxy command lines on up to size warm workers.
+    """
+
+    def __init__(self, size: int = 1, max_requests: int = 100, timeout: float = 1800,
+                 loader: Callable[[], Callable[[List[str]], int]] = _load_galaxy_main) -> None:
+        """
+        :param size: Maximum number of workers, and of concurrent commands.
+        :param max_requests: Number of commands after which a worker is replaced.
+        :param timeout: Default maximum time of a command in seconds.
+        :param loader: Function the workers import the CLI with.
+        """
+        # forkserver: workers are forked from a clean single-threaded server, not from a threaded caller.
+        # A forked child (a build process) inherits the forkserver of its parent but cannot use it
+        forkserver = "forkserver" in multiprocessing.get_all_start_methods() and multiprocessing.parent_process() is None
+        self._context = multiprocessing.get_context("forkserver" if forkserver else "spawn")
+        self.size = max(size, 1)
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.loader = loader
+        self.available = True
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def start(self, count: Optional[int] = None) -> bool:
+        """
+        Starts workers ahead of the first command.
+
+        :param count: Number of workers to start, the pool size by default.
+        :return: False when the workers cannot import the CLI; commands then run as subprocesses.
+        """
+        for _ in range(min(count or self.size, self.size) - len(self._workers)):
+            worker = self._new_worker()
+            if worker is None:
+                return False
+            self._idle.put(worker)
+        return self.available
+
+    def _new_worker(self) -> Optional[GalaxyWorker]:
+        with self._lock:
+            if not self.available:
+                return None
+            try:
+                worker = GalaxyWorker(self._context, self.loader)
+            except (GalaxyWorkerError, OSError) as e:
+                self.available = False
+                print(f"Running {PROG} as a subprocess per command, warm workers are not available: {e}")
+                return None
+            self._workers.append(worker)
+            return worker
+
+    def _retire(self, worker: GalaxyWorker, kill: bool = False) -> None:
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        worker.close(kill)
+
+    def run(self, args: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        """
+        Runs an ansible-galaxy command line.
+
+        :param args: Command line without the program name, for example ["collection", "build", ...].
+        :param timeout: Maximum time of the command in seconds, the pool timeout by default.
+        :return: The CompletedProcess with the exit code and the captured stdout and stderr as bytes.
+        """
+        command = [PROG] + list(args)
+        with self._slots:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                worker = self._new_worker()
+            if worker is None:
+                return subprocess.run(command, capture_output=True)
+
+            try:
+                code, stdout, stderr = worker.run(args, timeout or self.timeout)
+            except GalaxyWorkerError as e:
+                self._retire(worker, kill=True)
+                if "did not answer" in str(e):
+                    return subprocess.CompletedProcess(command, TIMEOUT_EXIT_CODE, b"", f"{e}\n".encode())
+                return subprocess.run(command, capture_output=True)
+
+            if worker.requests >= self.max_requests:
+                self._retire(worker)
+            else:
+                self._idle.put(worker)
+            return subprocess.CompletedProcess(command, code, stdout, stderr)
+
+    def close(self) -> None:
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+        self._idle = queue.LifoQueue()
+
+
+_pools = {}        # pid -> GalaxyWorkerPool of that process
+_settings = {"size": 0}
+_pools_lock = threading.Lock()
+
+
+def configure_galaxy_workers(size: int, **settings: Any) -> None:
+    """
+    Sets the pool size of run_galaxy; 0 runs every command as a subprocess.
+    Call it again in processes started with spawn or forkserver, they do not inherit the setting.
+
+    :param size: Maximum number of warm workers per process.
+    :param settings: Other GalaxyWorkerPool arguments, for example max_requests.
+    """
+    with _pools_lock:
+        _settings.clear()
+        _settings.update(settings, size=size)
+        pool = _pools.pop(os.getpid(), None)
+    if pool is not None:
+        pool.close()
+
+
+def galaxy_pool() -> Optional[GalaxyWorkerPool]:
+    """
+    :return: The worker pool of the current process, None when warm workers are disabled.
+    """
+    if not _settings["size"]:
+        return None
+    with _pools_lock:
+        pid = os.getpid()
+        if pid not in _pools:
+            _pools[pid] = GalaxyWorkerPool(_settings["size"], **{key: value for key, value in _settings.items()
+                                                                 if key != "size"})
+        return _pools[pid]
+
+
+def run_galaxy(args: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+    """
+    Runs an ansible-galaxy command line on a warm worker, or as a subprocess when warm workers are
+    disabled or unavailable.
+
+    :param args: Command line without the program name.
+    :param timeout: Maximum time of the command on a worker in seconds.
+    :return: The CompletedProcess with the exit code and the captured stdout and stderr as bytes.
+    """
+    pool = galaxy_pool()
+    if pool is None:
+        return subprocess.run([PROG] + list(args), capture_output=True)
+    return pool.run(args, timeout)
+
+
+def close_galaxy_workers() -> None:
+    """
+    Stops the workers of the current process.
+    """
+    with _pools_lock:
+        pool = _pools.pop(os.getpid(), None)
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Rendering and writing of galaxy.yml.
+
+Uses the libyaml C emitter when PyYAML was built with it and only touches galaxy.yml when the
+rendered bytes differ from the file on disk, replacing it atomically. Unchanged files keep their
+mtime, so anything that caches on galaxy.yml mtimes stays valid.
+"""
+
+import os
+import tempfile
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+import yaml
+
+# The C emitter produces the same output as the pure-Python one for plain JSON data
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper) if yaml.__with_libyaml__ else yaml.SafeDumper
+
+
+def render_galaxy_yaml(galaxy_data: Dict[str, Any], **dump_options: Any) -> bytes:
+    """
+    Renders galaxy.yml.
+
+    :param galaxy_data: The galaxy.yml data.
+    :param dump_options: Options passed to yaml.dump, for example default_flow_style or sort_keys.
+    :return: The UTF-8 encoded document.
+    """
+    return yaml.dump(galaxy_data, Dumper=Dumper, encoding='utf-8', **dump_options)
+
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """
+    Writes a file only if its content differs, through a temporary file and an atomic rename.
+
+    :param path: Path of the file.
+    :param data: New file contents.
+    :return: True when the file was written, False when it already had this content.
+    """
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".galaxy-", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o0644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def write_galaxy_file(galaxy_file: str, galaxy_data: Dict[str, Any], **dump_options: Any) -> bool:
+    """
+    Renders galaxy.yml and writes it if it changed.
+
+    :param galaxy_file: Path to the galaxy.yml file.
+    :param galaxy_data: The galaxy.yml data.
+    :param dump_options: Options passed to yaml.dump.
+    :return: True when galaxy.yml was written.
+    """
+    return write_if_changed(galaxy_file, render_galaxy_yaml(galaxy_data, **dump_options))
+
+
+def convert_batch(files: Iterable[Tuple[str, str]], to_galaxy_data: Callable[[str], Dict[str, Any]],
+                  **dump_options: Any) -> Dict[str, Any]:
+    """
+    Converts many MANIFEST.json files into galaxy.yml in one call.
+
+    :param files: (manifest_file, galaxy_file) pairs, for example built from an inventory.
+    :param to_galaxy_data: Function that reads a MANIFEST.json file and returns the galaxy.yml data.
+    :param dump_options: Options passed to yaml.dump.
+    :return: A dict with the changed and unchanged counts and a galaxy_file to error mapping of failures.
+    """
+    report = {"changed": 0, "unchanged": 0, "failed": {}}
+    for manifest_file, galaxy_file in files:
+        try:
+            changed = write_galaxy_file(galaxy_file, to_galaxy_data(manifest_file), **dump_options)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            report["failed"][galaxy_file] = str(e)
+            continue
+        report["changed" if changed else "unchanged"] += 1
+    return report
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Static extraction of module documentation from installed collections.
+
+Walks plugins/modules/*.py of every collection under an ansible_collections directory (and the
+ansible.builtin modules of ansible-core when it is installed), finds the top-level DOCUMENTATION
+string with ast and reads short_description, version_added and requirements from its YAML. Nothing
+is imported or executed, so there is no interpreter start-up per module and no module list to keep
+up to date; usually only the DOCUMENTATION statement itself is parsed, not the whole module.
+Collections are parsed on a process pool; the requirements of the documentation fragments a module
+extends (plugins/doc_fragments) are merged in like ansible-doc does. When only some collections are
+listed, the other collections are read for their doc_fragments only.
+
+Usage:
+python module_docs.py [--collections-dir DIR] [--no-builtin] [--jobs N] [--collection FQCN ...]
+                      [--format tsv|json] [--output FILE]
+"""
+
+import argparse
+import ast
+import importlib.util
+import io
+import json
+import os
+import re
+import sys
+import tokenize
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import yaml
+
+from collection_inventory import scan_inventory
+
+COLLECTIONS_DIR = "/usr/share/ansible/collections/ansible_collections/"
+BUILTIN = "ansible.builtin"
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader) if yaml.__with_libyaml__ else yaml.SafeLoader
+
+# A top-level DOCUMENTATION assignment starts in the first column
+DOCUMENTATION_RE = re.compile(rb"^DOCUMENTATION\s*(?::[^=\n]*)?=", re.MULTILINE)
+
+
+def string_assignments(body: Iterable[ast.stmt]) -> Dict[str, str]:
+    """
+    :param body: Statements of a module or class body.
+    :return: The names assigned a string literal, with their values; later assignments win.
+    """
+    strings = {}
+    for node in body:
+        if isinstance(node, ast.Assign):
+            targets, value = node.targets, node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            targets, value = [node.target], node.value
+        else:
+            continue
+        if isinstance(value, ast.Constant) and isinstance(value.value, str):
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    strings[target.id] = value.value
+    return strings
+
+
+def _outside_strings(source: bytes, position: int) -> bool:
+    # A first-column "DOCUMENTATION =" inside a triple-quoted literal (EXAMPLES, RETURN, a docstring)
+    # has an unclosed delimiter before it
+    head = source[:position]
+    return head.count(b'"""') % 2 == 0 and head.count(b"'''") % 2 == 0
+
+
+def _documentation_statement(source: bytes) -> Optional[str]:
+    """
+    Cuts the first top-level DOCUMENTATION assignment out of a module source, so only that statement
+    has to be parsed instead of the whole module.
+
+    :return: The source of the statement, None when there is no such line outside string literals.
+    """
+    match = next((match for match in DOCUMENTATION_RE.finditer(source) if _outside_strings(source, match.start())),
+                 None)
+    if match is None:
+        return None
+    lines = []
+    readline = io.StringIO(source[match.start():].decode('utf-8')).readline
+
+    def record() -> str:
+        line = readline()
+        lines.append(line)
+        return line
+
+    for token in tokenize.generate_tokens(record):
+        if token.type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+            break
+    return "".join(lines)
+
+
+def find_documentation(source: bytes, filename: str = "<module>", fast: bool = True) -> Optional[str]:
+    """
+    :param source: Source of a module.
+    :param filename: File name for syntax errors.
+    :param fast: Parse only the DOCUMENTATION statement when it can be found without parsing the module.
+    :return: The string assigned to DOCUMENTATION at the top level, None when there is none.
+    :raises SyntaxError: When the module does not parse.
+    """
+    if fast:
+        try:
+            statement = _documentation_statement(source)
+            if statement is not None:
+                documentation = string_assignments(ast.parse(statement).body).get("DOCUMENTATION")
+                if documentation is not None:
+                    return documentation
+        except (SyntaxError, UnicodeDecodeError, tokenize.TokenError):
+            pass
+    # Not a plain literal assignment in the first column: fall back to the whole module
+    return string_assignments(ast.parse(source, filename=filename).body).get("DOCUMENTATION")
+
+
+def _load_yaml(text: str) -> Dict[str, Any]:
+    data = yaml.load(text, Loader=Loader)
+    if not isinstance(data, dict):
+        raise ValueError("DOCUMENTATION is not a mapping")
+    return data
+
+
+def _as_list(value: Any) -> List[str]:
+    if not value:
+        return []
+    return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+
+
+def extract_module_doc(path: str) -> Dict[str, Any]:
+    """
+    :param path: Path of a module source file.
+    :return: A dict with short_description, version_added, requirements and the names of the
+             extended documentation fragments, or with "error" when there is no readable DOCUMENTATION.
+    """
+    try:
+        with open(path, 'rb') as f:
+            source = f.read()
+        documentation = find_documentation(source, path)
+        if documentation is None:
+            return {"error": "no DOCUMENTATION string"}
+        try:
+            doc = _load_yaml(documentation)
+        except (ValueError, yaml.YAMLError):
+            # The fast path may have picked a look-alike line; the whole module decides
+            full = find_documentation(source, path, fast=False)
+            if full is None or full == documentation:
+                raise
+            doc = _load_yaml(full)
+    except (OSError, SyntaxError, ValueError, yaml.YAMLError) as e:
+        return {"error": f"{type(e).__name__}: {' '.join(str(e).split())}"}
+
+    version_added = doc.get("version_added")
+    return {"short_description": str(doc.get("short_description") or ""),
+            "version_added": "" if version_added is None else str(version_added),
+            "requirements": _as_list(doc.get("requirements")),
+            "fragments": _as_list(doc.get("extends_documentation_fragment"))}
+
+
+def extract_fragment_requirements(path: str) -> Dict[str, List[str]]:
+    """
+    :param path: Path of a doc_fragments source file.
+    :return: A variable (DOCUMENTATION, or another upper case fragment variable) to requirements mapping
+             for the fragment strings of its classes that list requirements.
+    """
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return {}
+
+    requirements = {}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for variable, text in string_assignments(node.body).items():
+            try:
+                found = _as_list(_load_yaml(text).get("requirements"))
+            except (ValueError, yaml.YAMLError):
+                continue
+            if found:
+                requirements[variable] = found
+    return requirements
+
+
+def _py_files(directory: str) -> List[str]:
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(name for name in names if name.endswith(".py") and name != "__init__.py")
+
+
+def scan_collection(job: Tuple[str, Optional[str], str]) -> Dict[str, Any]:
+    """
+    Parses the modules and documentation fragments of one collection; runs in a worker process.
+
+    :param job: The collection name, its modules directory (None to read only the fragments)
+                and its doc_fragments directory.
+    :return: A dict with the collection, its "modules" (name -> extract_module_doc result with the path)
+             and its "fragments" (fragment name -> extract_fragment_requirements result).
+    """
+    collection, modules_dir, fragments_dir = job
+    modules = {}
+    for name in _py_files(modules_dir) if modules_dir is not None else ():
+        path = os.path.join(modules_dir, name)
+        modules[f"{collection}.{name[:-3]}"] = dict(extract_module_doc(path), path=path)
+    fragments = {}
+    for name in _py_files(fragments_dir):
+        found = extract_fragment_requirements(os.path.join(fragments_dir, name))
+        if found:
+            fragments[f"{collection}.{name[:-3]}"] = found
+    return {"collection": collection, "modules": modules, "fragments": fragments}
+
+
+def builtin_job() -> Optional[Tuple[str, str, str]]:
+    """
+    :return: The scan_collection job of the ansible.builtin modules of the installed ansible-core
+             (located without importing it), None when it is not installed.
+    """
+    try:
+        spec = importlib.util.find_spec("ansible")
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    root = list(spec.submodule_search_locations)[0]
+    return BUILTIN, os.path.join(root, "modules"), os.path.join(root, "plugins", "doc_fragments")
+
+
+def fragment_requirements(reference: str, fragments: Dict[str, Dict[str, List[str]]]) -> List[str]:
+    """
+    :param reference: An extends_documentation_fragment entry: "<ns>.<collection>.<fragment>[.<variable>]",
+                      or "<fragment>[.<variable>]" for a fragment of ansible-core.
+    :param fragments: Fragment name to variable to requirements mapping of all scanned collections.
+    :return: The requirements the fragment adds.
+    """
+    parts = reference.split(".")
+    candidates = [(".".join(parts[:3]), parts[3:]), (f"{BUILTIN}.{parts[0]}", parts[1:])]
+    for fragment, rest in candidates:
+        if fragment in fragments:
+            variable = rest[0].upper() if rest else "DOCUMENTATION"
+            return fragments[fragment].get(variable, [])
+    return []
+
+
+def collect_module_docs(collections_dir: str = COLLECTIONS_DIR, builtin: bool = True, jobs: Optional[int] = None,
+                        collections: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Extracts the documentation of every module of the installed collections.
+
+    :param collections_dir: Path to the ansible_collections directory.
+    :param builtin: Include the ansible.builtin modules of the installed ansible-core.
+    :param jobs: Number of worker processes, the CPU count by default.
+    :param collections: Only parse and report the modules of these collections; the others are read
+                        for their documentation fragments only.
+    :return: A module name to documentation mapping, sorted by name; each entry has collection, path,
+             short_description, version_added and requirements (including those of its fragments),
+             or collection, path and error.
+    """
+    selected = set(collections or ())
+    scan_jobs = []
+    if builtin:
+        job = builtin_job()
+        if job is not None:
+            scan_jobs.append(job)
+    if os.path.isdir(collections_dir):
+        for entry in scan_inventory(collections_dir):
+            plugins_dir = os.path.join(entry["path"], "plugins")
+            scan_jobs.append((entry["fqcn"], os.path.join(plugins_dir, "modules"),
+                              os.path.join(plugins_dir, "doc_fragments")))
+    # Fragments can come from any collection, modules only from the selected ones
+    scan_jobs = [(collection, modules_dir if not selected or collection in selected else None, fragments_dir)
+                 for collection, modules_dir, fragments_dir in scan_jobs]
+
+    # Many small collections: hand them out in chunks so the pool overhead stays small
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        scanned = list(executor.map(scan_collection, scan_jobs, chunksize=max(len(scan_jobs) // 64, 1)))
+
+    fragments = {}
+    for result in scanned:
+        fragments.update(result["fragments"])
+
+    docs = {}
+    for result in scanned:
+        if selected and result["collection"] not in selected:
+            continue
+        for module, doc in result["modules"].items():
+            doc = dict(doc, collection=result["collection"])
+            if "error" not in doc:
+                requirements = list(doc["requirements"])
+                for reference in doc.pop("fragments"):
+                    requirements.extend(fragment_requirements(reference, fragments))
+                doc["requirements"] = list(dict.fromkeys(requirements))
+            docs[module] = doc
+    return dict(sorted(docs.items()))
+
+
+def collection_requirements(collection: str, collections_dir: str = COLLECTIONS_DIR,
+                            jobs: Optional[int] = None) -> Dict[str, str]:
+    """
+    :param collection: Collection name, for example ansible.posix or ansible.builtin.
+    :param collections_dir: Path to the ansible_collections directory.
+    :param jobs: Number of worker processes.
+    :return: A module to requirements mapping of every module of the collection, formatted like
+             module_requirements.modules_requirements.
+    """
+    docs = collect_module_docs(collections_dir, True, jobs, [collection])
+    return {module: f"Error: {doc['error']}" if "error" in doc else ", ".join(doc["requirements"]) or "NONE"
+            for module, doc in docs.items()}
+
+
+def write_docs(docs: Dict[str, Dict[str, Any]], output: Any, output_format: str = "tsv") -> None:
+    """
+    Writes the extracted documentation as a tab separated table or as JSON.
+    """
+    if output_format == "json":
+        json.dump(docs, output, indent=1, sort_keys=True)
+        output.write("\n")
+        return
+    output.write("module_name\tversion_added\tshort_description\trequirements\n")
+    for module, doc in docs.items():
+        if "error" in doc:
+            output.write(f"{module}\t\t\tError: {doc['error']}\n")
+        else:
+            requirements = ", ".join(doc["requirements"]) or "NONE"
+            output.write(f"{module}\t{doc['version_added']}\t{doc['short_description']}\t{requirements}\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Extract module documentation without running ansible-doc.")
+    parser.add_argument("--collections-dir", default=COLLECTIONS_DIR,
+                        help=f"Path to the ansible_collections directory (default: {COLLECTIONS_DIR})")
+    parser.add_argument("--no-builtin", action="store_true", help="Leave out the ansible.builtin modules")
+    parser.add_argument("--collection", action="append", metavar="FQCN",
+                        help="Only list the modules of this collection (repeatable)")
+    parser.add_argument("--jobs", "-j", type=int, metavar="N", help="Worker processes (default: CPU count)")
+    parser.add_argument("--format", choices=("tsv", "json"), default="tsv", help="Output format (default: tsv)")
+    parser.add_argument("--output", metavar="FILE", help="Write to FILE instead of stdout")
+    args = parser.parse_args()
+
+    docs = collect_module_docs(args.collections_dir, not args.no_builtin, args.jobs, args.collection)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            write_docs(docs, f, args.format)
+    else:
+        write_docs(docs, sys.stdout, args.format)
+    errors = sum(1 for doc in docs.values() if "error" in doc)
+    print(f"{len(docs)} modules, {errors} without readable DOCUMENTATION", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Requirements of Ansible modules read from their structured documentation.
+
+ansible-doc is started once per batch of modules with --json instead of once per module through a
+shell, so ansible is imported and the plugin paths are scanned once, and the requirements come from
+the "requirements" list of the documentation instead of the "REQUIREMENTS:" line of the rendered text.
+
+Usage:
+python module_requirements.py MODULE [MODULE ...] [--output FILE]
+"""
+
+import argparse
+import json
+import subprocess
+from typing import Any, Dict, Iterable, List, Optional
+
+ANSIBLE_DOC = "ansible-doc"
+
+# Modules per ansible-doc call, keeps the command line short
+BATCH_SIZE = 200
+
+# Values written for modules without requirements and for modules ansible-doc cannot document,
+# the same the per-module text parsing of req.py and requirements.py writes
+NO_REQUIREMENTS = "NONE"
+NOT_FOUND = "Error: Module not found or other issue"
+
+
+def _ansible_doc_json(modules: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    :param modules: Fully qualified module names.
+    :return: The --json output of one ansible-doc call, None when the call failed.
+    """
+    try:
+        process = subprocess.run([ANSIBLE_DOC, "--json", "--type", "module"] + modules,
+                                 capture_output=True, text=True)
+        data = json.loads(process.stdout) if process.stdout.strip() else None
+    except (OSError, ValueError):
+        return None
+    if data is None and process.returncode == 0:
+        return {}
+    return data
+
+
+def _load_batch(batch: List[str], docs: Dict[str, Optional[Dict[str, Any]]]) -> None:
+    """
+    Documents a batch of modules into docs. Missing modules are only warned about and the others
+    are still in the JSON, but one module with unparseable documentation makes ansible-doc exit
+    with an empty stdout, so a failed batch is split in half until only the broken modules are left.
+    """
+    data = _ansible_doc_json(batch)
+    if data is None and len(batch) > 1:
+        middle = len(batch) // 2
+        _load_batch(batch[:middle], docs)
+        _load_batch(batch[middle:], docs)
+        return
+    for module in batch:
+        docs[module] = ((data or {}).get(module) or {}).get("doc")
+
+
+def load_module_docs(modules: Iterable[str], batch_size: int = BATCH_SIZE) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    :param modules: Fully qualified module names.
+    :param batch_size: Number of modules per ansible-doc call.
+    :return: A module to DOCUMENTATION mapping, None for modules ansible-doc did not document.
+    """
+    modules = list(dict.fromkeys(modules))
+    docs = {}
+    for start in range(0, len(modules), batch_size):
+        _load_batch(modules[start:start + batch_size], docs)
+    return docs
+
+
+def format_requirements(doc: Optional[Dict[str, Any]]) -> str:
+    """
+    :param doc: DOCUMENTATION of a module, None when it could not be loaded.
+    :return: The requirements joined like the "REQUIREMENTS:" line of ansible-doc, NONE or NOT_FOUND.
+    """
+    if doc is None:
+        return NOT_FOUND
+    requirements = doc.get("requirements") or []
+    if isinstance(requirements, str):
+        requirements = [requirements]
+    return ", ".join(str(requirement) for requirement in requirements) or NO_REQUIREMENTS
+
+
+def modules_requirements(modules: Iterable[str], batch_size: int = BATCH_SIZE) -> Dict[str, str]:
+    """
+    :param modules: Fully qualified module names.
+    :param batch_size: Number of modules per ansible-doc call.
+    :return: A module to requirements mapping, see format_requirements.
+    """
+    return {module: format_requirements(doc) for module, doc in load_module_docs(modules, batch_size).items()}
+
+
+def write_requirements_table(output_file: str, requirements: Dict[str, str]) -> None:
+    """
+    Writes a tab separated module_name/requirements table.
+    """
+    with open(output_file, 'w') as file:
+        file.write("module_name\trequirements\n")
+        for module, value in requirements.items():
+            file.write(f"{module}\t{value}\n")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Print the requirements of Ansible modules.")
+    parser.add_argument("modules", nargs="+", metavar="MODULE", help="Fully qualified module names")
+    parser.add_argument("--output", metavar="FILE", help="Write a tab separated table to FILE instead of printing")
+    args = parser.parse_args(argv)
+
+    requirements = modules_requirements(args.modules)
+    if args.output:
+        write_requirements_table(args.output, requirements)
+    else:
+        for module, value in requirements.items():
+            print(f"{module}: {value}")
+
+
+if __name__ == "__main__":
+    main()
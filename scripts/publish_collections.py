@@ -1,7 +1,12 @@
 import os
 import subprocess
 import json
-import yaml
+import tarfile
+
+from collection_inventory import scan_inventory
+from collection_state import CollectionState, build_state_key, collection_digest
+from galaxy_builder import build_collection_tarball
+from galaxy_yaml import write_galaxy_file
 
 def convert_manifest_to_galaxy(manifest_file, galaxy_file):
     # Чтение данных из MANIFEST.json
@@ -38,22 +43,20 @@ def convert_manifest_to_galaxy(manifest_file, galaxy_file):
     # Добавляем информацию о лицензии и другие метаданные в galaxy_data
     galaxy_data.update(collection_info_dict)
 
-    # Запись данных в galaxy.yml
-    with open(galaxy_file, 'w') as f:
-        yaml.dump(galaxy_data, f, default_flow_style=False, sort_keys=False)
+    # Запись данных в galaxy.yml, только если содержимое изменилось
+    return write_galaxy_file(galaxy_file, galaxy_data, default_flow_style=False, sort_keys=False)
 
 def build_collection(collection_path):
-    # Строим коллекцию
+    # Строим коллекцию без запуска ansible-galaxy, tar файл пишется в текущую директорию
     print(f"Building collection: {collection_path}")
     try:
-        subprocess.run(['ansible-galaxy', 'collection', 'build', '-c', collection_path], check=True)
-    except subprocess.CalledProcessError as e:
+        collection_tar = build_collection_tarball(collection_path)
+    except (OSError, ValueError, KeyError, tarfile.TarError) as e:
         print(f"Error building collection {collection_path}: {e}")
         return False
 
-    # Получаем имя tar файла
-    collection_name = os.path.basename(collection_path)
-    collection_tar = f"{collection_name}.tar.gz"
+    print(f"Created collection at {collection_tar}")
+    return True
 
     # Публикуем коллекцию
 def publish_collection(collection_path):
@@ -89,27 +92,35 @@ def publish_collection(collection_path):
 
 def main():
     collections_dir = "/usr/share/ansible/collections/ansible_collections/"
+    # Только сборка: состояние хранится отдельно от опубликованных версий
+    server = build_state_key(os.getenv('ANSIBLE_GALAXY_SERVER_GALAXY_URL', ''))
+    state = CollectionState()
     
-    # Проходим по директориям коллекций
-    for namespace in os.listdir(collections_dir):
-        namespace_path = os.path.join(collections_dir, namespace)
-        if os.path.isdir(namespace_path) and not namespace.endswith('.info'):
-            for collection in os.listdir(namespace_path):
-                collection_path = os.path.join(namespace_path, collection)
-                if os.path.isdir(collection_path):
-                    manifest_file = os.path.join(collection_path, 'MANIFEST.json')
-                    galaxy_file = os.path.join(collection_path, 'galaxy.yml')
-
-                    # Проверяем наличие MANIFEST.json
-                    if os.path.exists(manifest_file):
-                        convert_manifest_to_galaxy(manifest_file, galaxy_file)
-                        
-                        # Строим и публикуем коллекцию
-                        success = build_collection(collection_path)
-                        if not success:
-                            print(f"Failed to process collection: {collection_path}")
-                    else:
-                        print(f"MANIFEST.json not found in {collection_path}")
+    # Проходим по коллекциям из индекса (один проход os.scandir)
+    inventory = scan_inventory(collections_dir)
+    for collection_path in inventory.missing_manifest:
+        print(f"MANIFEST.json not found in {collection_path}")
+
+    for entry in inventory:
+        collection_path = entry["path"]
+        galaxy_file = os.path.join(collection_path, 'galaxy.yml')
+
+        # Пропускаем коллекции, которые не менялись с последней успешной сборки
+        name, version = entry["fqcn"], entry["version"]
+        digest = collection_digest(collection_path)
+        if state.is_unchanged(server, name, version, digest, statuses=("built",)):
+            print(f"Collection {name} {version} is unchanged, skipping.")
+            continue
+
+        convert_manifest_to_galaxy(entry["manifest_file"], galaxy_file)
+        
+        # Строим и публикуем коллекцию
+        success = build_collection(collection_path)
+        state.record(server, name, version, digest, "built" if success else "error")
+        if not success:
+            print(f"Failed to process collection: {collection_path}")
+
+    state.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
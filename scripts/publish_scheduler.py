@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Dependency-ordered publish scheduling.
+
+Builds the dependency DAG from collection_info.dependencies of the collections in a run and splits
+it into topological waves: every collection of a wave only depends on collections of earlier waves
+(or on collections that are already available on the server), so a wave can be uploaded concurrently.
+Missing dependencies and dependency cycles are found before anything is built.
+
+Builds do not depend on each other and are started longest first (LPT) from the build times recorded
+in earlier runs, or from the size of the collection directory when a collection has no history yet;
+the uploads within a wave are started longest first as well. The expected makespan of the run is
+simulated from the same estimates.
+"""
+
+import heapq
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+MIB = 1024 * 1024
+
+# Estimates used until a run has recorded durations
+DEFAULT_BUILD_SECONDS_PER_MIB = 0.05
+DEFAULT_PUBLISH_SECONDS = 1.0
+
+
+def dependency_graph(entries: Iterable[Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """
+    :param entries: Inventory entries of the collections in the run.
+    :return: A collection to dependency names mapping (version constraints are not evaluated).
+    """
+    return {entry["fqcn"]: set(entry.get("dependencies") or {}) for entry in entries}
+
+
+def find_missing(graph: Dict[str, Set[str]], available: Optional[Set[str]]) -> Dict[str, List[str]]:
+    """
+    Finds dependencies that are neither part of the run nor available on the server.
+
+    :param graph: Dependency graph, see dependency_graph.
+    :param available: Collections already available on the server; None when that is unknown,
+                      in which case dependencies outside the run are assumed to be available.
+    :return: A collection to missing dependencies mapping.
+    """
+    if available is None:
+        return {}
+
+    missing = {}
+    for collection, dependencies in graph.items():
+        absent = sorted(dep for dep in dependencies if dep not in graph and dep not in available)
+        if absent:
+            missing[collection] = absent
+    return missing
+
+
+def find_cycles(graph: Dict[str, Set[str]]) -> List[List[str]]:
+    """
+    Finds the dependency cycles between the collections of a run.
+
+    :param graph: Dependency graph, see dependency_graph.
+    :return: A list of cycles, each a list of collection names with the first name repeated at the end.
+    """
+    cycles = []
+    state = {}  # collection -> 1 while on the DFS stack, 2 when done
+
+    for start in sorted(graph):
+        if start in state:
+            continue
+        stack = [(start, iter(sorted(dep for dep in graph[start] if dep in graph)))]
+        path = [start]
+        state[start] = 1
+
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                path.pop()
+                state[node] = 2
+            elif state.get(child) == 1:
+                cycles.append(path[path.index(child):] + [child])
+            elif child not in state:
+                state[child] = 1
+                path.append(child)
+                stack.append((child, iter(sorted(dep for dep in graph[child] if dep in graph))))
+    return cycles
+
+
+def topological_waves(graph: Dict[str, Set[str]], blocked: Iterable[str] = ()) -> List[List[str]]:
+    """
+    Splits the collections of a run into waves with Kahn's algorithm.
+
+    :param graph: Dependency graph, see dependency_graph.
+    :param blocked: Collections that must not be published (missing dependencies, cycles);
+                    everything that depends on them is left out as well.
+    :return: Sorted lists of collection names, one list per wave.
+    """
+    blocked = set(blocked)
+    remaining = {collection: {dep for dep in deps if dep in graph}
+                 for collection, deps in graph.items() if collection not in blocked}
+    waves = []
+
+    while remaining:
+        wave = sorted(collection for collection, deps in remaining.items() if not deps)
+        if not wave:
+            break  # the rest depends on a blocked collection or a cycle
+        waves.append(wave)
+        for collection in wave:
+            del remaining[collection]
+        for deps in remaining.values():
+            deps.difference_update(wave)
+
+    return waves
+
+
+def schedule(entries: Iterable[Dict[str, Any]], available: Optional[Set[str]] = None) -> Dict[str, Any]:
+    """
+    Validates the dependencies of a run and computes its publish waves.
+
+    :param entries: Inventory entries of the collections in the run.
+    :param available: Collections already available on the server, None when unknown.
+    :return: A dict with the waves, the missing dependencies, the cycles and the blocked collections
+             (collection -> reason) that will not be published.
+    """
+    graph = dependency_graph(entries)
+    missing = find_missing(graph, available)
+    cycles = find_cycles(graph)
+
+    blocked = {collection: f"missing dependencies: {', '.join(deps)}" for collection, deps in missing.items()}
+    for cycle in cycles:
+        for collection in cycle[:-1]:
+            blocked.setdefault(collection, f"dependency cycle: {' -> '.join(cycle)}")
+
+    waves = topological_waves(graph, blocked)
+    scheduled = {collection for wave in waves for collection in wave}
+    for collection in graph:
+        if collection not in scheduled and collection not in blocked:
+            blocked[collection] = "depends on a collection that cannot be published"
+
+    return {"waves": waves, "missing": missing, "cycles": cycles, "blocked": blocked}
+
+
+def print_schedule(plan: Dict[str, Any]) -> None:
+    """
+    Prints the dependency problems and the publish waves of a run.
+
+    :param plan: A dict returned by schedule.
+    """
+    for collection, deps in sorted(plan["missing"].items()):
+        print(f"Collection {collection} has missing dependencies: {', '.join(deps)}")
+    for cycle in plan["cycles"]:
+        print(f"Dependency cycle: {' -> '.join(cycle)}")
+    for index, wave in enumerate(plan["waves"], 1):
+        print(f"Wave {index}: {', '.join(wave)}")
+
+
+def directory_size(path: str) -> int:
+    """
+    :param path: Path of a directory.
+    :return: The total size of the regular files below path in bytes (symlinks are not followed).
+    """
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+    return total
+
+
+def estimate_durations(entries: Iterable[Dict[str, Any]],
+                       history: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Estimates the build and publish time of every collection.
+
+    A collection with recorded durations uses them. Otherwise the build time is derived from the size of
+    its directory and the build rate (seconds per MiB) of the collections with history, and the publish
+    time is the median recorded publish time.
+
+    :param entries: Inventory entries of the collections.
+    :param history: Recorded durations, see CollectionState.durations.
+    :return: A collection to {"build": seconds, "publish": seconds, "source": "history" or "size",
+             "source_size": bytes or None} mapping; source_size is only measured for collections
+             without history.
+    """
+    sized = [item for item in history.values() if item.get("build_seconds") is not None and item.get("source_size")]
+    if sized:
+        rate = sum(item["build_seconds"] for item in sized) / (sum(item["source_size"] for item in sized) / MIB)
+    else:
+        rate = DEFAULT_BUILD_SECONDS_PER_MIB
+    publishes = sorted(item["publish_seconds"] for item in history.values() if item.get("publish_seconds") is not None)
+    default_publish = publishes[len(publishes) // 2] if publishes else DEFAULT_PUBLISH_SECONDS
+
+    estimates = {}
+    for entry in entries:
+        recorded = history.get(entry["fqcn"], {})
+        estimate = {"source": "history", "source_size": None}
+        if recorded.get("build_seconds") is not None:
+            estimate["build"] = recorded["build_seconds"]
+        else:
+            estimate["source"] = "size"
+            estimate["source_size"] = directory_size(entry["path"])
+            estimate["build"] = estimate["source_size"] / MIB * rate
+        publish = recorded.get("publish_seconds")
+        estimate["publish"] = publish if publish is not None else default_publish
+        estimates[entry["fqcn"]] = estimate
+    return estimates
+
+
+def lpt_order(collections: Iterable[str], seconds: Dict[str, float]) -> List[str]:
+    """
+    :param collections: Collection names.
+    :param seconds: Estimated duration of every collection.
+    :return: The collections ordered longest first, ties by name.
+    """
+    return sorted(collections, key=lambda collection: (-seconds[collection], collection))
+
+
+def _assign(order: List[str], seconds: Dict[str, float], workers: int, start: float = 0.0) -> Dict[str, float]:
+    """
+    Simulates a pool of workers that takes the jobs in order.
+
+    :return: A collection to finish time mapping.
+    """
+    free = [start] * max(workers, 1)
+    finish = {}
+    for collection in order:
+        begin = heapq.heappop(free)
+        finish[collection] = begin + seconds[collection]
+        heapq.heappush(free, finish[collection])
+    return finish
+
+
+def expected_makespan(waves: List[List[str]], estimates: Dict[str, Dict[str, Any]], jobs: int,
+                      publish_jobs: int) -> Dict[str, float]:
+    """
+    Simulates a run: all builds start longest first on the build processes (with a single job each
+    wave is built right before it is uploaded), a wave is uploaded longest first once it is built
+    and the previous wave is published.
+
+    :param waves: Publish waves, see schedule.
+    :param estimates: Estimated durations, see estimate_durations.
+    :param jobs: Number of build processes.
+    :param publish_jobs: Number of concurrent uploads.
+    :return: A dict with the expected "build" time of all builds and the "total" run time in seconds.
+    """
+    build = {collection: estimates[collection]["build"] for wave in waves for collection in wave}
+    publish = {collection: estimates[collection]["publish"] for wave in waves for collection in wave}
+
+    built = _assign(lpt_order(build, build), build, jobs) if jobs > 1 else {}
+    total = 0.0
+    for wave in waves:
+        if jobs > 1:
+            start = max([total] + [built[collection] for collection in wave])
+        else:
+            start = total + sum(build[collection] for collection in wave)
+        total = max(_assign(lpt_order(wave, publish), publish, publish_jobs, start).values(), default=start)
+
+    build_time = max(built.values(), default=0.0) if jobs > 1 else sum(build.values())
+    return {"build": build_time, "total": total}
+
+
+def print_makespan(makespan: Dict[str, float], estimates: Dict[str, Dict[str, Any]], longest: int = 3) -> None:
+    """
+    Prints the expected makespan of a run and its longest builds.
+
+    :param makespan: A dict returned by expected_makespan.
+    :param estimates: Estimated durations, see estimate_durations.
+    :param longest: Number of longest builds to list.
+    """
+    if not estimates:
+        return
+    recorded = sum(1 for estimate in estimates.values() if estimate["source"] == "history")
+    print(f"Expected makespan: {makespan['total']:.1f}s (builds {makespan['build']:.1f}s; "
+          f"{recorded} of {len(estimates)} collections estimated from earlier runs, the rest from their size)")
+    seconds = {collection: estimate["build"] for collection, estimate in estimates.items()}
+    ranked = [f"{collection} {seconds[collection]:.1f}s" for collection in lpt_order(seconds, seconds)[:longest]]
+    print(f"Longest builds: {', '.join(ranked)}")
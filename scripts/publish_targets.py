@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Publish targets: the Galaxy / Automation Hub repositories a built collection is uploaded to.
+
+A targets file lists the endpoints with their own token and routing rules, for example:
+
+    targets:
+      - name: validated
+        url: https://hub.example.com
+        publish_path: /api/galaxy/content/validated/
+        token_env: HUB_TOKEN
+        exclude_tags: [aacertified]
+      - name: aa-certified
+        url: https://hub.example.com
+        publish_path: /api/galaxy/content/aa-certified/
+        token_env: HUB_TOKEN
+        tags: [aacertified]
+      - name: dr-mirror
+        url: https://dr-hub.example.com
+        publish_path: /api/galaxy/content/validated/
+        token_env: DR_HUB_TOKEN
+        exclude_namespaces: [sandbox]
+        concurrency: {initial: 2, max: 8}
+
+A target matches a collection that has any of its tags (when tags are given), belongs to one of its
+namespaces (when namespaces are given) and has none of its exclude_tags and exclude_namespaces.
+Without a targets file the validated and aa-certified targets are derived from
+ANSIBLE_GALAXY_SERVER_GALAXY_URL, which routes exactly like the aacertified tag rule.
+
+The optional concurrency mapping configures the adaptive request limiter of the target's server
+(see galaxy_limits); targets on the same server share one limiter.
+"""
+
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import yaml
+
+CERTIFIED_TAG = "aacertified"
+VALIDATED_PATH = "/api/galaxy/content/validated/"
+AA_CERTIFIED_PATH = "/api/galaxy/content/aa-certified/"
+
+RULE_KEYS = ("tags", "exclude_tags", "namespaces", "exclude_namespaces")
+
+# Keys of the concurrency mapping and the galaxy_limits.AIMDLimiter arguments they set
+CONCURRENCY_KEYS = {"initial": "initial", "min": "min_limit", "max": "max_limit", "increase": "increase",
+                    "decrease": "decrease", "latency_ratio": "latency_ratio"}
+
+
+def join_publish_url(galaxy_url: str, publish_path: str) -> str:
+    """
+    Joins the base URL of the Ansible Galaxy server with the publish_url path of a collection.
+
+    :param galaxy_url: The base URL of the Ansible Galaxy server.
+    :param publish_path: The publish_url value from galaxy.yml.
+    :return: The full URL for publishing the collection.
+    """
+    if galaxy_url.startswith("http://") or galaxy_url.startswith("https://"):
+        publish_url = galaxy_url
+    else:
+        publish_url = f"https://{galaxy_url}"
+
+    return publish_url + publish_path
+
+
+def make_target(name: str, url: str, publish_path: str = "", token: Optional[str] = None,
+                state_key: Optional[str] = None, concurrency: Optional[Dict[str, float]] = None,
+                **rules: Iterable[str]) -> Dict[str, Any]:
+    """
+    :param name: Name of the target, used in the results and logs.
+    :param url: Base URL of the server.
+    :param publish_path: Path of the repository on the server.
+    :param token: API token of the server.
+    :param state_key: Server key of the target in the state store, the publish URL by default.
+    :param concurrency: Limiter settings of the server, see CONCURRENCY_KEYS.
+    :param rules: Routing rules: tags, exclude_tags, namespaces and exclude_namespaces.
+    :return: A target dict; "concurrency" holds the AIMDLimiter arguments.
+    """
+    unknown = set(rules) - set(RULE_KEYS)
+    if unknown:
+        raise ValueError(f"target {name}: unknown routing rules: {', '.join(sorted(unknown))}")
+    unknown = set(concurrency or {}) - set(CONCURRENCY_KEYS)
+    if unknown:
+        raise ValueError(f"target {name}: unknown concurrency settings: {', '.join(sorted(unknown))}")
+
+    publish_url = join_publish_url(url, publish_path)
+    target = {"name": name, "url": url, "publish_path": publish_path, "publish_url": publish_url,
+              "token": token, "state_key": state_key if state_key is not None else publish_url,
+              "concurrency": {CONCURRENCY_KEYS[key]: float(value) for key, value in (concurrency or {}).items()}}
+    for key in RULE_KEYS:
+        target[key] = set(rules.get(key) or ())
+    return target
+
+
+def default_targets(galaxy_url: Optional[str], token: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    :param galaxy_url: Value of ANSIBLE_GALAXY_SERVER_GALAXY_URL.
+    :param token: Value of ANSIBLE_GALAXY_SERVER_VALIDATED_TOKEN.
+    :return: The validated and aa-certified targets of the server. Both keep the server URL
+             as their state store key, so state recorded before targets existed stays valid.
+    """
+    galaxy_url = galaxy_url or ""
+    return [
+        make_target("validated", galaxy_url, VALIDATED_PATH, token, state_key=galaxy_url,
+                    exclude_tags=[CERTIFIED_TAG]),
+        make_target("aa-certified", galaxy_url, AA_CERTIFIED_PATH, token, state_key=galaxy_url,
+                    tags=[CERTIFIED_TAG]),
+    ]
+
+
+def load_targets(targets_file: str) -> List[Dict[str, Any]]:
+    """
+    Reads a targets file.
+
+    :param targets_file: Path of the YAML targets file.
+    :return: The list of target dicts.
+    :raises ValueError: When the file is invalid or a token environment variable is not set.
+    """
+    with open(targets_file, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+
+    items = data.get("targets") if isinstance(data, dict) else None
+    if not items or not isinstance(items, list):
+        raise ValueError(f"{targets_file}: expected a non-empty 'targets' list")
+
+    targets = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("url"):
+            raise ValueError(f"{targets_file}: target #{index + 1} has no url")
+        name = str(item.get("name") or f"target-{index + 1}")
+
+        token = item.get("token")
+        if item.get("token_env"):
+            token = os.getenv(item["token_env"])
+            if not token:
+                raise ValueError(f"target {name}: environment variable {item['token_env']} is not set")
+
+        rules = {key: value for key, value in item.items() if key not in ("name", "url", "publish_path", "token",
+                                                                            "token_env")}
+        targets.append(make_target(name, item["url"], item.get("publish_path", ""), token, **rules))
+
+    names = [target["name"] for target in targets]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"{targets_file}: duplicate target names: {', '.join(duplicates)}")
+    return targets
+
+
+def route_targets(entry: Dict[str, Any], targets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    :param entry: Inventory entry of a collection (namespace and tags are used).
+    :param targets: All targets.
+    :return: The targets the collection is published to, in configuration order.
+    """
+    tags = set(entry.get("tags") or ())
+    namespace = entry["namespace"]
+    matched = []
+    for target in targets:
+        if target["tags"] and not target["tags"] & tags:
+            continue
+        if target["namespaces"] and namespace not in target["namespaces"]:
+            continue
+        if target["exclude_tags"] & tags or namespace in target["exclude_namespaces"]:
+            continue
+        matched.append(target)
+    return matched
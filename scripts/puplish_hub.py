@@ -1,7 +1,12 @@
 import os
 import subprocess
 import json
-import yaml
+import tarfile
+
+from collection_inventory import scan_inventory
+from collection_state import CollectionState, collection_digest
+from galaxy_builder import build_collection_tarball
+from galaxy_yaml import write_galaxy_file
 
 def convert_manifest_to_galaxy(manifest_file, galaxy_file):
     # Чтение данных из MANIFEST.json
@@ -38,39 +43,21 @@ def convert_manifest_to_galaxy(manifest_file, galaxy_file):
     # Добавляем информацию о лицензии и другие метаданные в galaxy_data
     galaxy_data.update(collection_info_dict)
 
-    # Запись данных в galaxy.yml
-    with open(galaxy_file, 'w') as f:
-        yaml.dump(galaxy_data, f, default_flow_style=False, sort_keys=False)
+    # Запись данных в galaxy.yml, только если содержимое изменилось
+    return write_galaxy_file(galaxy_file, galaxy_data, default_flow_style=False, sort_keys=False)
 
 def build_collection(collection_path):
     collections_dir = "/usr/share/ansible/collections/ansible_collections/"
-    # Переходим в директорию collections_dir
-    os.chdir(collections_dir)
-    # Строим коллекцию
+    # Строим коллекцию без запуска ansible-galaxy, tar файл пишется в collections_dir
     print(f"Building collection: {collection_path}")
     try:
-        subprocess.run(['ansible-galaxy', 'collection', 'build', '-c', collection_path], check=True)
-    except subprocess.CalledProcessError as e:
+        collection_tar = build_collection_tarball(collection_path, output_path=collections_dir)
+    except (OSError, ValueError, KeyError, tarfile.TarError) as e:
         print(f"Error building collection {collection_path}: {e}")
         return None
 
-    # Получаем имя коллекции и пространство имен
-    namespace, collection_name = os.path.split(collection_path.rstrip('/'))
-    collection_name = f"{namespace}-{collection_name}"  # Формируем имя файла
-
-    # Используем шаблон для поиска созданного файла
-    collection_tar_pattern = f"{namespace}-{collection_name}-*.tar.gz"
-    collection_tar_path = os.path.join(collections_dir, collection_tar_pattern)
-
-    # Ищем созданный файл
-    created_files = [f for f in os.listdir(collections_dir) if f.startswith(f"{namespace}-{collection_name}") and f.endswith('.tar.gz')]
-    
-    if not created_files:
-        print(f"Созданный файл для коллекции {collection_name} не найден.")
-        return None
-
-    # Возвращаем полный путь к первому найденному файлу
-    return os.path.join(collections_dir, created_files[0])
+    # Возвращаем полный путь к созданному файлу
+    return collection_tar
 
 def publish_collection(collection_tar):
     galaxy_url = os.getenv('ANSIBLE_GALAXY_SERVER_GALAXY_URL')
@@ -78,7 +65,7 @@ def publish_collection(collection_tar):
 
     if not galaxy_url or not validated_token:
         print("Не установлены необходимые переменные окружения.")
-        return False
+        return "error"
 
     # Добавляем нужный путь к URL сервера
     if not galaxy_url.endswith('/api/galaxy/content/validated/'):
@@ -94,41 +81,51 @@ def publish_collection(collection_tar):
         '--ignore-certs'  # Добавляем опцию игнорирования сертификатов
     ]
 
+    # Вывод ansible-galaxy перехватываем, чтобы по нему отличить "уже существует" от ошибки
     try:
-        subprocess.run(command, check=True)
+        subprocess.run(command, check=True, capture_output=True, text=True)
         print(f"Коллекция {collection_tar} успешно опубликована.")
+        return "published"
     except subprocess.CalledProcessError as e:
-        if "already exists" in str(e):
+        output = f"{e.stdout or ''}{e.stderr or ''}"
+        if "already exists" in output:
             print(f"Коллекция {collection_tar} уже существует на Galaxy.")
-        elif "namespace" in str(e):
+            return "exists"
+        elif "namespace" in output.lower():
             print(f"Namespace для {collection_tar} не существует на Galaxy.")
-        else:
-            print(f"Ошибка при публикации коллекции {collection_tar}: {e}")
-        return False
-
-    return True
+            return "missing-namespace"
+        print(f"Ошибка при публикации коллекции {collection_tar}: {e}")
+        if output.strip():
+            print(output.strip())
+        return "error"
 
 def main():
     collections_dir = "/usr/share/ansible/collections/ansible_collections/"
+    server = os.getenv('ANSIBLE_GALAXY_SERVER_GALAXY_URL', '')
+    state = CollectionState()
     
-    # Проходим по директориям коллекций
-    for namespace in os.listdir(collections_dir):
-        namespace_path = os.path.join(collections_dir, namespace)
-        if os.path.isdir(namespace_path) and not namespace.endswith('.info'):
-            for collection in os.listdir(namespace_path):
-                collection_path = os.path.join(namespace_path, collection)
-                if os.path.isdir(collection_path):
-                    manifest_file = os.path.join(collection_path, 'MANIFEST.json')
-                    galaxy_file = os.path.join(collection_path, 'galaxy.yml')
-
-                    # Проверяем наличие MANIFEST.json
-                    if os.path.exists(manifest_file):
-                        convert_manifest_to_galaxy(manifest_file, galaxy_file)
-                        
-                        # Строим и публикуем коллекцию
-                        collection_tar = build_collection(collection_path)
-                        if collection_tar:
-                            publish_collection(collection_tar)
+    # Проходим по коллекциям из индекса (один проход os.scandir)
+    for entry in scan_inventory(collections_dir):
+        collection_path = entry["path"]
+        galaxy_file = os.path.join(collection_path, 'galaxy.yml')
+
+        # Пропускаем коллекции, которые не менялись с последней успешной публикации
+        name, version = entry["fqcn"], entry["version"]
+        digest = collection_digest(collection_path)
+        if state.is_unchanged(server, name, version, digest):
+            print(f"Коллекция {name} {version} не изменилась, пропускаем.")
+            continue
+
+        convert_manifest_to_galaxy(entry["manifest_file"], galaxy_file)
+        
+        # Строим и публикуем коллекцию
+        collection_tar = build_collection(collection_path)
+        if collection_tar:
+            # "exists" тоже считается опубликованной (DONE_STATUSES), при следующем запуске она пропускается
+            status = publish_collection(collection_tar)
+            state.record(server, name, version, digest, status)
+
+    state.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,8 @@
+import argparse
 import subprocess
 
+from module_requirements import modules_requirements, write_requirements_table
+
 # Список модулей Ansible
 modules = [
 	"ansible.builtin.add_host",
@@ -87,9 +90,25 @@ def get_module_requirements(module_name):
     except subprocess.CalledProcessError:
         return "Error: Module not found or other issue"
 
-# Создаем и записываем результаты в файл в виде таблицы
-with open('req_ans_builtin.txt', 'w') as file:
-    file.write("module_name\trequirements\n")  # Заголовки столбцов
-    for module in modules:
-        requirements = get_module_requirements(module)
-        file.write(f"{module}\t{requirements}\n")
+if __name__ == "__main__":
+    # По умолчанию один вызов ansible-doc --json на все модули из списка, --per-module - старый режим,
+    # --static - все модули коллекции без ansible-doc
+    parser = argparse.ArgumentParser(description="Записать требования модулей ansible.builtin в req_ans_builtin.txt")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--per-module", action="store_true", help="Запускать ansible-doc отдельно для каждого модуля")
+    mode.add_argument("--static", action="store_true",
+                      help="Читать DOCUMENTATION всех модулей коллекции из исходников, без ansible-doc")
+    args = parser.parse_args()
+
+    if args.per_module:
+        results = {module: get_module_requirements(module) for module in modules}
+    elif args.static:
+        # Все модули коллекции без запуска ansible-doc: DOCUMENTATION читается через ast.
+        # module_docs (и PyYAML) нужен только здесь, поэтому импортируется в этой ветке
+        from module_docs import collection_requirements
+        results = collection_requirements("ansible.builtin")
+    else:
+        results = modules_requirements(modules)
+
+    # Создаем и записываем результаты в файл в виде таблицы
+    write_requirements_table('req_ans_builtin.txt', results)
@@ -1,4 +1,8 @@
+import argparse
 import subprocess
+
+from module_requirements import modules_requirements
+
 # Список модулей Ansible
 # Тут указана часть модулей, расписанных выше
 # Для экономии места
@@ -30,7 +34,26 @@ def get_module_requirements(module_name):
         return requirements
     except subprocess.CalledProcessError:
         return "Error: Module not found or other issue"
-# Для каждого модуля выполняем команду ansible-doc и извлекаем информацию о REQUIREMENTS
-for module in modules:
-    requirements = get_module_requirements(module)
-    print(f"{module}: {requirements}")
+if __name__ == "__main__":
+    # По умолчанию один вызов ansible-doc --json на все модули,
+    # с --per-module для каждого модуля выполняем команду ansible-doc и извлекаем информацию о REQUIREMENTS,
+    # с --static берем все модули коллекции из их исходников
+    parser = argparse.ArgumentParser(description="Вывести требования модулей ansible.posix")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--per-module", action="store_true", help="Запускать ansible-doc отдельно для каждого модуля")
+    mode.add_argument("--static", action="store_true",
+                      help="Читать DOCUMENTATION всех модулей коллекции из исходников, без ansible-doc")
+    args = parser.parse_args()
+
+    if args.per_module:
+        results = {module: get_module_requirements(module) for module in modules}
+    elif args.static:
+        # Все модули коллекции без запуска ansible-doc: DOCUMENTATION читается через ast.
+        # module_docs (и PyYAML) нужен только здесь, поэтому импортируется в этой ветке
+        from module_docs import collection_requirements
+        results = collection_requirements("ansible.posix")
+    else:
+        results = modules_requirements(modules)
+
+    for module, requirements in results.items():
+        print(f"{module}: {requirements}")
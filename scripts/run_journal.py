@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Append-only journal of a publish run.
+
+Every stage a collection passes (converted, built with the tarball path and sha256, published)
+is appended as one JSON line and flushed right away, so a run that dies halfway leaves a journal
+that --resume can continue from: collections that were already published are skipped and tarballs
+that were already built are reused once their sha256 is verified. A checkpoint only matches a
+collection with the same version, content digest and build options (builder and build_ignore
+policy), so a resumed run with other options rebuilds instead of reusing a different tarball.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from collection_state import file_sha256
+
+DEFAULT_JOURNAL_FILE = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "ansible-collections-publish",
+    "journal.jsonl"
+)
+
+CONVERTED = "converted"
+BUILT = "built"
+PUBLISHED = "published"
+
+
+def build_options(builder: str, ignore_policy: Optional[Dict[str, List[str]]] = None, verify: bool = False) -> str:
+    """
+    :param builder: Tarball builder, see exports_collections.build_stage.
+    :param ignore_policy: build_ignore policy of the run, None when none is applied.
+    :param verify: Whether the built tarballs are verified, so a verified run never reuses unverified ones.
+    :return: A short digest of the options that change the built tarball, kept in every checkpoint.
+    """
+    options = json.dumps({"builder": builder, "build_ignore": ignore_policy, "verify": verify}, sort_keys=True)
+    return hashlib.sha256(options.encode()).hexdigest()[:16]
+
+
+def load_checkpoints(journal_file: str) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Reads a journal and keeps the last record of every collection and stage.
+    A torn last line of a killed run is ignored.
+
+    :param journal_file: Path of the journal.
+    :return: A collection to {stage: record} mapping.
+    """
+    checkpoints = {}
+    try:
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "collection" in record and "stage" in record:
+                    checkpoints.setdefault(record["collection"], {})[record["stage"]] = record
+    except FileNotFoundError:
+        pass
+    return checkpoints
+
+
+class RunJournal:
+    """
+    Journal of the current run. Starting without resume truncates the journal of the previous run.
+    Records may be appended from several publish threads.
+    """
+
+    def __init__(self, journal_file: str = DEFAULT_JOURNAL_FILE, resume: bool = False) -> None:
+        """
+        :param journal_file: Path of the journal.
+        :param resume: Continue the journal of the previous run instead of starting a new one.
+        """
+        self.journal_file = journal_file
+        self.checkpoints = load_checkpoints(journal_file) if resume else {}
+        journal_dir = os.path.dirname(journal_file)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(journal_file, 'a' if resume else 'w', encoding='utf-8')
+        self._write({"event": "resume" if resume else "start", "time": time.time(), "pid": os.getpid()})
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record, sort_keys=True) + "\n")
+            self._file.flush()
+
+    def record(self, collection: str, stage: str, version: str, digest: str, options: str = "",
+               **fields: Any) -> None:
+        """
+        Appends a checkpoint of a collection.
+
+        :param collection: Collection name in <namespace>.<collection> format.
+        :param stage: converted, built or published.
+        :param version: Version of the collection.
+        :param digest: Digest of MANIFEST.json and FILES.json, see collection_state.collection_digest.
+        :param options: Build options of the run, see build_options.
+        :param fields: Stage details, for example tarball and sha256 or status and message.
+        """
+        record = dict(fields, collection=collection, stage=stage, version=version, digest=digest, options=options,
+                      time=time.time())
+        self._write(record)
+        with self._lock:
+            self.checkpoints.setdefault(collection, {})[stage] = record
+
+    def checkpoint(self, collection: str, stage: str, version: str, digest: str,
+                   options: str = "") -> Optional[Dict[str, Any]]:
+        """
+        :return: The last record of the stage if it was made for the same version, content and build options,
+                 otherwise None.
+        """
+        record = self.checkpoints.get(collection, {}).get(stage)
+        if record and record.get("version") == version and record.get("digest") == digest \
+                and record.get("options", "") == options:
+            return record
+        return None
+
+    def built_tarball(self, collection: str, version: str, digest: str,
+                      options: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Finds a tarball built by an earlier attempt that can be published without rebuilding it.
+
+        :return: The "built" record when its tarball still exists with the recorded sha256, otherwise None.
+        """
+        record = self.checkpoint(collection, BUILT, version, digest, options)
+        if not record or not os.path.isfile(record.get("tarball", "")):
+            return None
+        try:
+            if file_sha256(record["tarball"]) != record.get("sha256"):
+                return None
+        except OSError:
+            return None
+        return record
+
+    def close(self, event: str = "finish") -> None:
+        self._write({"event": event, "time": time.time()})
+        self._file.close()
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self.close("finish" if exc_type is None else "abort")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per-stage timing events and profiling of a publish run.
+
+Every stage of every collection (convert, build, verify, publish, import) and every run-wide stage
+(inventory, catalog) becomes one JSON-lines event with start/end timestamps, duration and outcome;
+built collections also carry the tarball size. Build stages run in worker processes, so they measure
+themselves into the "timings" of their result dict and the events are emitted by the main process.
+Changes of the adaptive concurrency limit of a server become "limit" events.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+from typing import Any, Callable, Dict, Optional
+
+# Stages of a single collection, in pipeline order
+COLLECTION_STAGES = ("convert", "build", "verify", "publish", "import")
+
+
+def stage_timing(start: float, outcome: str) -> Dict[str, Any]:
+    """
+    :param start: time.time() when the stage started.
+    :param outcome: Outcome of the stage, for example built or build-error.
+    :return: The timing of a finished stage as stored in the "timings" of a result dict.
+    """
+    return {"start": start, "end": time.time(), "outcome": outcome}
+
+
+class RunMetrics:
+    """
+    Collects the stage events of a run and optionally streams them to a JSON-lines file.
+    """
+
+    def __init__(self, events_file: Optional[str] = None) -> None:
+        """
+        :param events_file: Path of the JSON-lines event file, "-" for stderr, None to only keep events in memory.
+        """
+        self.events = []
+        self.limits = {}   # server -> {"limit": current, "min": lowest, "max": highest, "changes": count}
+        if events_file == "-":
+            self._file = sys.stderr
+        elif events_file:
+            self._file = open(events_file, 'w', encoding='utf-8')
+        else:
+            self._file = None
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        self.events.append(event)
+        if self._file is not None:
+            self._file.write(json.dumps(event, sort_keys=True) + "\n")
+            self._file.flush()
+
+    def stage(self, stage: str, start: float, end: float, outcome: str = "ok",
+              collection: Optional[str] = None, **fields: Any) -> None:
+        """
+        Emits the event of a finished stage.
+
+        :param stage: Name of the stage.
+        :param start: Start timestamp (time.time()).
+        :param end: End timestamp (time.time()).
+        :param outcome: Outcome of the stage.
+        :param collection: Collection name, None for run-wide stages.
+        :param fields: Extra event fields, for example tarball_size or count.
+        """
+        self.emit(dict(fields, event="stage", stage=stage, collection=collection, start=start, end=end,
+                       duration=round(end - start, 6), outcome=outcome))
+
+    def limit(self, server: str, limit: float, reason: str) -> None:
+        """
+        Emits a change of the concurrency limit of a server; used as the galaxy_limits listener,
+        so it may be called from any thread.
+
+        :param server: Server the limit applies to.
+        :param limit: New limit.
+        :param reason: Why it changed, for example healthy, latency or HTTP 429.
+        """
+        self.emit({"event": "limit", "server": server, "limit": round(limit, 3), "reason": reason,
+                   "time": time.time()})
+        totals = self.limits.setdefault(server, {"limit": limit, "min": limit, "max": limit, "changes": 0})
+        totals.update(limit=limit, min=min(totals["min"], limit), max=max(totals["max"], limit),
+                      changes=totals["changes"] + 1)
+
+    def record_result(self, result: Dict[str, Any]) -> None:
+        """
+        Emits the events of the stage timings of a collection result.
+
+        :param result: A result dict of exports_collections.run_collections.
+        """
+        tarball_size = None
+        if result.get("tarball") and os.path.isfile(result["tarball"]):
+            tarball_size = os.path.getsize(result["tarball"])
+
+        for stage in COLLECTION_STAGES:
+            timing = result.get("timings", {}).get(stage)
+            if timing:
+                self.stage(stage, timing["start"], timing["end"], timing["outcome"], result["collection"],
+                           tarball_size=tarball_size)
+
+    def summary(self, slowest: int = 10) -> Dict[str, Any]:
+        """
+        :param slowest: Number of slowest collections to list.
+        :return: A dict with per-stage totals (count, seconds, max seconds, outcomes), the slowest
+                 collections by their summed stage durations and the concurrency limits per server.
+        """
+        stages = {}
+        per_collection = {}
+        for event in self.events:
+            if event.get("event") != "stage":
+                continue
+            totals = stages.setdefault(event["stage"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                        "outcomes": {}})
+            totals["count"] += 1
+            totals["seconds"] += event["duration"]
+            totals["max_seconds"] = max(totals["max_seconds"], event["duration"])
+            totals["outcomes"][event["outcome"]] = totals["outcomes"].get(event["outcome"], 0) + 1
+            if event["collection"]:
+                per_collection[event["collection"]] = per_collection.get(event["collection"], 0.0) + event["duration"]
+
+        ranked = sorted(per_collection.items(), key=lambda item: item[1], reverse=True)[:slowest]
+        return {"stages": stages, "slowest": [{"collection": name, "seconds": seconds} for name, seconds in ranked],
+                "limits": {server: dict(totals) for server, totals in self.limits.items()}}
+
+    def print_summary(self, slowest: int = 10) -> None:
+        """
+        Prints the per-stage totals and the slowest collections.
+        """
+        summary = self.summary(slowest)
+        if not summary["stages"]:
+            return
+
+        print(f"\n{'STAGE':<10} {'COUNT':>6} {'TOTAL S':>9} {'MAX S':>8}  OUTCOMES")
+        for stage, totals in summary["stages"].items():
+            outcomes = ", ".join(f"{outcome}: {count}" for outcome, count in sorted(totals["outcomes"].items()))
+            print(f"{stage:<10} {totals['count']:>6} {totals['seconds']:>9.3f} {totals['max_seconds']:>8.3f}  {outcomes}")
+
+        if summary["slowest"]:
+            print("\nSlowest collections:")
+            for item in summary["slowest"]:
+                print(f"  {item['seconds']:8.3f}s  {item['collection']}")
+
+        if summary["limits"]:
+            print("\nConcurrency limits:")
+            for server, totals in sorted(summary["limits"].items()):
+                print(f"  {server}: {totals['limit']:.1f} (range {totals['min']:.1f}-{totals['max']:.1f}, "
+                      f"{totals['changes']} changes)")
+
+    def close(self) -> None:
+        """
+        Emits the summary event and closes the event file.
+        """
+        self.emit(dict(self.summary(), event="summary", time=time.time()))
+        if self._file is not None and self._file is not sys.stderr:
+            self._file.close()
+
+    def __enter__(self) -> "RunMetrics":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def run_profiled(func: Callable[..., Any], stats_file: str, *args: Any, top: int = 25) -> Any:
+    """
+    Runs a function under cProfile, dumps the stats and prints the top entries by cumulative time.
+    Only the calling process is profiled, build worker processes are not.
+
+    :param func: Function to run.
+    :param stats_file: File the pstats data is written to (open it with `python -m pstats`).
+    :param args: Arguments of func.
+    :param top: Number of entries to print.
+    :return: The return value of func.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        profiler.dump_stats(stats_file)
+        print(f"\nProfile written to {stats_file}")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
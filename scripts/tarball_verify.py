@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Verification of a built collection tarball against the FILES.json of the source collection.
+
+The tarball is decompressed once as a stream and its headers are parsed directly (tarfile spends
+most of its time in per-member bookkeeping on collections with tens of thousands of files); member
+contents are handed to a thread pool for sha256 hashing (hashlib and zlib release the GIL on large
+buffers, so hashing overlaps with decompression). FILES.json is
+parsed incrementally, one file entry at a time, with ijson when it is installed and with a chunked
+json.JSONDecoder otherwise, so huge collections never hold the whole document in memory twice.
+
+Usage:
+python tarball_verify.py <tarball> <collection_dir> [--workers N]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from build_ignore import matching_pattern
+
+READ_SIZE = 64 * 1024
+# Members up to this size are hashed in the pool, bigger ones are hashed in chunks while reading
+POOL_MEMBER_SIZE = 8 * 1024 * 1024
+# Upper bound of member bytes waiting in the pool
+MAX_PENDING_BYTES = 64 * 1024 * 1024
+
+# Files of the tarball that are not listed in FILES.json
+METADATA_FILES = ("MANIFEST.json", "FILES.json")
+
+FILES_KEY_RE = re.compile(r'"files"\s*:\s*\[')
+
+BLOCK_SIZE = 512
+# Tar member types: regular files, directories and the headers that carry the name of the next member
+FILE_TYPES = (b"0", b"\0", b"7")
+DIR_TYPE = b"5"
+LONG_NAME_TYPES = (b"x", b"L")
+GLOBAL_HEADER_TYPE = b"g"
+
+
+class _StreamReader:
+    """
+    Reads a gzip file as one decompressed stream in large chunks.
+    """
+
+    def __init__(self, f: Any) -> None:
+        self._f = f
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self._buffer = bytearray()
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size: int) -> None:
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        while len(self._buffer) < size and not self._eof:
+            raw = self._f.read(READ_SIZE * 16)
+            try:
+                if raw:
+                    self._buffer += self._decompressor.decompress(raw)
+                else:
+                    self._buffer += self._decompressor.flush()
+                    self._eof = True
+            except zlib.error as e:
+                raise ValueError(f"invalid gzip stream: {e}")
+
+    def read(self, size: int) -> bytes:
+        if len(self._buffer) - self._pos < size:
+            self._fill(size)
+        data = bytes(self._buffer[self._pos:self._pos + size])
+        self._pos += len(data)
+        return data
+
+
+def _nts(field: bytes) -> str:
+    return field.split(b"\0", 1)[0].decode('utf-8', 'surrogateescape')
+
+
+def _size(field: bytes) -> int:
+    if field[0] & 0x80:
+        # base-256 encoding of big members
+        return int.from_bytes(field[1:], 'big')
+    field = field.strip(b"\0 ")
+    return int(field, 8) if field else 0
+
+
+def _pax_path(data: bytes) -> Optional[str]:
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        length = int(data[pos:space])
+        key, _, value = data[space + 1:pos + length - 1].partition(b"=")
+        if key == b"path":
+            return value.decode('utf-8', 'surrogateescape')
+        pos += length
+    return None
+
+
+def iter_tar_gz(tarball: str) -> Iterator[Tuple[str, str, Union[bytes, Iterator[bytes]]]]:
+    """
+    Iterates the members of a .tar.gz in one pass.
+
+    :param tarball: Path to the tarball.
+    :return: An iterator of (name, kind, data) with kind "file", "dir" or "other". The data of a file
+             is its content, or an iterator of chunks for members bigger than POOL_MEMBER_SIZE that has to
+             be consumed before the next member; other members have empty data.
+    :raises ValueError: When the stream is not a valid tar archive.
+    """
+    with open(tarball, 'rb') as f:
+        reader = _StreamReader(f)
+        long_name = None
+
+        while True:
+            header = reader.read(BLOCK_SIZE)
+            if len(header) < BLOCK_SIZE or not header.strip(b"\0"):
+                return
+            try:
+                size = _size(header[124:136])
+            except ValueError:
+                raise ValueError(f"{tarball}: invalid tar header")
+            typeflag = header[156:157]
+            padded = -(-size // BLOCK_SIZE) * BLOCK_SIZE
+
+            if typeflag in LONG_NAME_TYPES or typeflag == GLOBAL_HEADER_TYPE:
+                data = reader.read(padded)[:size]
+                if typeflag == b"L":
+                    long_name = _nts(data)
+                elif typeflag == b"x":
+                    long_name = _pax_path(data) or long_name
+                continue
+
+            name = long_name
+            if name is None:
+                prefix = _nts(header[345:500])
+                name = f"{prefix}/{_nts(header[:100])}" if prefix else _nts(header[:100])
+            long_name = None
+            name = name[2:] if name.startswith("./") else name
+
+            if typeflag not in FILE_TYPES:
+                reader.read(padded)
+                yield name.rstrip("/"), "dir" if typeflag == DIR_TYPE else "other", b""
+                continue
+
+            if size <= POOL_MEMBER_SIZE:
+                yield name, "file", reader.read(padded)[:size]
+                continue
+
+            remaining = [size]
+
+            def chunks() -> Iterator[bytes]:
+                while remaining[0]:
+                    chunk = reader.read(min(READ_SIZE, remaining[0]))
+                    if not chunk:
+                        raise ValueError(f"{tarball}: truncated member {name}")
+                    remaining[0] -= len(chunk)
+                    yield chunk
+
+            yield name, "file", chunks()
+            for _ in chunks():
+                pass
+            reader.read(padded - size)
+
+
+def _iter_files_json_fallback(f: Any) -> Iterator[Dict[str, Any]]:
+    decoder = json.JSONDecoder()
+    buffer = ""
+
+    def fill() -> bool:
+        nonlocal buffer
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            return False
+        buffer += chunk
+        return True
+
+    # Only a key is followed by ":", so a file named "files" cannot be mistaken for the array
+    while True:
+        match = FILES_KEY_RE.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        if not fill():
+            raise ValueError("FILES.json has no files list")
+        buffer = buffer[-64:] if len(buffer) > 64 * 1024 else buffer
+
+    # Decode one entry at a time and only compact the buffer when it has to be refilled
+    pos = 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            buffer, pos = "", 0
+            if not fill():
+                raise ValueError("FILES.json is truncated")
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            entry, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            buffer, pos = buffer[pos:], 0
+            if not fill():
+                raise ValueError("FILES.json is truncated or invalid")
+            continue
+        yield entry
+
+
+def iter_files_json(files_json: str) -> Iterator[Dict[str, Any]]:
+    """
+    Iterates the entries of FILES.json without loading the document at once.
+
+    :param files_json: Path to FILES.json.
+    :return: An iterator over the dicts of the "files" list.
+    """
+    if ijson is not None:
+        with open(files_json, 'rb') as f:
+            yield from ijson.items(f, "files.item")
+        return
+
+    with open(files_json, 'r', encoding='utf-8') as f:
+        yield from _iter_files_json_fallback(f)
+
+
+def load_expected(files_json: str, build_ignore: Iterable[str] = ()) -> Dict[str, Optional[str]]:
+    """
+    :param files_json: Path to FILES.json.
+    :param build_ignore: build_ignore patterns of the build; matching entries are not expected.
+    :return: A member name to sha256 mapping, directories map to None.
+    """
+    build_ignore = list(build_ignore)
+    expected = {}
+    for entry in iter_files_json(files_json):
+        if entry.get("name") in (None, "."):
+            continue
+        if build_ignore and matching_pattern(entry["name"], build_ignore) is not None:
+            continue
+        expected[entry["name"]] = entry.get("chksum_sha256") if entry.get("ftype") == "file" else None
+    return expected
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def verify_tarball(tarball: str, files_json: str, workers: int = 4, build_ignore: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Checks that a tarball contains exactly the files of FILES.json with the listed checksums.
+
+    :param tarball: Path to the collection tarball (.tar.gz).
+    :param files_json: Path to the FILES.json of the source collection.
+    :param workers: Number of hashing threads.
+    :param build_ignore: build_ignore patterns the tarball was built with.
+    :return: A dict with ok, the number of checked files and the sorted mismatched, missing and extra names.
+    """
+    expected = load_expected(files_json, build_ignore)
+    seen = set()
+    report = {"tarball": tarball, "ok": False, "checked": 0, "mismatched": [], "missing": [], "extra": []}
+
+    def check(name: str, digest: str) -> None:
+        report["checked"] += 1
+        if digest != expected[name]:
+            report["mismatched"].append(name)
+
+    pending = deque()  # (name, future, size)
+    pending_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for name, kind, data in iter_tar_gz(tarball):
+            if name in METADATA_FILES or name in (".", ""):
+                continue
+            if name not in expected:
+                report["extra"].append(name)
+                continue
+            seen.add(name)
+
+            if kind != "file" or expected[name] is None:
+                # Directories carry no checksum; links are checked when their target is checked
+                if kind == "file" and expected[name] is None:
+                    report["mismatched"].append(name)
+                continue
+
+            if not isinstance(data, bytes):
+                digest = hashlib.sha256()
+                for chunk in data:
+                    digest.update(chunk)
+                check(name, digest.hexdigest())
+                continue
+
+            pending.append((name, executor.submit(_sha256, data), len(data)))
+            pending_bytes += len(data)
+            while pending_bytes > MAX_PENDING_BYTES:
+                done_name, future, size = pending.popleft()
+                check(done_name, future.result())
+                pending_bytes -= size
+
+        for done_name, future, _ in pending:
+            check(done_name, future.result())
+
+    report["missing"] = sorted(set(expected) - seen)
+    report["mismatched"].sort()
+    report["extra"].sort()
+    report["ok"] = not (report["missing"] or report["mismatched"] or report["extra"])
+    return report
+
+
+def verify_collection_tarball(tarball: str, collection_dir: str, workers: int = 4,
+                              build_ignore: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Verifies a tarball against the installed collection it was built from.
+
+    :param tarball: Path to the collection tarball.
+    :param collection_dir: Path to the installed collection.
+    :param workers: Number of hashing threads.
+    :param build_ignore: build_ignore patterns the tarball was built with.
+    :return: The report of verify_tarball.
+    """
+    return verify_tarball(tarball, os.path.join(collection_dir, 'FILES.json'), workers, build_ignore)
+
+
+def format_report(report: Dict[str, Any], limit: int = 10) -> str:
+    """
+    :param report: A report of verify_tarball.
+    :param limit: Maximum number of names listed per problem.
+    :return: A one-line description of the problems, empty when the tarball is ok.
+    """
+    problems = []
+    for key in ("mismatched", "missing", "extra"):
+        names = report[key]
+        if names:
+            listed = ", ".join(names[:limit]) + (f" and {len(names) - limit} more" if len(names) > limit else "")
+            problems.append(f"{key}: {listed}")
+    return "; ".join(problems)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Verify a collection tarball against FILES.json checksums.")
+    parser.add_argument("tarball", help="Path to the collection tarball")
+    parser.add_argument("collection_dir", help="Path to the installed collection with FILES.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of hashing threads (default: CPU count)")
+    args = parser.parse_args()
+
+    report = verify_collection_tarball(args.tarball, args.collection_dir, args.workers)
+    if report["ok"]:
+        print(f"{args.tarball}: {report['checked']} files verified")
+        return
+    print(f"{args.tarball}: {format_report(report)}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Publish, import polling and mirror runs against the local Galaxy stand-in of the benchmarks.
+"""
+
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, os.pardir, "scripts"))
+sys.path.insert(0, os.path.join(TESTS_DIR, os.pardir, "benchmarks"))
+
+import galaxy_mirror  # noqa: E402
+from exports_collections import publish_collection_native  # noqa: E402
+from galaxy_client import EXISTS, MISSING_NAMESPACE, PUBLISHED, GalaxyClient  # noqa: E402
+from galaxy_imports import ImportPoller  # noqa: E402
+from galaxy_standin import start_standin  # noqa: E402
+
+
+def make_tarball(directory, namespace, name, version, payload=b""):
+    """
+    Writes a minimal <namespace>-<name>-<version>.tar.gz collection tarball.
+    """
+    path = os.path.join(str(directory), f"{namespace}-{name}-{version}.tar.gz")
+    manifest = {"collection_info": {"namespace": namespace, "name": name, "version": version}}
+    members = {"MANIFEST.json": json.dumps(manifest).encode(), "FILES.json": b'{"files": []}',
+               "plugins/modules/payload.py": payload}
+    with tarfile.open(path, "w:gz") as tar:
+        for member, data in members.items():
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+@pytest.fixture
+def standin():
+    server = start_standin(missing_namespaces=["ghost"])
+    yield server
+    server.stop()
+
+
+def test_native_publish_statuses(standin, tmp_path):
+    tarball = make_tarball(tmp_path, "acme", "tools", "1.0.0")
+    first = publish_collection_native(tarball, standin.url, token="token")
+    again = publish_collection_native(tarball, standin.url, token="token")
+    ghost = publish_collection_native(make_tarball(tmp_path, "ghost", "tools", "1.0.0"), standin.url, token="token")
+
+    assert first["status"] == PUBLISHED
+    assert again["status"] == EXISTS
+    assert "already exists" in again["message"]
+    assert ghost["status"] == MISSING_NAMESPACE
+    assert "acme-tools-1.0.0.tar.gz" in standin.artifacts
+    assert "ghost-tools-1.0.0.tar.gz" not in standin.artifacts
+
+
+def test_import_poller_waits_for_slow_imports(tmp_path):
+    server = start_standin(import_seconds=0.6)
+    try:
+        client = GalaxyClient(server.url)
+        poller = ImportPoller(client, workers=2, timeout=10, min_interval=0.1)
+        started = time.monotonic()
+        for name in ("alpha", "beta"):
+            upload = client.upload(make_tarball(tmp_path, "acme", name, "1.0.0"))
+            assert upload["status"] == PUBLISHED
+            poller.add(name, upload["task"])
+        results = poller.wait()
+        waited = time.monotonic() - started
+    finally:
+        server.stop()
+
+    # The poller counts from add(), after the upload returned, so only the whole wait covers import_seconds
+    assert waited >= 0.6
+    assert sorted(results) == ["alpha", "beta"]
+    for result in results.values():
+        assert result["status"] == PUBLISHED
+        assert result["state"] == "completed"
+        assert 0 < result["seconds"] <= waited
+        assert result["polls"] >= 2
+
+
+def test_import_poller_times_out(tmp_path):
+    server = start_standin(import_seconds=5)
+    try:
+        client = GalaxyClient(server.url)
+        poller = ImportPoller(client, timeout=0.3, min_interval=0.1)
+        upload = client.upload(make_tarball(tmp_path, "acme", "slow", "1.0.0"))
+        poller.add("slow", upload["task"])
+        result = poller.wait()["slow"]
+    finally:
+        server.stop()
+
+    assert result["state"] == "timeout"
+    assert result["status"] == "error"
+    assert "did not finish" in result["message"]
+
+
+def test_mirror_resumes_dropped_download(tmp_path):
+    tarball = make_tarball(tmp_path, "acme", "small", "1.0.0", payload=os.urandom(32 * 1024))
+    server = start_standin(artifacts=[tarball], drop_downloads_after=10000)
+    try:
+        client = GalaxyClient(server.url)
+        jobs, errors = galaxy_mirror.resolve_specs(client, [galaxy_mirror.parse_spec("acme.small")])
+        results = galaxy_mirror.mirror(client, jobs, str(tmp_path / "ansible_collections"),
+                                       str(tmp_path / "downloads"), retries=3)
+        stats = dict(server.stats)
+    finally:
+        server.stop()
+
+    assert not errors
+    assert [result["status"] for result in results] == [galaxy_mirror.MIRRORED]
+    assert results[0]["resumed"]
+    assert stats["range_requests"] >= 1
+
+    with open(tarball, 'rb') as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    assert jobs[0]["sha256"] == expected
+    with open(tmp_path / "downloads" / "acme-small-1.0.0.tar.gz", 'rb') as f:
+        assert hashlib.sha256(f.read()).hexdigest() == expected
+    assert os.path.isfile(tmp_path / "ansible_collections" / "acme" / "small" / "plugins" / "modules" / "payload.py")